@@ -4,23 +4,156 @@ from __future__ import print_function
 import argparse
 from qsub import *
 import sys
+import bisect
 import gzip
+from genomic_intervals import merge_intervals
+from vcf_io import open_vcf, write_vcf
 
 
-def in_region(reg_start, reg_end, set_name):
-    for x in range(reg_start, reg_end):
-        if x not in set_name:
+def in_region(reg_start, reg_end, intervals):
+
+    """
+    checks if every base of a 0-based half open region falls in one of a set of sorted, merged
+    half open intervals, false for contigs without intervals
+    :param reg_start: int
+    :param reg_end: int
+    :param intervals: tuple
+    :return: bool
+    """
+
+    if intervals is None:
+        return False
+
+    starts, ends = intervals
+    i = bisect.bisect_right(starts, reg_start) - 1
+
+    return i >= 0 and reg_end <= ends[i]
+
+
+def read_repeats(bed):
+
+    """
+    reads the ancestral repeat coordinates of each chromosome from a gzipped bed as sorted, merged intervals,
+    as lists for bisection
+    :param bed: str
+    :return: dict
+    """
+
+    rep_coords = {}
+    for line in gzip.open(bed):
+        chromo, start, end = line.split('\t')[:3]
+        if chromo not in rep_coords:
+            rep_coords[chromo] = ([], [])
+        rep_coords[chromo][0].append(int(start))
+        rep_coords[chromo][1].append(int(end))
+
+    rep_dict = {}
+    for chromo, coords in rep_coords.items():
+        starts, ends = merge_intervals(*coords)
+        rep_dict[chromo] = (starts.tolist(), ends.tolist())
+
+    return rep_dict
+
+
+def anc_rep_fields(fields, rep_dict, trim):
+
+    """
+    marks intergenic and intronic records in ancestral repeats in the INFO of a split record,
+    returns False if the record is to be trimmed
+    :param fields: list
+    :param rep_dict: dict
+    :param trim: bool
+    :return: bool
+    """
+
+    vcf_start = int(fields[1])
+    vcf_end = vcf_start + len(fields[3])
+    if in_region(vcf_start-1, vcf_end, rep_dict.get(fields[0])) is False:
+        if trim is True and any('Repeats' in x for x in fields):
             return False
-        else:
-            continue
+    else:
+        if 'ANNO=intergenic' in fields[7]:
+            fields[7] = fields[7].replace('ANNO=intergenic', 'ANNO=intergenic_ar')
+
+        elif 'ANNO=intron' in fields[7]:
+            fields[7] = fields[7].replace('ANNO=intron', 'ANNO=intron_ar')
+
+        elif trim is True:
+            return False
+
     return True
 
 
+def anc_rep_lines(vcf_lines, rep_dict, trim):
+
+    """
+    yields the header and the relabelled records of a vcf that are not trimmed
+    :param vcf_lines: iterable
+    :param rep_dict: dict
+    :param trim: bool
+    :return: generator
+    """
+
+    for line in vcf_lines:
+        if line.startswith('#'):
+            yield line
+            continue
+
+        fields = line.rstrip('\n').split('\t')
+        if anc_rep_fields(fields, rep_dict, trim):
+            yield '\t'.join(fields) + '\n'
+
+
+class AncRepAnnotator(object):
+
+    """
+    relabels intergenic and intronic ANNO values of records in ancestral repeats, for annotate_vcf.py,
+    runs after the ANNO annotation
+    """
+
+    name = 'AR'
+    suffix = '.ar'
+    info_lines = []
+
+    def __init__(self, bed, trim=False):
+
+        """
+        :param bed: str
+        :param trim: bool
+        """
+
+        self.rep_dict = read_repeats(bed)
+        self.trim = trim
+        self.counts = {'intergenic_ar': 0, 'intron_ar': 0, 'trimmed': 0}
+
+    def annotate(self, fields):
+
+        """
+        relabels the ANNO value of a split record, returns False if the record is to be dropped
+        :param fields: list
+        :return: bool
+        """
+
+        keep = anc_rep_fields(fields, self.rep_dict, self.trim)
+        if not keep:
+            self.counts['trimmed'] += 1
+        elif 'ANNO=intergenic_ar' in fields[7]:
+            self.counts['intergenic_ar'] += 1
+        elif 'ANNO=intron_ar' in fields[7]:
+            self.counts['intron_ar'] += 1
+
+        return keep
+
+    def summary(self):
+        return '\n'.join('{}\t{}'.format(x, self.counts[x]) for x in ['intergenic_ar', 'intron_ar', 'trimmed'])
+
+
 def main():
     # arguments
     parser = argparse.ArgumentParser()
     parser.add_argument('-bed', help='bed file containing ancestral repeats coordinates', required=True)
-    parser.add_argument('-vcf', help='vcf file to annotate', required=True)
+    parser.add_argument('-vcf', help='vcf file to annotate, if bgzipped the output is bgzipped and tabix indexed',
+                        required=True)
     parser.add_argument('-trim_non_anc_reps',
                         help='If specified will remove variants that are in non ancestral repeats',
                         action='store_true', default=False)
@@ -40,42 +173,12 @@ def main():
     trim = args.trim_non_anc_reps
 
     # repeats dictionary
-    rep_dict = {}
-    for line in gzip.open(bed):
-        chromo, start, end = line.split('\t')[0], int(line.split('\t')[1]), int(line.split('\t')[2])
-        if chromo not in rep_dict.keys():
-            rep_dict[chromo] = range(start, end)
-        else:
-            rep_dict[chromo] += range(start, end)
-    rep_dict = {x[0]: set(x[1]) for x in rep_dict.items()}
-
-    # adjust anno in vcf
-    with open(anno_vcf, 'w') as out_vcf:
-        for line in open(vcf):
-            line = line.rstrip('\n')
-            if line.startswith('#'):
-                print(line, file=out_vcf)
-            else:
-                vcf_chromo, vcf_start, vcf_var_len = line.split('\t')[0], int(line.split('\t')[1]), \
-                                                     len(line.split('\t')[3])
-                vcf_end = vcf_start + vcf_var_len
-                if in_region(vcf_start-1, vcf_end, rep_dict[vcf_chromo]) is False:
-                    if trim is True and 'Repeats' in line:
-                        continue
-                    print(line, file=out_vcf)
-                else:
-                    if 'ANNO=intergenic' in line:
-                        line = line.replace('ANNO=intergenic', 'ANNO=intergenic_ar')
-                        print(line, file=out_vcf)
-
-                    elif 'ANNO=intron' in line:
-                        line = line.replace('ANNO=intron', 'ANNO=intron_ar')
-                        print(line, file=out_vcf)
-
-                    else:
-                        if trim is True:
-                            continue
-                        print(line, file=out_vcf)
+    rep_dict = read_repeats(bed)
+
+    # adjust anno in vcf, a bgzipped vcf is streamed to bgzipped output
+    vcf_lines = open_vcf(vcf)
+    write_vcf(anc_rep_lines(vcf_lines, rep_dict, trim), anno_vcf)
+    vcf_lines.close()
 
 if __name__ == '__main__':
     main()
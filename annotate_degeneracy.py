@@ -3,6 +3,8 @@
 from __future__ import print_function
 import argparse
 import gzip
+import sys
+from degen_to_bed import DegeneracyTrack
 
 
 def bed_to_region_dict(bed):
@@ -19,18 +21,144 @@ def bed_to_region_dict(bed):
     return coord_dict
 
 
+def snp_degeneracy(chromo, snp_pos, zerofold_sites, fourfold_sites):
+
+    """
+    returns the degeneracy of a 1-based position, 0 or 4, None if it is neither or its chromosome
+    is missing from the bed files
+    :param chromo: str
+    :param snp_pos: int
+    :param zerofold_sites: dict
+    :param fourfold_sites: dict
+    :return: int
+    """
+
+    # sets line unchanged if chromo doesn't appear in bed files
+    if chromo not in zerofold_sites.keys():
+        return None
+
+    # if snp is zerofold
+    elif snp_pos in zerofold_sites[chromo]:
+        return 0
+
+    # if snp is fourfold
+    elif snp_pos in fourfold_sites[chromo]:
+        return 4
+
+    # if snp is neither
+    else:
+        return None
+
+
+def track_snp_degeneracy(chromo, snp_pos, degen_track):
+
+    """
+    returns the degeneracy of a 1-based position from a per base degeneracy track, 0 or 4,
+    None if it is neither, its transcripts disagree or it is non coding
+    :param chromo: str
+    :param snp_pos: int
+    :param degen_track: DegeneracyTrack
+    :return: int
+    """
+
+    degen = degen_track.site_degeneracy(chromo, snp_pos - 1)
+    if degen == 0 or degen == 4:
+        return degen
+
+    return None
+
+
+def degen_summary(zero_count, four_count):
+
+    """
+    returns the summary table of the degeneracy counts
+    :param zero_count: int
+    :param four_count: int
+    :return: str
+    """
+
+    return ('\n'
+            '|Category          | Number SNPs     |\n'
+            '|:-----------------|:---------------:|\n'
+            '|zerofold          |{:<17}|\n'
+            '|fourfold          |{:<17}|').format(zero_count, four_count)
+
+
+class DegeneracyAnnotator(object):
+
+    """
+    DEGEN annotation of zerofold and fourfold SNPs, for annotate_vcf.py
+    """
+
+    name = 'DEGEN'
+    suffix = '.degen'
+    info_lines = ['##INFO=<ID=DEGEN,Number=1,Type=Integer,Description="Annotation of SNP degeneracy">']
+
+    def __init__(self, zerofold=None, fourfold=None, degen_track=None):
+
+        """
+        sites are looked up in the degeneracy track if given and in the zerofold and fourfold beds otherwise
+        :param zerofold: str
+        :param fourfold: str
+        :param degen_track: str
+        """
+
+        if degen_track is not None:
+            self.degen_track = DegeneracyTrack(degen_track)
+        else:
+            self.degen_track = None
+            self.zerofold_sites = bed_to_region_dict(zerofold)
+            self.fourfold_sites = bed_to_region_dict(fourfold)
+        self.counts = {0: 0, 4: 0}
+
+    def site_degeneracy(self, chromo, snp_pos):
+
+        """
+        returns the degeneracy of a 1-based position, 0 or 4, None if it is neither
+        :param chromo: str
+        :param snp_pos: int
+        :return: int
+        """
+
+        if self.degen_track is not None:
+            return track_snp_degeneracy(chromo, snp_pos, self.degen_track)
+        else:
+            return snp_degeneracy(chromo, snp_pos, self.zerofold_sites, self.fourfold_sites)
+
+    def annotate(self, fields):
+
+        """
+        adds the degeneracy to the INFO of a split record, returns False if the record is to be dropped
+        :param fields: list
+        :return: bool
+        """
+
+        degen = self.site_degeneracy(fields[0], int(fields[1]))
+        if degen is not None:
+            self.counts[degen] += 1
+            fields[7] += ';DEGEN=' + str(degen)
+
+        return True
+
+    def summary(self):
+        return degen_summary(self.counts[0], self.counts[4])
+
+
 def main():
     # arguments
     parser = argparse.ArgumentParser()
     parser.add_argument('-vcf', help='VCF file to annotate variants in', required=True)
-    parser.add_argument('-zerofold', help='bed file of zerofold sites', required=True)
-    parser.add_argument('-fourfold', help='bed file of fourfold sites', required=True)
+    parser.add_argument('-zerofold', help='bed file of zerofold sites', default=None)
+    parser.add_argument('-fourfold', help='bed file of fourfold sites', default=None)
+    parser.add_argument('-degen_track', help='Degeneracy track directory from degen_to_bed.py -track_dir, '
+                                             'used in place of -zerofold and -fourfold', default=None)
     args = parser.parse_args()
 
     # variables
     vcf = args.vcf
-    zerofold_sites = bed_to_region_dict(args.zerofold)
-    fourfold_sites = bed_to_region_dict(args.fourfold)
+    if args.degen_track is None and (args.zerofold is None or args.fourfold is None):
+        sys.exit('either -degen_track or both -zerofold and -fourfold must be specified')
+    degen_sites = DegeneracyAnnotator(args.zerofold, args.fourfold, args.degen_track)
     annotated_vcf = vcf.replace('.vcf', '.degen.vcf')
 
     # loop through vcf
@@ -48,37 +176,21 @@ def main():
                 print(line.rstrip(), file=out_vcf)
             else:
                 split_line = line.rstrip().split('\t')
-                chromo = split_line[0]
-                snp_pos = int(split_line[1])
+                degen = degen_sites.site_degeneracy(split_line[0], int(split_line[1]))
 
-                # sets line unchanged if chromo doesn't appear in bed files
-                if chromo not in zerofold_sites.keys():
+                if degen is None:
                     out_line = line.rstrip()
-
-                # if snp is zerofold sets new line
-                elif snp_pos in zerofold_sites[chromo]:
-                    out_line = '\t'.join(split_line[0:7] + [split_line[7] + ';DEGEN=0'] + split_line[8:])
-                    zero_count += 1
-
-                # if snp is fourfold sets new line
-                elif snp_pos in fourfold_sites[chromo]:
-                    out_line = '\t'.join(split_line[0:7] + [split_line[7] + ';DEGEN=4'] + split_line[8:])
-                    four_count += 1
-
-                # if snp is neither sets original line
                 else:
-                    out_line = line.rstrip()
+                    out_line = '\t'.join(split_line[0:7] + [split_line[7] + ';DEGEN=' + str(degen)] + split_line[8:])
+                    if degen == 0:
+                        zero_count += 1
+                    else:
+                        four_count += 1
 
                 # outputs line
                 print(out_line, file=out_vcf)
 
-    summary_table = ('\n'
-                     '|Category          | Number SNPs     |\n'
-                     '|:-----------------|:---------------:|\n'
-                     '|zerofold          |{:<17}|\n'
-                     '|fourfold          |{:<17}|').format(zero_count, four_count)
-
-    print(summary_table)
+    print(degen_summary(zero_count, four_count))
 
 if __name__ == '__main__':
     main()
@@ -1,19 +1,51 @@
 #!/usr/bin/env python
 
 import argparse
-import gzip
-import subprocess
+import numpy
+from gff_index import GFFIndex
+from codons import degeneracy
 
+BATCH_SIZE = 100000
+
+
+def cds_index(gff, chromo):
+
+    """
+    reads the CDS records of a chromosome from the compiled gff, ordered by start with ties in file order,
+    as arrays of their 1-based start and end with the running maximum of the ends, and a list of the records
+    :param gff: str
+    :param chromo: str
+    :return: dict
+    """
+
+    cds = GFFIndex(gff).features(chromo, 'CDS')
+    starts = numpy.array(cds['starts'], dtype=numpy.int64)
+    ends = numpy.array(cds['ends'], dtype=numpy.int64)
+    records = [(chromo, x[0], x[1], x[2], x[3]) for x in
+               zip(starts.tolist(), ends.tolist(), cds['strands'].tolist(), cds['frames'].tolist())]
+
+    return {'starts': starts + 1, 'max_ends': numpy.maximum.accumulate(ends), 'records': records}
 
-def snp_cds(gff, chromo, snp_position):
-    grep = 'tabix {} {}:{}-{} | grep CDS'.format(gff, chromo, snp_position, snp_position+1)
-    cds_record = subprocess.Popen(grep, shell=True, stdout=subprocess.PIPE).communicate()[0].split('\n')[:-1]
-    cds_record = [x for x in cds_record if x.split('\t')[2] == 'CDS']
-    if len(cds_record) == 0:
-        return False
-    else:
-        gff_record = cds_record[0].split('\t')
-        return gff_record[0], int(gff_record[3])-1, int(gff_record[4]), gff_record[6], int(gff_record[7])
+
+def snp_cds(cds_coords, snp_positions):
+
+    """
+    returns the index of the first CDS record in file order that the tabix region chr:pos-pos+1 of
+    each 0-based snp position overlaps, ie with start <= pos+1 and end >= pos, or -1 where there is none
+    :param cds_coords: dict
+    :param snp_positions: numpy.array
+    :return: numpy.array
+    """
+
+    snp_positions = numpy.asarray(snp_positions, dtype=numpy.int64)
+    if len(cds_coords['starts']) == 0:
+        return numpy.full(len(snp_positions), -1, dtype=numpy.int64)
+
+    # records are sorted by start, the first whose end reaches pos is the first to overlap if it starts in range
+    first = numpy.searchsorted(cds_coords['max_ends'], snp_positions, side='left')
+    last = numpy.searchsorted(cds_coords['starts'], snp_positions + 1, side='right')
+
+    return numpy.where(first < last, first, -1)
 
 
 def reverse_comp(sequence):
@@ -25,64 +57,99 @@ def reverse_comp(sequence):
     return sequence_rev
 
 
-def snp_codon(snp_position, cds_record, reference):
+def cds_sequence(cds_record, reference):
+
+    """
+    returns the coding sequence of a CDS record from its frame offset, reverse complemented on the minus strand
+    :param cds_record: tuple
+    :param reference: str
+    :return: str
+    """
+
     if cds_record[3] == '+':
-        cds_seq = reference[cds_record[1]+cds_record[4]:cds_record[2]]
-        snp_block_pos = snp_position - cds_record[1] - cds_record[4]
+        return reference[cds_record[1]+cds_record[4]:cds_record[2]]
+    else:
+        return reverse_comp(reference[cds_record[1]:cds_record[2]-cds_record[4]])
+
+
+def snp_codon(snp_position, cds_record, cds_seq):
+
+    """
+    returns the codon holding a snp and the snp position in it, None if the snp falls outside the coding sequence
+    :param snp_position: int
+    :param cds_record: tuple
+    :param cds_seq: str
+    :return: tuple
+    """
 
+    if cds_record[3] == '+':
+        snp_block_pos = snp_position - cds_record[1] - cds_record[4]
     else:
-        cds_seq = reverse_comp(reference[cds_record[1]:cds_record[2]-cds_record[4]])
         snp_block_pos = cds_record[2]-1 - snp_position - cds_record[4]
 
-    for i in range(0, len(cds_seq), 3):
-        if i <= snp_block_pos < i+3:
-            codon = cds_seq[i:i+3]
-            snp_codon_pos = snp_block_pos - i
-            return codon, snp_codon_pos
-
-
-def degeneracy(codon):
-
-    # codon table
-    standard_codon_table = {
-        "TTT": "F", "CTT": "L", "ATT": "I", "GTT": "V",
-        "TTC": "F", "CTC": "L", "ATC": "I", "GTC": "V",
-        "TTA": "L", "CTA": "L", "ATA": "I", "GTA": "V",
-        "TTG": "L", "CTG": "L", "ATG": "M", "GTG": "V",
-
-        "TCT": "S", "CCT": "P", "ACT": "T", "GCT": "A",
-        "TCC": "S", "CCC": "P", "ACC": "T", "GCC": "A",
-        "TCA": "S", "CCA": "P", "ACA": "T", "GCA": "A",
-        "TCG": "S", "CCG": "P", "ACG": "T", "GCG": "A",
-
-        "TAT": "Y", "CAT": "H", "AAT": "N", "GAT": "D",
-        "TAC": "Y", "CAC": "H", "AAC": "N", "GAC": "D",
-        "TAA": "*", "CAA": "Q", "AAA": "K", "GAA": "E",
-        "TAG": "*", "CAG": "Q", "AAG": "K", "GAG": "E",
-
-        "TGT": "C", "CGT": "R", "AGT": "S", "GGT": "G",
-        "TGC": "C", "CGC": "R", "AGC": "S", "GGC": "G",
-        "TGA": "*", "CGA": "R", "AGA": "R", "GGA": "G",
-        "TGG": "W", "CGG": "R", "AGG": "R", "GGG": "G",
-    }
-
-    ref_codon = codon[0].upper()
-    snp_site = codon[1]
-    ref_amino_acid = standard_codon_table[ref_codon]
-    degen = 0
-    for bp in ['A', 'T', 'C', 'G']:
-        if snp_site == 0:
-            alt_codon = bp + ref_codon[1:]
-        elif snp_site == 1:
-            alt_codon = ref_codon[0] + bp + ref_codon[2]
-        else:
-            alt_codon = ref_codon[0:2] + bp
-        alt_amino_acid = standard_codon_table[alt_codon]
-        if alt_amino_acid == ref_amino_acid:
-            degen += 1
-    if degen == 1:
-        degen = 0
-    return degen
+    i = snp_block_pos - snp_block_pos % 3
+    if snp_block_pos < 0 or i >= len(cds_seq):
+        return None
+
+    return cds_seq[i:i+3], snp_block_pos - i
+
+
+def annotate_batch(lines, cds_coords, reference_sequence, cds_seqs, counts, degen_counter):
+
+    """
+    returns a batch of vcf lines of one chromosome with the degeneracy of CDS_non_frameshift SNPs in CDS added,
+    adding to the counters, the coding sequence of each CDS record is kept in cds_seqs once read
+    :param lines: list
+    :param cds_coords: dict
+    :param reference_sequence: str
+    :param cds_seqs: dict
+    :param counts: dict
+    :param degen_counter: dict
+    :return: list
+    """
+
+    split_lines = [line.split('\t') for line in lines]
+    snp_positions = numpy.array([int(x[1])-1 for x in split_lines], dtype=numpy.int64)
+    cds_rows = snp_cds(cds_coords, snp_positions)
+
+    out_lines = []
+    for line, split_line, snp_pos, cds_row in zip(lines, split_lines, snp_positions.tolist(), cds_rows.tolist()):
+        counts['all'] += 1
+        if cds_row == -1 or split_line[7].find('ANNO=CDS_non_frameshift') == -1:
+            # write unnanotated line
+            out_lines.append(line)
+            continue
+
+        counts['cds'] += 1
+        ref_allele = split_line[3].upper()
+        snp_cds_coords = cds_coords['records'][cds_row]
+        if cds_row not in cds_seqs:
+            cds_seqs[cds_row] = cds_sequence(snp_cds_coords, reference_sequence)
+        snp_containing_codon = snp_codon(snp_pos, snp_cds_coords, cds_seqs[cds_row])
+
+        # catches instance where snp is in cds coords but due to gff 'frame' offset is not in exon
+        if snp_containing_codon is None or snp_containing_codon[1] >= len(snp_containing_codon[0]) or \
+                snp_containing_codon[0][snp_containing_codon[1]] != \
+                (ref_allele if snp_cds_coords[3] == '+' else reverse_comp(ref_allele)):
+            # write unannotated line
+            out_lines.append(line)
+            continue
+
+        # catch out of frame cds
+        if len(snp_containing_codon[0]) != 3:
+            # write unnanotated line
+            out_lines.append(line)
+            continue
+
+        codon_degeneracy = degeneracy(snp_containing_codon)
+        degen_counter[codon_degeneracy] += 1
+
+        # write newly annotated line
+        anno_line = ('\t'.join(split_line[0:7]) + '\t' + split_line[7] +
+                     ';DEGEN=' + str(codon_degeneracy) + '\t' + '\t'.join(split_line[8:]))
+        out_lines.append(anno_line)
+
+    return out_lines
 
 
 def main():
@@ -103,15 +170,11 @@ def main():
     chromo = args.chr
     annotated_vcf = open(out_dir + vcf[vcf.rfind('/')+1:].replace('.vcf', '.degen.' + chromo + '.vcf'), 'w')
 
-    # get chromosomal annotation data
-    gff_string = ''
-    for line in gzip.open(gff):
-        gff_chromo = line.split('\t')[0]
-        if chromo == gff_chromo:
-            gff_string += line
+    # get chromosomal cds records
+    cds_coords = cds_index(gff, chromo)
 
     # get chromosomal reference sequence
-    reference_sequence = ''
+    reference_sequence = []
     target = False
     for line in open(ref):
         line = line.rstrip('\n')
@@ -122,13 +185,15 @@ def main():
                 target = False
         else:
             if target is True:
-                reference_sequence += line
+                reference_sequence.append(line)
+    reference_sequence = ''.join(reference_sequence)
 
-    # loop through vcf and identify if each variant is zerofold or not
+    # loop through vcf and identify if each variant is zerofold or not, a batch of records at a time
     previous_line = ''
-    all_variants = 0
-    cds_counter = 0
+    counts = {'all': 0, 'cds': 0}
     degen_counter = {0: 0, 2: 0, 3: 0, 4: 0}
+    cds_seqs = {}
+    batch = []
     for line in open(vcf):
         if line.startswith('#'):
             if line.startswith('##contig') and previous_line.startswith('##INFO'):
@@ -136,59 +201,22 @@ def main():
                 annotated_vcf.write(new_info)
             previous_line = line
             annotated_vcf.write(line)
-        elif line.split('\t')[0] == chromo:
-            all_variants += 1
-            split_line = line.split('\t')
-            ref_allele = split_line[3].upper()
-            snp_pos = int(split_line[1])-1
-            snp_cds_coords = snp_cds(gff, chromo, snp_pos)
-            if snp_cds_coords is not False and split_line[7].find('ANNO=CDS_non_frameshift') != -1:
-                cds_counter += 1
-                snp_containing_codon = snp_codon(snp_pos, snp_cds_coords, reference_sequence)
-                if snp_cds_coords[3] == '+':
-                    try:
-                        assert snp_containing_codon[0][snp_containing_codon[1]] == ref_allele
-
-                    # catches instance where snp is in cds coords but due to gff 'frame' offset is not in exon
-                    except (TypeError, AssertionError, IndexError):
-                        # write unannotated line
-                        annotated_vcf.write(line)
-                        continue
-                else:
-                    try:
-                        assert snp_containing_codon[0][snp_containing_codon[1]] == reverse_comp(ref_allele)
-
-                    # catches instance where snp is in cds coords but due to gff 'frame' offset is not in exon
-                    except (TypeError, AssertionError, IndexError):
-                        # write unannotated line
-                        annotated_vcf.write(line)
-                        continue
-
-                # catch out of frame cds
-                if len(snp_containing_codon[0]) != 3:
-                    # write unnanotated line
-                    annotated_vcf.write(line)
-                    continue
-
-                codon_degeneracy = degeneracy(snp_containing_codon)
-                degen_counter[codon_degeneracy] += 1
-
-                # write newly annotated line
-                anno_line = ('\t'.join(split_line[0:7]) + '\t' + split_line[7] +
-                             ';DEGEN=' + str(codon_degeneracy) + '\t' + '\t'.join(split_line[8:]))
-                annotated_vcf.write(anno_line)
-
-            else:
-                # write unnanotated line
-                annotated_vcf.write(line)
+        elif line.split('\t', 1)[0] == chromo:
+            batch.append(line)
+            if len(batch) == BATCH_SIZE:
+                annotated_vcf.write(''.join(annotate_batch(batch, cds_coords, reference_sequence, cds_seqs,
+                                                           counts, degen_counter)))
+                batch = []
+    annotated_vcf.write(''.join(annotate_batch(batch, cds_coords, reference_sequence, cds_seqs,
+                                               counts, degen_counter)))
 
     annotated_vcf.close()
 
     print('\n'
           '|Category          | Number SNPs     |\n'
           '|:-----------------|:---------------:|\n'
-          '|All               | ' + str(all_variants) + ' |\n'
-          '|CDS               | ' + str(cds_counter) + ' |')
+          '|All               | ' + str(counts['all']) + ' |\n'
+          '|CDS               | ' + str(counts['cds']) + ' |')
 
     for z in degen_counter.keys():
         print'|' + str(z) + 'fold             | ' + str(degen_counter[z]) + ' |'
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import argparse
+from qsub import *
+import sys
+import time
+from vcf_io import add_info_lines, open_vcf, write_vcf
+from polarise_vcf import Polariser
+from vcf_region_annotater import RegionAnnotator
+from annotate_anc_reps import AncRepAnnotator
+from annotate_degeneracy import DegeneracyAnnotator
+
+
+def annotate_records(vcf_lines, annotators, timings):
+
+    """
+    applies each annotator in turn to every record, yielding the annotated lines of records none of
+    the annotators drop, the header is yielded first with the INFO lines of all annotators merged into it
+    :param vcf_lines: iterable
+    :param annotators: list
+    :param timings: dict
+    :return: generator
+    """
+
+    header = []
+    info_lines = [x for annotator in annotators for x in annotator.info_lines]
+    for line in vcf_lines:
+        if line.startswith('#'):
+            header.append(line)
+            continue
+        if len(header):
+            yield ''.join(add_info_lines(header, info_lines))
+            header = []
+
+        fields = line.rstrip('\n').split('\t')
+        keep = True
+        for annotator in annotators:
+            start = time.time()
+            keep = annotator.annotate(fields)
+            timings[annotator.name] += time.time() - start
+            if not keep:
+                break
+
+        if keep:
+            yield '\t'.join(fields) + '\n'
+
+    if len(header):
+        yield ''.join(add_info_lines(header, info_lines))
+
+
+def annotate_vcf(vcf_file, annotators, out_vcf):
+
+    """
+    annotates a vcf with all annotators in one pass, a bgzipped vcf is written bgzipped with its tabix index
+    built in the same pass
+    :param vcf_file: str
+    :param annotators: list
+    :param out_vcf: str
+    :return: dict
+    """
+
+    timings = {x.name: 0.0 for x in annotators}
+
+    vcf_lines = open_vcf(vcf_file)
+    write_vcf(annotate_records(vcf_lines, annotators, timings), out_vcf)
+    vcf_lines.close()
+
+    return timings
+
+
+def main():
+
+    # arguments
+    parser = argparse.ArgumentParser(description='Annotates a vcf in a single pass with any of the ancestral allele '
+                                                 '(AA), genomic region (ANNO), ancestral repeat (AR) and degeneracy '
+                                                 '(DEGEN) annotations, applied in that order')
+    parser.add_argument('-vcf', help='VCF file to annotate, if bgzipped the output is bgzipped and tabix indexed',
+                        required=True)
+    parser.add_argument('-wga_bed', help='Tabix indexed whole genome alignment bed file, adds AA', default=None)
+    parser.add_argument('-gff', help='GFF file to read genomic regions from, adds ANNO', default=None)
+    parser.add_argument('--feat_merge_gene_proxy', help='If specified will merge all features to get gene coords,'
+                                                        'only valid if only gene features annotated in gff',
+                        action='store_true', default=False)
+    parser.add_argument('-ar_bed', help='bed file containing ancestral repeats coordinates, relabels ANNO',
+                        default=None)
+    parser.add_argument('-trim_non_anc_reps',
+                        help='If specified will remove variants that are in non ancestral repeats',
+                        action='store_true', default=False)
+    parser.add_argument('-zerofold', help='bed file of zerofold sites, adds DEGEN with -fourfold', default=None)
+    parser.add_argument('-fourfold', help='bed file of fourfold sites, adds DEGEN with -zerofold', default=None)
+    parser.add_argument('-degen_track', help='Degeneracy track directory from degen_to_bed.py -track_dir, '
+                                             'adds DEGEN in place of -zerofold and -fourfold', default=None)
+    parser.add_argument('-sub', help='If specified will submit script to cluster', action='store_true', default=False)
+    parser.add_argument('-evolgen', help='If specified will run on evolgen', default=False, action='store_true')
+    args = parser.parse_args()
+
+    # submission loop
+    if args.sub is True:
+        command_line = [' '.join([x for x in sys.argv if x != '-sub' and x != '-evolgen'])]
+        q_sub(command_line, out=args.vcf.replace('.vcf', '.annotation'), evolgen=args.evolgen)
+        sys.exit()
+
+    if (args.zerofold is None) != (args.fourfold is None):
+        sys.exit('-zerofold and -fourfold must be specified together')
+
+    # annotators in pipeline order
+    annotators = []
+    if args.wga_bed is not None:
+        annotators.append(Polariser(args.wga_bed))
+    if args.gff is not None:
+        annotators.append(RegionAnnotator(args.gff, args.feat_merge_gene_proxy))
+    if args.ar_bed is not None:
+        annotators.append(AncRepAnnotator(args.ar_bed, args.trim_non_anc_reps))
+    if args.degen_track is not None:
+        annotators.append(DegeneracyAnnotator(degen_track=args.degen_track))
+    elif args.zerofold is not None:
+        annotators.append(DegeneracyAnnotator(args.zerofold, args.fourfold))
+    if len(annotators) == 0:
+        sys.exit('no annotations specified')
+
+    out_vcf = args.vcf.replace('.vcf', ''.join([x.suffix for x in annotators]) + '.vcf')
+    timings = annotate_vcf(args.vcf, annotators, out_vcf)
+
+    # counters and time of each annotator
+    for annotator in annotators:
+        print('\n## {} ({:.2f}s)'.format(annotator.name, timings[annotator.name]))
+        print(annotator.summary())
+    print('\n' + out_vcf)
+
+
+if __name__ == '__main__':
+    main()
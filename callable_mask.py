@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import argparse
+import os
+import numpy
+
+# callable site codes, a site's 4 bit value is its index in this string
+CODES = '01kKrR'
+CHUNK_SITES = 16 * 1024 * 1024
+
+letter_lookup = numpy.full(256, 255, dtype=numpy.uint8)
+letter_lookup[numpy.frombuffer(CODES.encode(), dtype=numpy.uint8)] = numpy.arange(len(CODES), dtype=numpy.uint8)
+code_letters = numpy.frombuffer(CODES.encode(), dtype=numpy.uint8)
+
+
+def mask_paths(call_fa):
+
+    """
+    returns the mask and index file names that sit next to a callable sites fasta
+    :param call_fa: str
+    :return: str, str
+    """
+
+    return call_fa + '.cmask', call_fa + '.cmask.idx'
+
+
+def letters_to_codes(letters):
+
+    """
+    converts a string of callable site letters to a set of mask codes
+    :param letters: str
+    :return: numpy.array
+    """
+
+    codes = letter_lookup[numpy.frombuffer(letters.encode(), dtype=numpy.uint8)]
+    if (codes == 255).any():
+        raise ValueError('unrecognised callable site code in {}'.format(letters))
+
+    return numpy.unique(codes)
+
+
+def pack_sites(sequence):
+
+    """
+    packs a string of callable site letters two sites per byte, the first site in the low bits
+    :param sequence: str
+    :return: numpy.array
+    """
+
+    codes = letter_lookup[numpy.frombuffer(sequence.encode(), dtype=numpy.uint8)]
+    if (codes == 255).any():
+        raise ValueError('unrecognised callable site code in callable fasta')
+
+    if len(codes) % 2 == 1:
+        codes = numpy.append(codes, numpy.uint8(0))
+
+    return codes[0::2] | (codes[1::2] << 4)
+
+
+def fasta_chunks(call_fa, chunk_sites=CHUNK_SITES):
+
+    """
+    streams a callable sites fasta as (contig, sequence) chunks, each chunk except the last
+    of a contig holds an even number of sites so packed bytes never straddle two chunks
+    :param call_fa: str
+    :param chunk_sites: int
+    :return: generator
+    """
+
+    contig = None
+    lines = []
+    n_sites = 0
+    for line in open(call_fa):
+        if line.startswith('>'):
+            if contig is not None:
+                yield contig, ''.join(lines)
+            contig = line[1:].split()[0]
+            lines, n_sites = [], 0
+            continue
+
+        lines.append(line.rstrip())
+        n_sites += len(lines[-1])
+        if n_sites >= chunk_sites:
+            sequence = ''.join(lines)
+            cut = n_sites - n_sites % 2
+            yield contig, sequence[:cut]
+            lines, n_sites = [sequence[cut:]], n_sites - cut
+
+    if contig is not None:
+        yield contig, ''.join(lines)
+
+
+def write_callable_mask(call_fa, chunk_sites=CHUNK_SITES):
+
+    """
+    writes the packed 4 bit mask of a callable sites fasta and its per contig offset index,
+    the fasta is read a chunk at a time so no contig is ever held in memory as a string
+    :param call_fa: str
+    :param chunk_sites: int
+    :return: str
+    """
+
+    mask_file, index_file = mask_paths(call_fa)
+
+    contigs = []
+    offset = 0
+    with open(mask_file, 'wb') as mask:
+        for contig, sequence in fasta_chunks(call_fa, chunk_sites):
+            if len(contigs) == 0 or contigs[-1][0] != contig:
+                if len(contigs):
+                    offset += (contigs[-1][1] + 1) // 2
+                contigs.append([contig, 0, offset])
+            contigs[-1][1] += len(sequence)
+            mask.write(pack_sites(sequence).tostring())
+
+    # index written last, so a partly written mask is never picked up as complete
+    with open(index_file, 'w') as index:
+        for contig, length, contig_offset in contigs:
+            print(contig, length, contig_offset, sep='\t', file=index)
+
+    return mask_file
+
+
+class ContigMask(object):
+
+    """
+    read only view of the callable sites of one contig, indexing returns the fasta letters
+    so it can stand in for the contig string, array methods return 4 bit codes
+    """
+
+    def __init__(self, data, contig, length, offset):
+
+        """
+        :param data: numpy.memmap
+        :param contig: str
+        :param length: int
+        :param offset: int
+        """
+
+        self.data = data
+        self.contig = contig
+        self.length = length
+        self.offset = offset
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, item):
+
+        if isinstance(item, slice):
+            start, end, step = item.indices(self.length)
+            return code_letters[self.fetch(start, end)[::step]].tostring().decode()
+
+        if item < 0:
+            item += self.length
+        if not 0 <= item < self.length:
+            raise IndexError('position {} outside {}'.format(item, self.contig))
+
+        byte = self.data[self.offset + (item >> 1)]
+
+        return CODES[(byte >> (4 * (item & 1))) & 15]
+
+    def fetch(self, start=0, end=None):
+
+        """
+        returns the codes of the sites in the 0-based half open region start-end
+        :param start: int
+        :param end: int
+        :return: numpy.array
+        """
+
+        if end is None or end > self.length:
+            end = self.length
+        start = max(start, 0)
+        if end <= start:
+            return numpy.array([], dtype=numpy.uint8)
+
+        packed = self.data[self.offset + (start >> 1): self.offset + ((end + 1) >> 1)]
+        codes = numpy.empty(2 * len(packed), dtype=numpy.uint8)
+        codes[0::2] = packed & 15
+        codes[1::2] = packed >> 4
+
+        skip = start & 1
+        return codes[skip: skip + end - start]
+
+    def codes_at(self, positions):
+
+        """
+        returns the codes of the sites at a set of 0-based positions
+        :param positions: numpy.array
+        :return: numpy.array
+        """
+
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        if len(positions) and (positions.min() < 0 or positions.max() >= self.length):
+            raise IndexError('position outside {}'.format(self.contig))
+
+        packed = self.data[self.offset + (positions >> 1)]
+
+        return (packed >> (4 * (positions & 1)).astype(numpy.uint8)) & 15
+
+    def count_at(self, positions, letters='K'):
+
+        """
+        counts the sites at a set of 0-based positions with any of the given codes
+        :param positions: numpy.array
+        :param letters: str
+        :return: int
+        """
+
+        return int(numpy.in1d(self.codes_at(positions), letters_to_codes(letters)).sum())
+
+    def count(self, starts, ends, letters='K', chunk_sites=CHUNK_SITES):
+
+        """
+        counts the sites with any of the given codes in each 0-based half open interval,
+        intervals are decoded a chunk of the contig at a time and counted from prefix sums
+        :param starts: numpy.array
+        :param ends: numpy.array
+        :param letters: str
+        :param chunk_sites: int
+        :return: numpy.array
+        """
+
+        starts = numpy.clip(numpy.asarray(starts, dtype=numpy.int64), 0, self.length)
+        ends = numpy.clip(numpy.asarray(ends, dtype=numpy.int64), 0, self.length)
+        ends = numpy.maximum(starts, ends)
+        wanted = letters_to_codes(letters)
+
+        counts = numpy.zeros(len(starts), dtype=numpy.int64)
+        chunk_ids = starts // chunk_sites
+        for chunk in numpy.unique(chunk_ids):
+            in_chunk = chunk_ids == chunk
+            low, high = starts[in_chunk].min(), ends[in_chunk].max()
+
+            prefix = numpy.zeros(high - low + 1, dtype=numpy.int64)
+            numpy.cumsum(numpy.in1d(self.fetch(low, high), wanted), out=prefix[1:])
+            counts[in_chunk] = prefix[ends[in_chunk] - low] - prefix[starts[in_chunk] - low]
+
+        return counts
+
+    def cumulative_counts(self, letters='K', chunk_sites=CHUNK_SITES):
+
+        """
+        returns the running count of sites with any of the given codes, entry i holds the count
+        over positions 0 to i - 1 so the count in any interval is the difference of its two ends
+        :param letters: str
+        :param chunk_sites: int
+        :return: numpy.array
+        """
+
+        wanted = letters_to_codes(letters)
+        prefix = numpy.zeros(self.length + 1, dtype=numpy.int64)
+        for low in range(0, self.length, chunk_sites):
+            high = min(low + chunk_sites, self.length)
+            numpy.cumsum(numpy.in1d(self.fetch(low, high), wanted), out=prefix[low + 1: high + 1])
+            prefix[low + 1: high + 1] += prefix[low]
+
+        return prefix
+
+
+class CallableMask(object):
+
+    """
+    memory mapped packed callable sites mask, built next to the fasta if it is missing or out of date
+    """
+
+    def __init__(self, call_fa):
+
+        """
+        :param call_fa: str
+        """
+
+        mask_file, index_file = mask_paths(call_fa)
+        if not os.path.isfile(index_file) or os.path.getmtime(index_file) < os.path.getmtime(call_fa):
+            write_callable_mask(call_fa)
+
+        self.index = {}
+        self.contigs = []
+        for line in open(index_file):
+            contig, length, offset = line.split()
+            self.index[contig] = (int(length), int(offset))
+            self.contigs.append(contig)
+
+        if os.path.getsize(mask_file) > 0:
+            self.data = numpy.memmap(mask_file, dtype=numpy.uint8, mode='r')
+        else:
+            self.data = numpy.array([], dtype=numpy.uint8)
+
+    def __contains__(self, contig):
+        return contig in self.index
+
+    def __getitem__(self, contig):
+
+        """
+        returns the view of one contig
+        :param contig: str
+        :return: ContigMask
+        """
+
+        if contig not in self.index:
+            raise KeyError('sequence \'{}\' not present'.format(contig))
+
+        length, offset = self.index[contig]
+
+        return ContigMask(self.data, contig, length, offset)
+
+    def fetch(self, contig, start=0, end=None):
+
+        """
+        returns the codes of the sites in a region of a contig
+        :param contig: str
+        :param start: int
+        :param end: int
+        :return: numpy.array
+        """
+
+        return self[contig].fetch(start, end)
+
+
+def main():
+
+    # arguments
+    parser = argparse.ArgumentParser(description='Writes the packed 4 bit mask and index for a callable sites fasta')
+    parser.add_argument('-call_fa', help='Callable sites fasta file', required=True)
+    args = parser.parse_args()
+
+    mask_file = write_callable_mask(args.call_fa)
+    print(mask_file)
+
+
+if __name__ == '__main__':
+    main()
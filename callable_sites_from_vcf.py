@@ -4,8 +4,19 @@ import argparse
 from qsub import *
 import sys
 from pysam import VariantFile
-import pysam
 import gzip
+from multiprocessing import Pool
+import numpy
+from vcf_blocks import site_blocks, contig_length, samples_within_depth, sample_mean_depths, \
+    write_sample_depths, read_sample_depths, depth_sample_blocks
+from genomic_intervals import read_bed_intervals, merge_intervals, in_intervals
+from wga_index import WGAIndex
+from polarisable_mask import SNPPolarisableMask
+from callable_mask import write_callable_mask
+from depth_cache import DepthCache
+
+REGION_SIZE = 2000000
+FASTA_LINE_LENGTH = 60
 
 
 def polarisable(vcf_var, wga_bed):
@@ -24,8 +35,7 @@ def polarisable(vcf_var, wga_bed):
 
     # get aligned seq for var
     try:
-        var_align = [x for x in wga_bed.fetch(chrom, pos - 1, pos - 1 + len(ref),
-                                              parser=pysam.asTuple())]
+        var_align = wga_bed.alignment(chrom, pos - 1, pos - 1 + len(ref))
 
     # catch if whole chromo not in align
     except ValueError:
@@ -42,16 +52,15 @@ def polarisable(vcf_var, wga_bed):
         # catch deletions rel to ref that uniq to ref spp
         else:
             # merge sequences from multiple bed rows
-            merged_align = [''.join(y) for y in zip(*[x[7].split(',') for x in var_align])]
+            merged_align = [''.join(y) for y in zip(*var_align)]
             if '-' not in ''.join(merged_align):
                 var_align = merged_align
             else:
                 return False, 'indel_hotspot'
 
     else:
-        var_align = [x[7] for x in var_align][0].split(',')
+        var_align = var_align[0]
 
-    var_align = [x.upper() for x in var_align]
     # print chrom, pos, len(ref), ref, alt, var_align
 
     # skip positions without full coverage
@@ -111,6 +120,377 @@ def polarisable(vcf_var, wga_bed):
         return True, 'polarisable'
 
 
+def classify_sites(block, depth_limits, no_indiv, repeats, ars, min_samples=None):
+
+    """
+    assigns callable site codes to a block of records for each pair of lower and upper depth limits,
+    returning one row of codes per pair, polarisation is not checked so callable sites are returned as 'k' and 'r'.
+    If min_samples is given each limit is an array with one entry per sample and a site passes the depth filter
+    when at least min_samples samples have a FORMAT/DP within their own limits
+    :param block: SiteBlock
+    :param depth_limits: list
+    :param no_indiv: float
+    :param repeats: tuple
+    :param ars: tuple
+    :param min_samples: int
+    :return: numpy.array
+    """
+
+    depth_limits = numpy.array(depth_limits, dtype=float)
+    codes = numpy.full((len(depth_limits), len(block)), ord('1'), dtype=numpy.uint8)
+
+    # depth filter, repeat and N checks below are shared by every pair of limits
+    if min_samples is not None:
+        depth_pass = samples_within_depth(block.sample_depths(),
+                                          depth_limits[:, 0], depth_limits[:, 1]) >= min_samples
+    else:
+        depth_limits = depth_limits.reshape(-1, 2)
+        locus_mean_depth = block.dp / no_indiv
+        depth_pass = (block.has_dp &
+                      (depth_limits[:, 0:1] <= locus_mean_depth) & (locus_mean_depth <= depth_limits[:, 1:2]))
+
+    # repeat filter, vcf positions are compared to the 0-based bed coordinates as in the record loop
+    in_repeat = in_intervals(block.pos, repeats[0], repeats[1])
+    in_ar = in_intervals(block.pos, ars[0], ars[1])
+
+    codes[depth_pass & ~in_repeat] = ord('k')
+    codes[depth_pass & in_repeat & in_ar] = ord('r')
+
+    # ns take priority over all other filters
+    codes[:, block.ref_n] = ord('0')
+
+    return codes
+
+
+def polarise_codes(block, codes, snp_mask):
+
+    """
+    upper cases the codes of callable sites that can be polarised, each site is only checked
+    once however many rows of codes it is callable in. Monomorphic and SNP sites are looked up
+    in the per base polarisability mask, INDELs are checked against the alignment record by record
+    :param block: SiteBlock
+    :param codes: numpy.array
+    :param snp_mask: SNPPolarisableMask
+    :return: None
+    """
+
+    callable_codes = (codes == ord('k')) | (codes == ord('r'))
+    to_check = numpy.flatnonzero(callable_codes.any(axis=0))
+
+    can_polarise = numpy.zeros(len(block), dtype=bool)
+    ref_first, ref_single, alt_first, alt_single, mono = [x[to_check] for x in block.alleles()]
+    can_polarise[to_check], full_check = snp_mask.polarisable(block.contig, block.pos[to_check] - 1, ref_first,
+                                                              ref_single, alt_first, alt_single, mono)
+
+    for i in to_check[full_check]:
+        can_polarise[i] = polarisable(block.record(i), snp_mask.wga_index)[0]
+
+    codes[callable_codes & can_polarise] -= 32
+
+
+def advance_line_buffer(buffered, steps, line_length=FASTA_LINE_LENGTH):
+
+    """
+    returns the length of the unwritten fasta buffer of the record loop after a number of
+    records that did not follow a gap, each record writes one line if the buffer is full
+    and then adds its own base
+    :param buffered: int
+    :param steps: int
+    :param line_length: int
+    :return: int
+    """
+
+    if steps == 0:
+        return buffered
+
+    # after a large gap the buffer drains by one line per record until it is below a line
+    if buffered >= line_length:
+        lagged = (buffered - line_length) // (line_length - 1) + 1
+        if steps <= lagged:
+            return buffered - (line_length - 1) * steps
+        buffered -= (line_length - 1) * lagged
+        steps -= lagged
+
+    return (buffered - 1 + steps) % line_length + 1
+
+
+class CallableFastaWriter(object):
+
+    """
+    writes per record codes to a callable sites fasta with the same gap filling
+    and line wrapping as the record by record loop
+    """
+
+    def __init__(self, out_fa, chromo, line_length=FASTA_LINE_LENGTH):
+
+        """
+        :param out_fa: file
+        :param chromo: str
+        :param line_length: int
+        """
+
+        self.out_fa = out_fa
+        self.line_length = line_length
+        self.pending = ''
+        self.buffered = 0
+        self.prev_position = 0
+        self.out_fa.write('>' + chromo + '\n')
+
+    def add(self, positions, codes):
+
+        """
+        adds codes for a block of records, blocks must be added in position order
+        :param positions: numpy.array
+        :param codes: numpy.array
+        :return: None
+        """
+
+        if len(positions) == 0:
+            return
+
+        # number of missing sites before each record, filled with '1'
+        gaps = numpy.empty(len(positions), dtype=numpy.int64)
+        gaps[0] = positions[0] - self.prev_position
+        gaps[1:] = numpy.diff(positions)
+        gaps = numpy.maximum(gaps - 1, 0)
+
+        record_ends = numpy.cumsum(gaps + 1)
+        stream = numpy.full(record_ends[-1], ord('1'), dtype=numpy.uint8)
+        stream[record_ends - 1] = codes
+
+        # track how much of the sequence the record loop would still hold unwritten
+        buffered = self.buffered
+        prev = 0
+        for i in numpy.flatnonzero(gaps):
+            buffered = advance_line_buffer(buffered, i - prev, self.line_length)
+            buffered = advance_line_buffer(buffered + int(gaps[i]), 1, self.line_length)
+            prev = i + 1
+        buffered = advance_line_buffer(buffered, len(positions) - prev, self.line_length)
+
+        sequence = self.pending + stream.tostring()
+        n_written = len(sequence) - buffered
+        for i in range(0, n_written, self.line_length):
+            self.out_fa.write(sequence[i: i + self.line_length] + '\n')
+
+        self.pending = sequence[n_written:]
+        self.buffered = buffered
+        self.prev_position = int(positions[-1])
+
+    def close(self):
+
+        """
+        writes remaining sequence
+        :return: None
+        """
+
+        self.out_fa.write(self.pending + '\n')
+
+
+def classified_blocks(all_sites, chromosome, start, stop, depth_limits, no_indiv, repeats, ars, snp_mask,
+                      depth_cache=None, min_samples=None):
+
+    """
+    yields the positions and callable site codes, one row per pair of depth limits,
+    of each block of records in a region, records are read from the depth cache if one is given
+    :param all_sites: str
+    :param chromosome: str
+    :param start: int
+    :param stop: int
+    :param depth_limits: list
+    :param no_indiv: float
+    :param repeats: tuple
+    :param ars: tuple
+    :param snp_mask: SNPPolarisableMask
+    :param depth_cache: DepthCache
+    :param min_samples: int
+    :return: generator
+    """
+
+    if depth_cache is not None:
+        blocks = depth_cache.site_blocks(chromosome, start, stop)
+    else:
+        blocks = site_blocks(all_sites, chromosome, start, stop, samples=min_samples is not None)
+
+    for block in blocks:
+        codes = classify_sites(block, depth_limits, no_indiv, repeats, ars, min_samples)
+        if snp_mask is not None:
+            polarise_codes(block, codes, snp_mask)
+        yield block.pos, codes
+
+
+region_job = {}
+
+
+def init_region_worker(job):
+
+    """
+    stores the settings shared by every region in a pool worker, so intervals are only sent once
+    :param job: dict
+    :return: None
+    """
+
+    region_job.update(job)
+
+
+def classify_region(region):
+
+    """
+    classifies all records in one region of a chromosome in a pool worker
+    :param region: tuple
+    :return: numpy.array, numpy.array
+    """
+
+    start, stop = region
+
+    # each worker maps the compiled alignment and polarisability mask itself
+    if region_job['pol'] != 'None':
+        snp_mask = SNPPolarisableMask(WGAIndex(region_job['pol']))
+    else:
+        snp_mask = None
+
+    fragments = list(classified_blocks(region_job['all_sites'], region_job['chromosome'], start, stop,
+                                       region_job['depth_limits'], region_job['no_indiv'],
+                                       region_job['repeats'], region_job['ars'], snp_mask,
+                                       region_job['depth_cache'], region_job['min_samples']))
+
+    if len(fragments) == 0:
+        return (numpy.array([], dtype=numpy.int64),
+                numpy.zeros((len(region_job['depth_limits']), 0), dtype=numpy.uint8))
+
+    return numpy.concatenate([x[0] for x in fragments]), numpy.concatenate([x[1] for x in fragments], axis=1)
+
+
+def chromosome_regions(length, region_size=REGION_SIZE):
+
+    """
+    splits a chromosome into consecutive tabix addressable regions, the last is left open ended
+    to catch any records beyond the length in the header
+    :param length: int
+    :param region_size: int
+    :return: list
+    """
+
+    regions = [(x, x + region_size) for x in range(0, length, region_size)]
+    if len(regions) == 0:
+        return [(None, None)]
+
+    regions[-1] = (regions[-1][0], None)
+
+    return regions
+
+
+def vectorised_callable_sites(all_sites, chromosome, fasta_outs, depth_limits,
+                              no_indiv, repeat_bed, line_bed, pol, threads=1, region_size=REGION_SIZE,
+                              depth_cache=None, min_samples=None):
+
+    """
+    writes the callable sites fasta for a chromosome classifying blocks of records with numpy,
+    with more than one thread regions of the chromosome are classified in a process pool and
+    stitched back together in order, output is identical to the record by record loop.
+    One fasta is written per pair of lower and upper depth limits from the same pass of the vcf,
+    returns the number of records and the count of each site code per fasta
+    :param all_sites: str
+    :param chromosome: str
+    :param fasta_outs: list
+    :param depth_limits: list
+    :param no_indiv: float
+    :param repeat_bed: str
+    :param line_bed: str
+    :param pol: str
+    :param threads: int
+    :param region_size: int
+    :param depth_cache: DepthCache
+    :param min_samples: int
+    :return: int, numpy.array
+    """
+
+    repeats = merge_intervals(*read_bed_intervals(repeat_bed, chromosome))
+    if line_bed != 'None':
+        ars = merge_intervals(*read_bed_intervals(line_bed, chromosome))
+    else:
+        ars = (numpy.array([], dtype=numpy.int64), numpy.array([], dtype=numpy.int64))
+
+    job = {'all_sites': all_sites, 'chromosome': chromosome,
+           'depth_limits': depth_limits, 'no_indiv': no_indiv, 'repeats': repeats, 'ars': ars, 'pol': pol,
+           'depth_cache': depth_cache, 'min_samples': min_samples}
+
+    # extract the contig and compile its alignment and polarisability mask once here rather than in every worker
+    if depth_cache is not None and not depth_cache.has_contig(chromosome):
+        depth_cache.build(chromosome)
+    if pol != 'None':
+        snp_mask = SNPPolarisableMask(WGAIndex(pol))
+        if chromosome in snp_mask.wga_index and not snp_mask.has_contig(chromosome):
+            snp_mask.build(chromosome)
+    else:
+        snp_mask = None
+
+    length = contig_length(all_sites, chromosome)
+    pool = None
+    if threads > 1 and length is not None:
+        pool = Pool(processes=threads, initializer=init_region_worker, initargs=(job,))
+        # imap returns regions in order, so fragments can be written as soon as they are ready
+        fragments = pool.imap(classify_region, chromosome_regions(length, region_size))
+    else:
+        fragments = classified_blocks(all_sites, chromosome, None, None, depth_limits,
+                                      no_indiv, repeats, ars, snp_mask, depth_cache, min_samples)
+
+    # gap filling between fragments is handled by the writers, which track the last position written
+    counter = 0
+    code_counts = numpy.zeros((len(fasta_outs), 256), dtype=numpy.int64)
+    out_fas = [open(x, 'w') for x in fasta_outs]
+    writers = [CallableFastaWriter(x, chromosome) for x in out_fas]
+    for positions, codes in fragments:
+        for i, writer in enumerate(writers):
+            writer.add(positions, codes[i])
+            code_counts[i] += numpy.bincount(codes[i], minlength=256)
+        counter += len(positions)
+
+    for writer, out_fa in zip(writers, out_fas):
+        writer.close()
+        out_fa.close()
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    return counter, code_counts
+
+
+def sweep_fasta_name(out, depth_pair, chromo):
+
+    """
+    returns the fasta name for one DF and mean depth pair of a depth sweep
+    :param out: str
+    :param depth_pair: tuple
+    :param chromo: str
+    :return: str
+    """
+
+    return '{}.DF{}_depth{}.{}.fa'.format(out, depth_pair[0], depth_pair[1], chromo)
+
+
+def write_sweep_summary(summary_file, chromo, depth_pairs, depth_limits, code_counts):
+
+    """
+    writes a table of the number of callable sites in each fasta of a depth sweep
+    :param summary_file: str
+    :param chromo: str
+    :param depth_pairs: list
+    :param depth_limits: list
+    :param code_counts: numpy.array
+    :return: None
+    """
+
+    with open(summary_file, 'w') as summary:
+        summary.write('\t'.join(['contig', 'DF', 'mean_depth', 'lower_depth', 'upper_depth',
+                                 'all_callable', 'pol_callable', 'all_ar_callable', 'pol_ar_callable']) + '\n')
+        for pair, limits, counts in zip(depth_pairs, depth_limits, code_counts):
+            row = [chromo, pair[0], pair[1], limits[0], limits[1],
+                   counts[ord('k')] + counts[ord('K')], counts[ord('K')],
+                   counts[ord('r')] + counts[ord('R')], counts[ord('R')]]
+            summary.write('\t'.join([str(x) for x in row]) + '\n')
+
+
 def main():
     # arguments
     parser = argparse.ArgumentParser()
@@ -139,7 +519,9 @@ def main():
                              '-chr ALL can only be specified in conjunction with -sub',
                         default='ALL')
     parser.add_argument('-pol',
-                        help='If specified will check if site can be polarised, takes a wga bed file',
+                        help='If specified will check if site can be polarised, takes a wga bed file, with '
+                             '-vectorised monomorphic and SNP sites are looked up in a per base mask built '
+                             'from the alignment on first use, see polarisable_mask.py',
                         default='None')
     parser.add_argument('-out',
                         help='Output directory and prefix',
@@ -152,6 +534,43 @@ def main():
                         help='If specified will submit itself to cluster',
                         action='store_true',
                         default=False)
+    parser.add_argument('-vectorised',
+                        help='If specified will classify sites in large numpy blocks rather than record by record, '
+                             'output is identical',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('-threads',
+                        help='Number of processes to classify regions of the chromosome with, implies -vectorised',
+                        type=int,
+                        default=1)
+    parser.add_argument('-region_size',
+                        help='Size in bp of the chromosome regions given to each process',
+                        type=int,
+                        default=REGION_SIZE)
+    parser.add_argument('-sweep',
+                        help='DF and mean depth pair to write a callable fasta for, i.e. 2.0,20, can be specified '
+                             'multiple times to sweep several depth thresholds in one pass of the vcf, '
+                             'overrides -DF and -mean_depth and implies -vectorised',
+                        action='append')
+    parser.add_argument('-depth_cache',
+                        help='If specified reads depth, N and allele data from a per base cache of the vcf, '
+                             'extracting it on first use, implies -vectorised',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('-cache_dir',
+                        help='Directory holding depth caches, defaults to the vcf directory',
+                        default=None)
+    parser.add_argument('-min_samples',
+                        help='If specified filters depth on the FORMAT/DP of each sample rather than INFO/DP, a site '
+                             'passes if at least this many samples are within DF fold of their own mean depth, '
+                             'implies -vectorised',
+                        type=int,
+                        default=None)
+    parser.add_argument('-sample_depths',
+                        help='Mean depth of each sample for -min_samples, as output by vcftools --depth, if not '
+                             'specified means are estimated from evenly spaced windows covering 5%% of the '
+                             'chromosome and written to out.chr.idepth',
+                        default=None)
     args = parser.parse_args()
 
     # variables
@@ -166,6 +585,32 @@ def main():
     out = args.out
     fasta_out = out + '.' + chromosome + '.fa'
     evolgen = args.evolgen
+    threads = args.threads
+    if args.sweep is not None:
+        depth_pairs = [(float(x.split(',')[0]), float(x.split(',')[1])) for x in args.sweep]
+    else:
+        depth_pairs = None
+    min_samples = args.min_samples
+    vectorised = (args.vectorised or threads > 1 or depth_pairs is not None or args.depth_cache or
+                  min_samples is not None)
+    if vectorised:
+        engine_flag = ' -vectorised -threads {} -region_size {}'.format(threads, args.region_size)
+        if depth_pairs is not None:
+            engine_flag += ''.join([' -sweep {},{}'.format(x[0], x[1]) for x in depth_pairs])
+        if args.depth_cache:
+            engine_flag += ' -depth_cache'
+            if args.cache_dir is not None:
+                engine_flag += ' -cache_dir ' + args.cache_dir
+        if min_samples is not None:
+            engine_flag += ' -min_samples ' + str(min_samples)
+            if args.sample_depths is not None:
+                engine_flag += ' -sample_depths ' + args.sample_depths
+    else:
+        engine_flag = ''
+
+    # the cache only holds INFO/DP
+    if min_samples is not None and args.depth_cache:
+        sys.exit('-min_samples needs FORMAT/DP so cannot be run in conjunction with -depth_cache')
 
     # submission loop
     if args.sub is True:
@@ -191,12 +636,27 @@ def main():
                                 '-N ' + str(no_indiv) + ' '
                                 '-chr ' + chromo + ' '
                                 '-pol ' + pol + ' '
-                                '-out ' + out)
-                q_sub([command_line], out + '.' + chromo, jid=jid, evolgen=evolgen, t=48)
+                                '-out ' + out + engine_flag)
+                q_sub([command_line], out + '.' + chromo, jid=jid, evolgen=evolgen, t=48, tr=threads)
 
             # cat job for final output
-            cat_cmd = 'cat ' + ' '.join(output_fasta_list) + ' > ' + fasta_out
-            q_sub([cat_cmd], out + 'cat', evolgen=evolgen, hold=jid_list)
+            if depth_pairs is None:
+                cat_cmd = 'cat ' + ' '.join(output_fasta_list) + ' > ' + fasta_out
+                mask_cmd = 'callable_mask.py -call_fa ' + fasta_out
+                q_sub([cat_cmd, mask_cmd], out + 'cat', evolgen=evolgen, hold=jid_list)
+
+            # one fasta per depth pair, and the per chromosome summaries with a single header
+            else:
+                cat_cmds = []
+                for pair in depth_pairs:
+                    pair_fasta = sweep_fasta_name(out, pair, 'ALL')
+                    cat_cmds.append('cat ' + ' '.join([sweep_fasta_name(out, pair, x) for x in chromo_list]) +
+                                    ' > ' + pair_fasta)
+                    cat_cmds.append('callable_mask.py -call_fa ' + pair_fasta)
+                cat_cmds.append('awk \'FNR > 1 || NR == 1\' ' +
+                                ' '.join([out + '.' + x + '.depth_sweep.txt' for x in chromo_list]) +
+                                ' > ' + out + '.ALL.depth_sweep.txt')
+                q_sub(cat_cmds, out + 'cat', evolgen=evolgen, hold=jid_list)
             sys.exit()
 
         else:
@@ -210,8 +670,8 @@ def main():
                             '-N ' + str(no_indiv) + ' '
                             '-chr ' + chromosome + ' '
                             '-pol ' + pol + ' '
-                            '-out ' + out)
-            q_sub([command_line], out, evolgen=evolgen, t=48)
+                            '-out ' + out + engine_flag)
+            q_sub([command_line], out, evolgen=evolgen, t=48, tr=threads)
             sys.exit()
 
     # catch -all specified without -sub
@@ -222,6 +682,47 @@ def main():
     lower_depth_limit = all_data_mean_depth / filter_factor
     upper_depth_limit = all_data_mean_depth * filter_factor
 
+    # block wise classification
+    if vectorised:
+        if depth_pairs is None:
+            fasta_outs = [fasta_out]
+            depth_limits = [(lower_depth_limit, upper_depth_limit)]
+        else:
+            fasta_outs = [sweep_fasta_name(out, x, chromosome) for x in depth_pairs]
+            depth_limits = [(x[1] / x[0], x[1] * x[0]) for x in depth_pairs]
+        summary_limits = depth_limits
+
+        # per sample limits, each sample's own mean depth takes the place of -mean_depth
+        if min_samples is not None:
+            samples = list(VariantFile(all_sites).header.samples)
+            if args.sample_depths is not None:
+                sample_means = read_sample_depths(args.sample_depths, samples)
+            else:
+                n_sites, sample_means = sample_mean_depths(depth_sample_blocks(all_sites, chromosome), len(samples))
+                write_sample_depths(out + '.' + chromosome + '.idepth', samples, n_sites, sample_means)
+
+            depth_factors = [filter_factor] if depth_pairs is None else [x[0] for x in depth_pairs]
+            depth_limits = [(sample_means / x, sample_means * x) for x in depth_factors]
+            summary_limits = [('NA', 'NA') for x in depth_factors]
+
+        if args.depth_cache:
+            depth_cache = DepthCache(all_sites, args.cache_dir)
+        else:
+            depth_cache = None
+
+        counter, code_counts = vectorised_callable_sites(all_sites, chromosome, fasta_outs,
+                                                         depth_limits, no_indiv,
+                                                         repeat_bed, line_bed, pol, threads, args.region_size,
+                                                         depth_cache, min_samples)
+        for x in fasta_outs:
+            write_callable_mask(x)
+
+        if depth_pairs is not None:
+            write_sweep_summary(out + '.' + chromosome + '.depth_sweep.txt', chromosome,
+                                depth_pairs, summary_limits, code_counts)
+        print counter
+        sys.exit()
+
     repeats = set()
     # get bed regions per chromo
     for x in open(repeat_bed):
@@ -239,7 +740,7 @@ def main():
     counter = 0
     fasta_string = '>' + chromosome + '\n'
     if pol != 'None':
-        wga_bed = pysam.TabixFile(pol)
+        wga_bed = WGAIndex(pol)
     else:
         wga_bed = None
 
@@ -323,6 +824,9 @@ def main():
 
         out_fa.write(fasta_string + '\n')
 
+    # packed mask for random access by downstream scripts
+    write_callable_mask(fasta_out)
+
     print counter
 
 if __name__ == '__main__':
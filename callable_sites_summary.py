@@ -3,46 +3,48 @@
 from __future__ import print_function
 import argparse
 import pysam
-import gzip
-import itertools
+import numpy
+from callable_mask import CallableMask
+from gff_index import gff_regions
+from degen_to_bed import DegeneracyTrack
 
 
-def ranges(i):
-    for a, b in itertools.groupby(enumerate(i), lambda (x, y): y - x):
-        b = list(b)
-        yield b[0][1], b[-1][1]
-
-
-def gff_regions(gff_file, chromo):
+def bed_regions(bed_file, chromo):
 
-    # dict holding region coords for each chromosome
-    features = ['CDS', 'intron', 'gene', 'all_feat']
-    region_dict = {y: set() for y in features}
+    """
+    reads the intervals of a chromosome from a tabix indexed bed file, unmerged so overlapping
+    intervals are counted once for each interval as before
+    :param bed_file: str
+    :param chromo: str
+    :return: numpy.array, numpy.array
+    """
 
-    # make coord sets
-    for line in gzip.open(gff_file):
-        line = line.split('\t')
-        if line[0] == chromo:
-            gff_chromo, feature, feat_start, feat_end = line[0], line[2], int(line[3]), int(line[4])
+    open_bed = pysam.TabixFile(bed_file)
+    starts = []
+    ends = []
+    for line in open_bed.fetch(chromo, parser=pysam.asTuple()):
+        starts.append(int(line[1]))
+        ends.append(int(line[2]))
 
-            region_dict['all_feat'] |= set(range(feat_start - 1, feat_end))
-            if feature in features:
-                region_dict[feature] |= set(range(feat_start - 1, feat_end))
+    return numpy.array(starts, dtype=numpy.int64), numpy.array(ends, dtype=numpy.int64)
 
-    # region_dict = {k2: [x for x in ranges(sorted(list(region_dict[k2])))] for k2 in region_dict.keys()}
 
-    return region_dict
+def interval_count(prefix, starts, ends):
 
+    """
+    sums the number of sites counted by a cumulative count array over a set of intervals
+    :param prefix: numpy.array
+    :param starts: numpy.array
+    :param ends: numpy.array
+    :return: int
+    """
 
-def bed_regions(bed_file, chromo):
-    open_bed = pysam.TabixFile(bed_file)
-    coords = []
-    for line in open_bed.fetch(chromo, parser=pysam.asTuple()):
-        start = int(line[1])
-        end = int(line[2])
-        coords += range(start, end)
+    keep = ends > starts
+    starts, ends = starts[keep], ends[keep]
+    if len(starts) and (starts.min() < 0 or ends.max() > len(prefix) - 1):
+        raise IndexError('interval outside callable fasta')
 
-    return coords
+    return int((prefix[ends] - prefix[starts]).sum())
 
 
 def main():
@@ -54,62 +56,84 @@ def main():
     parser.add_argument('-chr_list', help='File of chromosomes to calc callable sites for', required=True)
     parser.add_argument('-opt_bed', help='Optional bed file of regions to count callables sites, with associated label'
                                          'i.e. /path/to/file.bed.gz,my_sub_region', action='append')
+    parser.add_argument('-degen_track', help='Optional degeneracy track directory from degen_to_bed.py -track_dir, '
+                                             'adds counts of zerofold, twofold, threefold and fourfold sites '
+                                             'that all transcripts agree on', default=None)
     args = parser.parse_args()
 
     # variables
     gff = args.gff
-    fa = pysam.FastaFile(args.call_fa)
+    call_mask = CallableMask(args.call_fa)
     if args.opt_bed is not None:
         bed_files = {x.split(',')[1]: x.split(',')[0] for x in args.opt_bed}
     else:
         bed_files = {}
 
+    degen_regions = {}
+    if args.degen_track is not None:
+        degen_track = DegeneracyTrack(args.degen_track)
+        degen_regions = {'zerofold': 0, 'twofold': 2, 'threefold': 3, 'fourfold': 4}
+
     chr_list = [x.rstrip() for x in open(args.chr_list)]
-    regions = ['ALL', 'CDS', 'intron', 'intergenic', 'AR'] + bed_files.keys()
+    regions = ['ALL', 'CDS', 'intron', 'intergenic', 'AR'] + bed_files.keys() + sorted(degen_regions.keys())
     call_data = {x: {y: {'ALL': 0, 'POL': 0} for y in regions} for x in ['ALL'] + chr_list}
 
     # {chromo: {all: 0, CDS: 0, intron: 0 ...}}
 
     # get call sites for all chr and regions
+    chr_regions = gff_regions(gff, chr_list)
     for chromo in chr_list:
-        fasta_string = fa.fetch(chromo)
-        region_coords = gff_regions(gff, chromo)
+        call_seq = call_mask[chromo]
+        region_coords = chr_regions[chromo]
+
+        # running counts of callable sites, a region's count is then a sum over its interval ends
+        all_prefix = call_seq.cumulative_counts('kK')
+        pol_prefix = call_seq.cumulative_counts('K')
+        whole_chromo = (numpy.array([0]), numpy.array([len(call_seq)]))
+
         for region in regions:
             if region == 'ALL':
-                callable_sites_all = fasta_string.upper().count('K')
-                callable_sites_pol = fasta_string.count('K')
+                callable_sites_all = interval_count(all_prefix, *whole_chromo)
+                callable_sites_pol = interval_count(pol_prefix, *whole_chromo)
             elif region == 'AR':
-                callable_sites_all = fasta_string.upper().count('R')
-                callable_sites_pol = fasta_string.count('R')
+                callable_sites_all = call_seq.count(*whole_chromo, letters='rR')[0]
+                callable_sites_pol = call_seq.count(*whole_chromo, letters='R')[0]
             elif region == 'intergenic':
                 # need to reverse engineer intergenic coords
-                gene_coords = region_coords['gene']
-                if len(gene_coords) == 0:
-                    gene_coords = region_coords['all_feat']
-
-                # invert
-                intergenic_coords = [i for i in range(0, len(fasta_string)) if i not in gene_coords]
-                intergenic_coords = list(intergenic_coords)
-
-                callable_sites_all = ''.join([fasta_string[x] for x in intergenic_coords]).upper().count('K')
-                callable_sites_pol = ''.join([fasta_string[x] for x in intergenic_coords]).count('K')
+                gene_starts, gene_ends = region_coords['gene']
+                if len(gene_starts) == 0:
+                    gene_starts, gene_ends = region_coords['all_feat']
+
+                # sites outside genes, gene coords beyond the fasta are ignored
+                gene_starts = numpy.clip(gene_starts, 0, len(call_seq))
+                gene_ends = numpy.clip(gene_ends, 0, len(call_seq))
+                callable_sites_all = (interval_count(all_prefix, *whole_chromo) -
+                                      interval_count(all_prefix, gene_starts, gene_ends))
+                callable_sites_pol = (interval_count(pol_prefix, *whole_chromo) -
+                                      interval_count(pol_prefix, gene_starts, gene_ends))
 
             # handle optional bed files
             elif region in bed_files.keys():
                 degen_bed = bed_files[region]
                 try:
-                    degen_coords = bed_regions(degen_bed, chromo)
+                    bed_starts, bed_ends = bed_regions(degen_bed, chromo)
 
-                    callable_sites_all = ''.join([fasta_string[x] for x in degen_coords]).upper().count('K')
-                    callable_sites_pol = ''.join([fasta_string[x] for x in degen_coords]).count('K')
+                    callable_sites_all = interval_count(all_prefix, bed_starts, bed_ends)
+                    callable_sites_pol = interval_count(pol_prefix, bed_starts, bed_ends)
                 except ValueError:
                     callable_sites_all = 0
                     callable_sites_pol = 0
 
+            # degenerate sites by indexing the track
+            elif region in degen_regions.keys():
+                track = degen_track.contig(chromo)[:len(call_seq)]
+                degen_sites = numpy.flatnonzero(track == degen_regions[region])
+                callable_sites_all = call_seq.count_at(degen_sites, letters='kK')
+                callable_sites_pol = call_seq.count_at(degen_sites, letters='K')
+
             else:
-                coords = list(region_coords[region])
-                callable_sites_all = ''.join([fasta_string[x] for x in coords]).upper().count('K')
-                callable_sites_pol = ''.join([fasta_string[x] for x in coords]).count('K')
+                callable_sites_all = interval_count(all_prefix, *region_coords[region])
+                callable_sites_pol = interval_count(pol_prefix, *region_coords[region])
 
             call_data[chromo][region]['ALL'] += callable_sites_all
             call_data[chromo][region]['POL'] += callable_sites_pol
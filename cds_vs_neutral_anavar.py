@@ -5,7 +5,7 @@ import anavar_utils as an
 import argparse
 from qsub import q_sub
 from collections import Counter
-from vcf2raw_sfs import vcf2sfs
+from sfs_cache import cached_vcf2sfs
 import random
 
 # import gzip
@@ -153,21 +153,21 @@ def prepare_indel_sfs(vcf, call, n):
     """
 
     # extract site frequencies
-    del_sfs = vcf2sfs(vcf_name=vcf, mode='del',
-                      auto_only=True, skip_hetero=True,
-                      regions=['CDS_frameshift', 'CDS_non_frameshift'])
+    del_sfs = cached_vcf2sfs(vcf_name=vcf, mode='del',
+                             auto_only=True, skip_hetero=True,
+                             regions=['CDS_frameshift', 'CDS_non_frameshift'])
 
-    n_d_sfs = vcf2sfs(vcf_name=vcf, mode='del',
-                      auto_only=True, skip_hetero=True,
-                      regions=['intergenic', 'intron'])
+    n_d_sfs = cached_vcf2sfs(vcf_name=vcf, mode='del',
+                             auto_only=True, skip_hetero=True,
+                             regions=['intergenic', 'intron'])
 
-    ins_sfs = vcf2sfs(vcf_name=vcf, mode='ins',
-                      auto_only=True, skip_hetero=True,
-                      regions=['CDS_frameshift', 'CDS_non_frameshift'])
+    ins_sfs = cached_vcf2sfs(vcf_name=vcf, mode='ins',
+                             auto_only=True, skip_hetero=True,
+                             regions=['CDS_frameshift', 'CDS_non_frameshift'])
 
-    n_i_sfs = vcf2sfs(vcf_name=vcf, mode='ins',
-                      auto_only=True, skip_hetero=True,
-                      regions=['intergenic', 'intron'])
+    n_i_sfs = cached_vcf2sfs(vcf_name=vcf, mode='ins',
+                             auto_only=True, skip_hetero=True,
+                             regions=['intergenic', 'intron'])
 
     # convert to correct format for anavar
     sfs_i = sfs2counts(ins_sfs, n)
@@ -197,13 +197,13 @@ def prepare_snp_sfs(vcf, call, n):
     """
 
     # extract site frequencies
-    sel_sfs = vcf2sfs(vcf_name=vcf, mode='snp',
-                      auto_only=True, skip_hetero=True,
-                      regions=['CDS_frameshift', 'CDS_non_frameshift'])
+    sel_sfs = cached_vcf2sfs(vcf_name=vcf, mode='snp',
+                             auto_only=True, skip_hetero=True,
+                             regions=['CDS_frameshift', 'CDS_non_frameshift'])
 
-    neu_sfs = vcf2sfs(vcf_name=vcf, mode='snp',
-                      auto_only=True, skip_hetero=True,
-                      degen=4)
+    neu_sfs = cached_vcf2sfs(vcf_name=vcf, mode='snp',
+                             auto_only=True, skip_hetero=True,
+                             degen=4)
 
     # convert to correct format for anavar
     sfs_sel = sfs2counts(sel_sfs, n)
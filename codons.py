@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import numpy
+
+# codon table
+standard_codon_table = {
+    "TTT": "F", "CTT": "L", "ATT": "I", "GTT": "V",
+    "TTC": "F", "CTC": "L", "ATC": "I", "GTC": "V",
+    "TTA": "L", "CTA": "L", "ATA": "I", "GTA": "V",
+    "TTG": "L", "CTG": "L", "ATG": "M", "GTG": "V",
+
+    "TCT": "S", "CCT": "P", "ACT": "T", "GCT": "A",
+    "TCC": "S", "CCC": "P", "ACC": "T", "GCC": "A",
+    "TCA": "S", "CCA": "P", "ACA": "T", "GCA": "A",
+    "TCG": "S", "CCG": "P", "ACG": "T", "GCG": "A",
+
+    "TAT": "Y", "CAT": "H", "AAT": "N", "GAT": "D",
+    "TAC": "Y", "CAC": "H", "AAC": "N", "GAC": "D",
+    "TAA": "*", "CAA": "Q", "AAA": "K", "GAA": "E",
+    "TAG": "*", "CAG": "Q", "AAG": "K", "GAG": "E",
+
+    "TGT": "C", "CGT": "R", "AGT": "S", "GGT": "G",
+    "TGC": "C", "CGC": "R", "AGC": "S", "GGC": "G",
+    "TGA": "*", "CGA": "R", "AGA": "R", "GGA": "G",
+    "TGG": "W", "CGG": "R", "AGG": "R", "GGG": "G",
+}
+
+BASES = 'ACGT'
+STOPS = {'TAG', 'TGA', 'TAA'}
+
+# sites of codons holding anything other than ACGT, and of incomplete codons
+NO_CODON = 255
+
+# byte to base code lookup, 4 for anything other than ACGT
+base_codes = numpy.full(256, 4, dtype=numpy.uint8)
+for _i, _base in enumerate(BASES):
+    base_codes[ord(_base)] = _i
+    base_codes[ord(_base.lower())] = _i
+
+# codons in index order, the index of a codon is 16 * first base + 4 * second + third
+CODONS = [x + y + z for x in BASES for y in BASES for z in BASES]
+CODON_INDEX = {x: i for i, x in enumerate(CODONS)}
+AMINO_ACIDS = numpy.array([standard_codon_table[x] for x in CODONS])
+
+# amino acid and stop codon made by each base at each position of each codon, [codon, position, base]
+ALT_AMINO_ACIDS = numpy.empty((64, 3, 4), dtype=AMINO_ACIDS.dtype)
+for _c, _codon in enumerate(CODONS):
+    for _pos in range(3):
+        for _b, _base in enumerate(BASES):
+            ALT_AMINO_ACIDS[_c, _pos, _b] = standard_codon_table[_codon[:_pos] + _base + _codon[_pos + 1:]]
+MAKES_STOP = ALT_AMINO_ACIDS == '*'
+
+# number of bases at a site giving the same amino acid, 1 counted as 0 fold, and any base makes a stop
+DEGENERACY = (ALT_AMINO_ACIDS == AMINO_ACIDS[:, None, None]).sum(axis=2).astype(numpy.uint8)
+DEGENERACY[DEGENERACY == 1] = 0
+PREM_STOP = MAKES_STOP.any(axis=2)
+
+
+def codon_index(codon):
+
+    """
+    returns the table index of an upper case codon, raises KeyError for codons other than three of ACGT
+    :param codon: str
+    :return: int
+    """
+
+    return CODON_INDEX[codon]
+
+
+def degeneracy(codon):
+
+    """
+    returns the degeneracy of a site in a codon, given as [codon, position in codon]
+    :param codon: list
+    :return: int
+    """
+
+    return int(DEGENERACY[codon_index(codon[0].upper()), codon[1]])
+
+
+def amino_acid_changes(codon, pos):
+
+    """
+    returns the amino acids that a change at a position of a codon can give, other than its own
+    :param codon: str
+    :param pos: int
+    :return: set
+    """
+
+    index = codon_index(codon.upper())
+
+    return set(ALT_AMINO_ACIDS[index, pos]) - {AMINO_ACIDS[index]}
+
+
+def prem_stop(codon, pos, bases=('A', 'T', 'G', 'C')):
+
+    """
+    goes through a list of bases and sees if any make a stop codon
+    :param codon: str
+    :param pos: int
+    :param bases: set
+    :return: bool
+    """
+
+    if pos not in (0, 1, 2):
+        raise IndexError
+
+    # codons other than three of ACGT can only be checked base by base
+    index = CODON_INDEX.get(codon)
+    if index is None:
+        return any([codon[:pos] + x + codon[pos + 1:] in STOPS for x in bases])
+
+    if tuple(bases) == ('A', 'T', 'G', 'C'):
+        return bool(PREM_STOP[index, pos])
+
+    return any([MAKES_STOP[index, pos, BASES.index(x)] for x in bases if len(x) == 1 and x in BASES])
+
+
+def classify_cds(sequence):
+
+    """
+    returns the degeneracy of each site of an in frame coding sequence and whether a change at the site
+    can give a premature stop, in one pass over the codon indexes. Sites in codons with bases other than
+    ACGT, or in an incomplete final codon, are NO_CODON and can not give a stop
+    :param sequence: str or numpy.array
+    :return: numpy.array, numpy.array
+    """
+
+    if not isinstance(sequence, numpy.ndarray):
+        sequence = numpy.frombuffer(sequence.encode(), dtype=numpy.uint8)
+    codes = base_codes[sequence]
+
+    n_codons = len(codes) // 3
+    codon_codes = codes[:3 * n_codons].reshape(n_codons, 3).astype(numpy.int64)
+    valid = (codon_codes < 4).all(axis=1)
+    indexes = numpy.where(valid, codon_codes[:, 0] * 16 + codon_codes[:, 1] * 4 + codon_codes[:, 2], 0)
+
+    degens = numpy.full(len(codes), NO_CODON, dtype=numpy.uint8)
+    stops = numpy.zeros(len(codes), dtype=bool)
+    degens[:3 * n_codons] = numpy.where(valid[:, None], DEGENERACY[indexes], NO_CODON).ravel()
+    stops[:3 * n_codons] = (valid[:, None] & PREM_STOP[indexes]).ravel()
+
+    return degens, stops
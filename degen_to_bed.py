@@ -3,50 +3,16 @@
 from __future__ import print_function
 import argparse
 import gzip
+import os
+import sys
+import numpy
+from depth_cache import save_array
+from codons import STOPS, classify_cds, prem_stop, NO_CODON
 
-
-def degeneracy(codon):
-
-    # codon table
-    standard_codon_table = {
-        "TTT": "F", "CTT": "L", "ATT": "I", "GTT": "V",
-        "TTC": "F", "CTC": "L", "ATC": "I", "GTC": "V",
-        "TTA": "L", "CTA": "L", "ATA": "I", "GTA": "V",
-        "TTG": "L", "CTG": "L", "ATG": "M", "GTG": "V",
-
-        "TCT": "S", "CCT": "P", "ACT": "T", "GCT": "A",
-        "TCC": "S", "CCC": "P", "ACC": "T", "GCC": "A",
-        "TCA": "S", "CCA": "P", "ACA": "T", "GCA": "A",
-        "TCG": "S", "CCG": "P", "ACG": "T", "GCG": "A",
-
-        "TAT": "Y", "CAT": "H", "AAT": "N", "GAT": "D",
-        "TAC": "Y", "CAC": "H", "AAC": "N", "GAC": "D",
-        "TAA": "*", "CAA": "Q", "AAA": "K", "GAA": "E",
-        "TAG": "*", "CAG": "Q", "AAG": "K", "GAG": "E",
-
-        "TGT": "C", "CGT": "R", "AGT": "S", "GGT": "G",
-        "TGC": "C", "CGC": "R", "AGC": "S", "GGC": "G",
-        "TGA": "*", "CGA": "R", "AGA": "R", "GGA": "G",
-        "TGG": "W", "CGG": "R", "AGG": "R", "GGG": "G",
-    }
-
-    ref_codon = codon[0].upper()
-    snp_site = codon[1]
-    ref_amino_acid = standard_codon_table[ref_codon]
-    degen = 0
-    for bp in ['A', 'T', 'C', 'G']:
-        if snp_site == 0:
-            alt_codon = bp + ref_codon[1:]
-        elif snp_site == 1:
-            alt_codon = ref_codon[0] + bp + ref_codon[2]
-        else:
-            alt_codon = ref_codon[0:2] + bp
-        alt_amino_acid = standard_codon_table[alt_codon]
-        if alt_amino_acid == ref_amino_acid:
-            degen += 1
-    if degen == 1:
-        degen = 0
-    return degen
+# per base degeneracy track values, sites take their degeneracy where all transcripts agree
+DEGEN_CLASSES = [0, 2, 3, 4]
+AMBIGUOUS = 254
+NON_CODING = 255
 
 
 def cds_coord_to_codon_coords(fa_coord, direction):
@@ -77,7 +43,7 @@ def pos_unique(pos, chr_degen_dict, other_degens):
 def start_stop_ok(fa_seq):
 
     codon_list = [fa_seq[i:i+3] for i in range(0, len(fa_seq), 3)]
-    stops = {'TAG', 'TGA', 'TAA'}
+    stops = STOPS
     # check if has start codon
     if codon_list[0] != 'ATG':
         return False
@@ -95,23 +61,17 @@ def start_stop_ok(fa_seq):
         return True
 
 
-def main():
-    # arguments
-    parser = argparse.ArgumentParser(description='Script that outputs the position of '
-                                                 'degenerate sites in coding regions to a bed file')
-    parser.add_argument('-cds_fa', help='Fasta file with CDS sequences in', required=True)
-    parser.add_argument('-degen', help='Degeneracy of sites to extract positions for', required=True,
-                        action='append', choices=[0, 2, 3, 4], type=int)
-    args = parser.parse_args()
+def cds_transcripts(cds_fa):
 
-    # variables
-    fa = args.cds_fa
-    out_degens = set(args.degen)
-    degen_data = {}
+    """
+    reads the transcripts of a CDS fasta, skipping those with coordinates on both strands
+    :param cds_fa: str
+    :return: generator
+    """
 
-    # loop through fasta
     sequence, chromo, coords, skip, trans_name = '', '', [], False, ''
-    for line in gzip.open(fa):
+
+    for line in gzip.open(cds_fa):
 
         # skip sequence line following skipped header
         if skip is True:
@@ -126,31 +86,14 @@ def main():
                 skip = True
                 continue
 
-            # process prev sequence
-            if sequence != '' and len(sequence) % 3 == 0 and start_stop_ok(sequence):
-                for i in range(0, len(sequence), 3):
-                    codon = sequence[i:i+3]
-
-                    # skip codons with Ns
-                    if 'N' in codon:
-                        continue
-
-                    base_pos = coords[i:i+3]
-                    for pos in range(0, 3):
-                        degen = degeneracy([codon, pos])
-                        site_pos = base_pos[pos]
-                        if chromo not in degen_data.keys():
-                            degen_data[chromo] = {}
-                        if trans_name not in degen_data[chromo].keys():
-                            degen_data[chromo][trans_name] = {}
-                        if degen not in degen_data[chromo][trans_name].keys():
-                            degen_data[chromo][trans_name][degen] = set()
-                        degen_data[chromo][trans_name][degen] |= {site_pos}
+            # prev sequence
+            if sequence != '':
+                yield trans_name, chromo, sequence, coords
 
             # reset holders and store details of next sequence
             sequence = ''
             header_info = line.split(';')[1]
-            chromo = header_info.split(':')[0].replace('loc=', '')
+            chromo = header_info.split(':')[0].replace('loc=', '').strip()
             trans_name = line.split(' ')[0].strip('>')
             if '(' in header_info:
                 method = header_info.split('(')[0].split(':')[1]
@@ -163,25 +106,247 @@ def main():
         else:
             sequence += line.rstrip()
 
-    # process last seq in file
-    for i in range(0, len(sequence), 3):
-        codon = sequence[i:i + 3]
+    # final sequence
+    if sequence != '':
+        yield trans_name, chromo, sequence, coords
+
+
+def transcript_codons(sequence, coords):
+
+    """
+    yields the codons of a complete transcript without Ns, excluding the stop codon,
+    with their 1-based coordinates, nothing is yielded for incomplete transcripts
+    :param sequence: str
+    :param coords: list
+    :return: generator
+    """
+
+    if sequence != '' and len(sequence) % 3 == 0 and start_stop_ok(sequence):
+        for i in range(0, len(sequence) - 3, 3):
+            codon = sequence[i:i + 3]
+
+            # skip codons with Ns
+            if 'N' in codon:
+                continue
+
+            yield codon, coords[i:i + 3]
 
-        # skip codons with Ns
-        if 'N' in codon:
-            continue
 
-        base_pos = coords[i:i + 3]
+def prem_stop_sites(sequence, coords):
+
+    """
+    yields the 1-based position of each site of a transcript where a premature stop is possible,
+    with its codon, position in the codon and the codon coordinates
+    :param sequence: str
+    :param coords: list
+    :return: generator
+    """
+
+    for codon, base_pos in transcript_codons(sequence, coords):
         for pos in range(0, 3):
-            degen = degeneracy([codon, pos])
-            site_pos = base_pos[pos]
-            if chromo not in degen_data.keys():
-                degen_data[chromo] = {}
-            if trans_name not in degen_data[chromo].keys():
-                degen_data[chromo][trans_name] = {}
+            if prem_stop(codon, pos):
+                yield base_pos[pos], codon, pos, base_pos
+
+
+def transcript_degeneracies(cds_fa):
+
+    """
+    yields the positions of each degeneracy class in each complete transcript of a CDS fasta,
+    the stop codon included
+    :param cds_fa: str
+    :return: generator
+    """
+
+    for trans_name, chromo, sequence, coords in cds_transcripts(cds_fa):
+        if not (len(sequence) % 3 == 0 and start_stop_ok(sequence)):
+            continue
+
+        # codons with Ns are skipped
+        degens = classify_cds(sequence)[0][:len(coords)]
+        coords = numpy.array(coords[:len(degens)], dtype=numpy.int64)
+        trans_degens = {}
+        for degen in numpy.unique(degens):
+            if degen != NO_CODON:
+                trans_degens[int(degen)] = set(coords[degens == degen].tolist())
+
+        yield trans_name, chromo, trans_degens
+
+
+def contig_track(chr_degen_data):
+
+    """
+    returns the per base degeneracy of a contig from the degeneracy classes of its transcripts,
+    sites in more than one class of a transcript, as pos_unique finds, or in different classes in
+    different transcripts are AMBIGUOUS and sites in no transcript NON_CODING
+    :param chr_degen_data: dict
+    :return: numpy.array
+    """
+
+    positions = []
+    classes = []
+    for trans_degens in chr_degen_data.values():
+        site_class = {}
+        for degen, sites in trans_degens.items():
+            for site in sites:
+                site_class[site] = degen if site not in site_class else AMBIGUOUS
+        positions += site_class.keys()
+        classes += site_class.values()
+
+    positions = numpy.array(positions, dtype=numpy.int64) - 1
+    classes = numpy.array(classes, dtype=numpy.uint8)
+    length = int(positions.max()) + 1 if len(positions) else 0
+
+    low = numpy.full(length, NON_CODING, dtype=numpy.uint8)
+    high = numpy.zeros(length, dtype=numpy.uint8)
+    numpy.minimum.at(low, positions, classes)
+    numpy.maximum.at(high, positions, classes)
+
+    track = numpy.full(length, NON_CODING, dtype=numpy.uint8)
+    covered = numpy.bincount(positions, minlength=length) > 0
+    track[covered] = numpy.where(low == high, low, AMBIGUOUS)[covered]
+
+    return track
+
+
+def track_intervals(track, degens):
+
+    """
+    returns the merged 0-based half open intervals of the sites of a track in any of the given classes
+    :param track: numpy.array
+    :param degens: list
+    :return: numpy.array, numpy.array
+    """
+
+    in_class = numpy.zeros(len(track) + 2, dtype=numpy.int8)
+    in_class[1:-1] = numpy.in1d(track, degens)
+    edges = numpy.diff(in_class)
+
+    return numpy.flatnonzero(edges == 1), numpy.flatnonzero(edges == -1)
+
+
+class DegeneracyTrack(object):
+
+    """
+    memory mapped per base degeneracy of each contig, as written by degen_to_bed.py -track_dir
+    """
+
+    def __init__(self, track_dir):
+
+        """
+        :param track_dir: str
+        """
+
+        self.track_dir = track_dir
+        self.loaded = {}
+
+    def track_file(self, chromo):
+        return os.path.join(self.track_dir, chromo + '.npy')
+
+    def __contains__(self, chromo):
+        return os.path.isfile(self.track_file(chromo))
+
+    def contig(self, chromo):
+
+        """
+        returns the track of a contig, empty if the contig has no transcripts
+        :param chromo: str
+        :return: numpy.array
+        """
+
+        if chromo not in self.loaded:
+            if chromo in self:
+                self.loaded[chromo] = numpy.load(self.track_file(chromo), mmap_mode='r')
+            else:
+                self.loaded[chromo] = numpy.array([], dtype=numpy.uint8)
+
+        return self.loaded[chromo]
+
+    def degeneracy(self, chromo, positions):
+
+        """
+        returns the track value at each 0-based position, NON_CODING beyond the last coding site
+        :param chromo: str
+        :param positions: numpy.array
+        :return: numpy.array
+        """
+
+        track = self.contig(chromo)
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        values = numpy.full(len(positions), NON_CODING, dtype=numpy.uint8)
+        in_track = (positions >= 0) & (positions < len(track))
+        values[in_track] = track[positions[in_track]]
+
+        return values
+
+    def site_degeneracy(self, chromo, position):
+
+        """
+        returns the track value at a single 0-based position
+        :param chromo: str
+        :param position: int
+        :return: int
+        """
+
+        track = self.contig(chromo)
+        if 0 <= position < len(track):
+            return int(track[position])
+
+        return NON_CODING
+
+
+def main():
+    # arguments
+    parser = argparse.ArgumentParser(description='Script that outputs the position of '
+                                                 'degenerate sites in coding regions to a bed file, '
+                                                 'and optionally writes a per base degeneracy track')
+    parser.add_argument('-cds_fa', help='Fasta file with CDS sequences in', required=True)
+    parser.add_argument('-degen', help='Degeneracy of sites to extract positions for',
+                        action='append', choices=DEGEN_CLASSES, type=int, default=[])
+    parser.add_argument('-track_dir', help='If specified writes a memory mapped uint8 array of the degeneracy of '
+                                           'each site of each contig to this directory, 254 for sites of conflicting '
+                                           'degeneracy and 255 for non coding sites', default=None)
+    parser.add_argument('-merged', help='If specified outputs merged intervals of sites of the -degen classes that '
+                                        'all transcripts agree on, rather than a line per transcript site',
+                        action='store_true', default=False)
+    args = parser.parse_args()
+
+    if len(args.degen) == 0 and args.track_dir is None:
+        sys.exit('-degen must be specified unless -track_dir is specified')
+    if args.merged is True and len(args.degen) == 0:
+        sys.exit('-degen must be specified in conjunction with -merged')
+
+    # variables
+    fa = args.cds_fa
+    out_degens = set(args.degen)
+    degen_data = {}
+
+    # degeneracy of sites in each transcript
+    for trans_name, chromo, trans_degens in transcript_degeneracies(fa):
+        if chromo not in degen_data.keys():
+            degen_data[chromo] = {}
+        if trans_name not in degen_data[chromo].keys():
+            degen_data[chromo][trans_name] = {}
+        for degen, sites in trans_degens.items():
             if degen not in degen_data[chromo][trans_name].keys():
                 degen_data[chromo][trans_name][degen] = set()
-            degen_data[chromo][trans_name][degen] |= {site_pos}
+            degen_data[chromo][trans_name][degen] |= sites
+
+    # per base tracks
+    tracks = {}
+    if args.track_dir is not None or args.merged is True:
+        tracks = {x: contig_track(degen_data[x]) for x in degen_data.keys()}
+    if args.track_dir is not None:
+        if not os.path.isdir(args.track_dir):
+            os.makedirs(args.track_dir)
+        for contig, track in tracks.items():
+            save_array(os.path.join(args.track_dir, contig + '.npy'), track)
+
+    # output merged sites
+    if args.merged is True:
+        for contig in sorted(tracks.keys()):
+            for start, end in zip(*track_intervals(tracks[contig], list(out_degens))):
+                print(contig, start, end, sep='\t')
+        return
 
     # output sites
     for contig in sorted(degen_data.keys()):
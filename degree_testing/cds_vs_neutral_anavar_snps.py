@@ -5,8 +5,9 @@ import anavar_utils as an
 import argparse
 from qsub import *
 import sys
-import random
+import numpy
 from collections import Counter
+from sfs_bootstrap import sfs_replicates
 
 
 def read_callable_csv(csv):
@@ -22,14 +23,6 @@ def read_callable_csv(csv):
     return call_sites
 
 
-def resample_replace(site_freqs):
-    resamp_sfs = []
-    for i in range(0, len(site_freqs)):
-        random_no = random.randint(0, len(site_freqs) - 1)
-        resamp_sfs.append(site_freqs[random_no])
-    return resamp_sfs
-
-
 def sfs2counts(freq_list, n):
     pos_biallelic_freqs = [round(i / float(n), 3) for i in range(1, int(n))]
 
@@ -48,25 +41,19 @@ def sfs2counts(freq_list, n):
     return counts
 
 
-def snp_sel_v_neu_anavar(snp_sfs, snp_m, n_sfs, n_m, constraint, bootstrap, n, c, dfe, out_stem, fold, degree, search):
+def snp_sel_v_neu_anavar(snp_sfs, snp_m, n_sfs, n_m, constraint, bootstrap, n, c, dfe, out_stem, fold, degree, search,
+                         seed=None):
 
     anavar_path = '/shared/evolgen1/shared_data/program_files/sharc/'
 
     anavar_cmd = '{path}anavar1.22 {ctl} {rslts} {log}'
 
-    for i in [0] + range(1, bootstrap+1):
-
-        # sort sfs
-        if i == 0:
-            sfs = snp_sfs
-            sfs_n = n_sfs
-        else:
-            sfs = resample_replace(snp_sfs)
-            sfs_n = resample_replace(n_sfs)
+    # anavar format sfs and all bootstrap replicates, resampled from the sites of each sfs
+    rng = numpy.random.RandomState(seed)
+    snp_reps = sfs_replicates(sfs2counts(snp_sfs, n), bootstrap, rng, len(snp_sfs))
+    n_reps = sfs_replicates(sfs2counts(n_sfs, n), bootstrap, rng, len(n_sfs))
 
-        # convert to correct format for anavar
-        sfs = sfs2counts(sfs, n)
-        sfs_n = sfs2counts(sfs_n, n)
+    for i, (sfs, sfs_n) in enumerate(zip(snp_reps, n_reps)):
 
         # sort file names
         ctl_name = out_stem + '.rep{}.control.txt'.format(i)
@@ -108,6 +95,8 @@ def main():
                         default='none')
     parser.add_argument('-call_csv', help='Callable sites summary file', required=True)
     parser.add_argument('-bootstrap', help='Number of bootstrap replicates', default=0, type=int)
+    parser.add_argument('-seed', help='Random seed for bootstrapping, for reproducible replicates', type=int,
+                        default=None)
     parser.add_argument('-out_pre', help='File path and prefix for output', required=True)
     parser.add_argument('-n_search', help='Number of searches to conduct', default=500, type=int)
     parser.add_argument('-degree', help='changes degree setting in anavar', default=50, type=int)
@@ -173,7 +162,8 @@ def main():
                          n=args.n, c=args.c, dfe=args.dfe,
                          out_stem=out_pre,
                          degree=args.degree,
-                         search=args.n_search)
+                         search=args.n_search,
+                         seed=args.seed)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import argparse
+import os
+import numpy
+from pysam import VariantFile
+from file_cache import file_checksum
+from vcf_blocks import site_blocks, contig_length, SiteRecord
+
+# per base flags
+RECORD = 1
+REF_N = 2
+HAS_DP = 4
+ALLELES = 8
+
+MAX_DEPTH = numpy.iinfo(numpy.uint16).max
+BLOCK_SITES = 4 * 1024 * 1024
+
+
+def cache_path(vcf_file, cache_dir=None):
+
+    """
+    returns the cache directory of a vcf, named by its checksum so an edited vcf never
+    reads a stale cache
+    :param vcf_file: str
+    :param cache_dir: str
+    :return: str
+    """
+
+    if cache_dir is None:
+        cache_dir = os.path.dirname(os.path.abspath(vcf_file))
+
+    return os.path.join(cache_dir, '{}.{}.depth_cache'.format(os.path.basename(vcf_file), file_checksum(vcf_file)))
+
+
+def save_array(out_file, array):
+
+    """
+    writes a .npy file via a temporary name so a partly written array is never read
+    :param out_file: str
+    :param array: numpy.array
+    :return: None
+    """
+
+    tmp_file = '{}.{}.tmp.npy'.format(out_file, os.getpid())
+    numpy.save(tmp_file, array)
+    os.rename(tmp_file, out_file)
+
+
+def build_contig_cache(vcf_file, chromo, cache):
+
+    """
+    extracts the depth, N and allele state of every base of a contig from the vcf in one pass.
+    The first record at each position fills the per base arrays, later records at the same position
+    and records with multi base alleles are kept in a small side table
+    :param vcf_file: str
+    :param chromo: str
+    :param cache: str
+    :return: int
+    """
+
+    if not os.path.isdir(cache):
+        try:
+            os.makedirs(cache)
+        except OSError:
+            if not os.path.isdir(cache):
+                raise
+
+    size = (contig_length(vcf_file, chromo) or 0) + 1
+    depth = numpy.zeros(size, dtype=numpy.uint16)
+    flags = numpy.zeros(size, dtype=numpy.uint8)
+    ref = numpy.zeros(size, dtype=numpy.uint8)
+    alt = numpy.zeros(size, dtype=numpy.uint8)
+
+    n_records = 0
+    extra_file = os.path.join(cache, chromo + '.extra.txt')
+    with open(extra_file + '.tmp', 'w') as extra:
+        for block in site_blocks(vcf_file, chromo):
+            pos = block.pos
+            if len(pos) == 0:
+                continue
+            n_records += len(pos)
+
+            # records beyond the contig length in the header
+            if pos.max() >= size:
+                size = pos.max() + 1
+                depth, flags, ref, alt = [numpy.append(x, numpy.zeros(size - len(x), dtype=x.dtype))
+                                          for x in [depth, flags, ref, alt]]
+
+            duplicate = (flags[pos] & RECORD) > 0
+            duplicate[1:] |= pos[1:] == pos[:-1]
+
+            buf = numpy.frombuffer(block.text, dtype=numpy.uint8)
+            ref_start, alt_start = block.field_starts[:, 3], block.field_starts[:, 4]
+            single_base = ((block.field_ends[:, 3] - ref_start == 1) &
+                           (block.field_ends[:, 4] - alt_start == 1))
+            alt_base = numpy.where(buf[alt_start] == ord('.'), 0, buf[alt_start])
+
+            first = ~duplicate
+            first_pos = pos[first]
+            flags[first_pos] = (RECORD | block.ref_n[first] * REF_N | block.has_dp[first] * HAS_DP |
+                                ~single_base[first] * ALLELES)
+            depth[first_pos] = numpy.minimum(block.dp[first], MAX_DEPTH)
+            ref[first_pos] = numpy.where(single_base[first], buf[ref_start[first]], 0)
+            alt[first_pos] = numpy.where(single_base[first], alt_base[first], 0)
+
+            for i in numpy.flatnonzero(duplicate | ~single_base):
+                record = block.record(i)
+                if record.alts is None:
+                    alt_allele = '.'
+                else:
+                    alt_allele = record.alts[0]
+                print(record.pos, int(duplicate[i]), int(block.has_dp[i]), int(block.dp[i]),
+                      record.ref, alt_allele, sep='\t', file=extra)
+
+    os.rename(extra_file + '.tmp', extra_file)
+    for name, array in [('depth', depth), ('flags', flags), ('ref', ref), ('alt', alt)]:
+        save_array(os.path.join(cache, '{}.{}.npy'.format(chromo, name)), array)
+
+    # written last, marks the contig as complete
+    with open(os.path.join(cache, chromo + '.done'), 'w') as done:
+        print(n_records, file=done)
+
+    return n_records
+
+
+class ContigDepth(object):
+
+    """
+    memory mapped per base arrays of one contig of a depth cache
+    """
+
+    def __init__(self, cache, chromo):
+
+        """
+        :param cache: str
+        :param chromo: str
+        """
+
+        self.contig = chromo
+        self.depth, self.flags, self.ref, self.alt = [
+            numpy.load(os.path.join(cache, '{}.{}.npy'.format(chromo, x)), mmap_mode='r')
+            for x in ['depth', 'flags', 'ref', 'alt']]
+
+        extra_pos, duplicate, has_dp, dp, self.extra_ref, self.extra_alt = [], [], [], [], [], []
+        for line in open(os.path.join(cache, chromo + '.extra.txt')):
+            line = line.rstrip('\n').split('\t')
+            extra_pos.append(int(line[0]))
+            duplicate.append(line[1] == '1')
+            has_dp.append(line[2] == '1')
+            dp.append(int(line[3]))
+            self.extra_ref.append(line[4])
+            self.extra_alt.append(line[5])
+
+        self.extra_pos = numpy.array(extra_pos, dtype=numpy.int64)
+        self.extra_duplicate = numpy.array(duplicate, dtype=bool)
+        self.extra_has_dp = numpy.array(has_dp, dtype=bool)
+        self.extra_dp = numpy.array(dp, dtype=float)
+
+    def __len__(self):
+        return len(self.flags)
+
+
+class CachedSiteBlock(object):
+
+    """
+    a block of records rebuilt from a depth cache, with the same attributes as a SiteBlock
+    so it can be classified in the same way
+    """
+
+    def __init__(self, contig_depth, low, high):
+
+        """
+        gathers the records at positions low to high - 1, duplicate records follow the first
+        record at their position in vcf order
+        :param contig_depth: ContigDepth
+        :param low: int
+        :param high: int
+        """
+
+        self.contig = contig_depth.contig
+        self.contig_depth = contig_depth
+
+        flags = numpy.asarray(contig_depth.flags[low:high])
+        first_pos = numpy.flatnonzero(flags & RECORD) + low
+        first_flags = flags[first_pos - low]
+
+        # side table rows, first records with multi base alleles and duplicate records
+        rows = numpy.flatnonzero((contig_depth.extra_pos >= low) & (contig_depth.extra_pos < high))
+        dup_rows = rows[contig_depth.extra_duplicate[rows]]
+        allele_rows = rows[~contig_depth.extra_duplicate[rows]]
+
+        pos = numpy.concatenate([first_pos, contig_depth.extra_pos[dup_rows]])
+        order = numpy.argsort(pos, kind='mergesort')
+        self.pos = pos[order]
+
+        self.ref_n = numpy.concatenate([(first_flags & REF_N) > 0,
+                                        numpy.array([contig_depth.extra_ref[x] == 'N' for x in dup_rows],
+                                                    dtype=bool)])[order]
+        self.has_dp = numpy.concatenate([(first_flags & HAS_DP) > 0,
+                                         contig_depth.extra_has_dp[dup_rows]])[order]
+        self.dp = numpy.concatenate([numpy.asarray(contig_depth.depth[first_pos], dtype=float),
+                                     contig_depth.extra_dp[dup_rows]])[order]
+
+        # row of the side table holding the alleles of each record, -1 if held in the per base arrays
+        row = numpy.full(len(first_pos), -1, dtype=numpy.int64)
+        if len(allele_rows):
+            row[numpy.searchsorted(first_pos, contig_depth.extra_pos[allele_rows])] = allele_rows
+        self.allele_row = numpy.concatenate([row, dup_rows])[order]
+
+    def __len__(self):
+        return len(self.pos)
+
+    def record(self, i):
+
+        """
+        returns a lightweight record for site i that can be passed to polarisable()
+        :param i: int
+        :return: SiteRecord
+        """
+
+        pos = int(self.pos[i])
+        row = self.allele_row[i]
+        if row >= 0:
+            ref, alt = self.contig_depth.extra_ref[row], self.contig_depth.extra_alt[row]
+        else:
+            ref, alt = chr(self.contig_depth.ref[pos]), self.contig_depth.alt[pos]
+            alt = '.' if alt == 0 else chr(alt)
+
+        if alt == '.':
+            alts = None
+        else:
+            alts = (alt,)
+
+        return SiteRecord(self.contig, pos, ref, alts)
+
+    def alleles(self):
+
+        """
+        returns the first base of the ref and first alt allele of each record, whether each of the two is a
+        single base and whether the record is monomorphic, as SiteBlock.alleles()
+        :return: numpy.array, numpy.array, numpy.array, numpy.array, numpy.array
+        """
+
+        in_arrays = self.allele_row < 0
+        ref_first = numpy.zeros(len(self.pos), dtype=numpy.uint8)
+        alt_first = numpy.zeros(len(self.pos), dtype=numpy.uint8)
+        ref_single = in_arrays.copy()
+        alt_single = in_arrays.copy()
+
+        # single base alleles of first records sit in the per base arrays
+        ref_first[in_arrays] = self.contig_depth.ref[self.pos[in_arrays]]
+        alt_first[in_arrays] = self.contig_depth.alt[self.pos[in_arrays]]
+
+        # the side table holds the ref and first alt allele of the rest
+        for i in numpy.flatnonzero(~in_arrays):
+            row = self.allele_row[i]
+            ref, alt = self.contig_depth.extra_ref[row], self.contig_depth.extra_alt[row]
+            ref_first[i], ref_single[i] = ord(ref[0]), len(ref) == 1
+            if alt != '.':
+                alt_first[i], alt_single[i] = ord(alt[0]), len(alt) == 1
+
+        mono = alt_first == 0
+        alt_single &= ~mono
+
+        return ref_first, ref_single, alt_first, alt_single, mono
+
+
+class DepthCache(object):
+
+    """
+    per base depth, N and allele cache of an allsites vcf, keyed by the vcf checksum
+    """
+
+    def __init__(self, vcf_file, cache_dir=None):
+
+        """
+        :param vcf_file: str
+        :param cache_dir: str
+        """
+
+        self.vcf_file = vcf_file
+        self.path = cache_path(vcf_file, cache_dir)
+
+    def has_contig(self, chromo):
+        return os.path.isfile(os.path.join(self.path, chromo + '.done'))
+
+    def build(self, chromo):
+
+        """
+        extracts a contig from the vcf into the cache
+        :param chromo: str
+        :return: int
+        """
+
+        return build_contig_cache(self.vcf_file, chromo, self.path)
+
+    def contig(self, chromo):
+
+        """
+        returns the arrays of a contig, extracting it from the vcf first if it is not yet cached
+        :param chromo: str
+        :return: ContigDepth
+        """
+
+        if not self.has_contig(chromo):
+            self.build(chromo)
+
+        return ContigDepth(self.path, chromo)
+
+    def site_blocks(self, chromo, start=None, stop=None, block_sites=BLOCK_SITES):
+
+        """
+        streams the records of a chromosome or region from the cache in blocks, mirroring
+        vcf_blocks.site_blocks(), only records with 0-based positions within [start, stop) are returned
+        :param chromo: str
+        :param start: int
+        :param stop: int
+        :param block_sites: int
+        :return: generator
+        """
+
+        contig_depth = self.contig(chromo)
+
+        # arrays are indexed by the 1-based vcf position
+        low = 1 if start is None else start + 1
+        high = len(contig_depth) if stop is None else min(stop + 1, len(contig_depth))
+
+        for block_low in range(low, high, block_sites):
+            block = CachedSiteBlock(contig_depth, block_low, min(block_low + block_sites, high))
+            if len(block):
+                yield block
+
+
+def main():
+
+    # arguments
+    parser = argparse.ArgumentParser(description='Extracts the per base depth cache of an allsites vcf')
+    parser.add_argument('-vcf', help='Allsites vcf to cache', required=True)
+    parser.add_argument('-chr', help='Contig to cache, if not specified all contigs in the vcf header are cached',
+                        default='ALL')
+    parser.add_argument('-cache_dir', help='Directory to hold the cache, defaults to the vcf directory',
+                        default=None)
+    args = parser.parse_args()
+
+    cache = DepthCache(args.vcf, args.cache_dir)
+    if args.chr == 'ALL':
+        chromo_list = list(VariantFile(args.vcf).header.contigs)
+    else:
+        chromo_list = [args.chr]
+
+    for chromo in chromo_list:
+        print(chromo, cache.build(chromo), sep='\t')
+
+    print(cache.path)
+
+
+if __name__ == '__main__':
+    main()
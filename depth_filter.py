@@ -3,21 +3,77 @@
 from __future__ import print_function
 import argparse
 import re
+import sys
+import numpy
+from vcf_blocks import file_site_blocks, sample_mean_depths, write_sample_depths, read_sample_depths, \
+    samples_within_depth
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-vcf', '--vcf', help='Location of vcf file to filter', required=True)
 parser.add_argument('-DF', '--DepthFilter',
                     help='Defines abnormal depth eg) 2 means abnormal depth is twice and half the mean depth',
                     default=2.0, type=float)
-parser.add_argument('-mean_depth', '--mean_depth', help='Mean coverage depth of samples', required=True)
-parser.add_argument('-N', '--no_individuals', help='Number of individuals in VCF', type=float, required=True)
+parser.add_argument('-mean_depth', '--mean_depth', help='Mean coverage depth of samples, required unless '
+                                                        '-min_samples is specified')
+parser.add_argument('-N', '--no_individuals', help='Number of individuals in VCF, required unless '
+                                                   '-min_samples is specified', type=float)
+parser.add_argument('-min_samples', help='If specified filters on the FORMAT/DP of each sample rather than INFO/DP, '
+                                         'a variant passes if at least this many samples are within DF fold of '
+                                         'their own mean depth', type=int, default=None)
+parser.add_argument('-sample_depths', help='Mean depth of each sample for -min_samples, as output by vcftools '
+                                           '--depth, if not specified means are taken from a first pass of the vcf',
+                    default=None)
 args = parser.parse_args()
 
+if args.min_samples is None and (args.mean_depth is None or args.no_individuals is None):
+    parser.error('-mean_depth and -N are required unless -min_samples is specified')
+
 # variables
 vcf = args.vcf
 destination = vcf.rstrip('vcf')+'dpfiltered.vcf'
 output_vcf = open(destination, 'w')
 filter_factor = args.DepthFilter
+
+# filter vcf on the depth of each sample
+if args.min_samples is not None:
+    in_vcf = open(vcf)
+    samples = []
+    while True:
+        line = in_vcf.readline()
+        output_vcf.write(line)
+        if line.startswith('#CHROM') or line == '':
+            samples = line.rstrip('\n').split('\t')[9:]
+            break
+    header_end = in_vcf.tell()
+
+    # first pass for the mean depth of each sample
+    if args.sample_depths is not None:
+        sample_means = read_sample_depths(args.sample_depths, samples)
+    else:
+        n_sites, sample_means = sample_mean_depths(file_site_blocks(in_vcf), len(samples))
+        write_sample_depths(vcf.rstrip('vcf') + 'idepth', samples, n_sites, sample_means)
+        in_vcf.seek(header_end)
+
+    lower_depth_limits = sample_means / filter_factor
+    upper_depth_limits = sample_means * filter_factor
+
+    number_failed = 0
+    number_passed = 0
+    for block in file_site_blocks(in_vcf):
+        passed = samples_within_depth(block.sample_depths(),
+                                      lower_depth_limits, upper_depth_limits)[0] >= args.min_samples
+        number_passed += int(passed.sum())
+        number_failed += int((~passed).sum())
+        output_vcf.write(''.join([block.line(i) for i in numpy.flatnonzero(passed)]))
+
+    output_vcf.close()
+
+    for sample, lower_depth_limit, upper_depth_limit in zip(samples, lower_depth_limits, upper_depth_limits):
+        print(sample + ' depth range: ' + str(lower_depth_limit) + ' - ' + str(upper_depth_limit))
+    print(str(number_passed) + ' variants passed, ' + str(number_failed) + ' variants failed')
+    print('Output written to ' + destination)
+    sys.exit()
+
 all_data_mean_depth = float(args.mean_depth)
 no_indiv = args.no_individuals
 
@@ -2,11 +2,13 @@
 
 from __future__ import print_function
 import argparse
-import gzip
 import subprocess
 import pysam
 from vcf2raw_sfs import get_out_freq
-from degen_to_bed import start_stop_ok, cds_coord_to_codon_coords
+from degen_to_bed import cds_transcripts, transcript_codons, prem_stop_sites
+from codons import prem_stop
+from callable_mask import CallableMask
+from transcript_callable import read_callable_table, prem_stop_callable_counts
 
 
 def reverse_strand(codon_coords):
@@ -79,36 +81,6 @@ def snp_makes_stop(pysam_snp, codon_pos, codon, codon_coords):
     return stop
 
 
-def prem_stop(codon, pos, bases=('A', 'T', 'G', 'C')):
-
-    """
-    goes through a list of bases and sees if any make a stop codon
-    :param codon: str
-    :param pos: int
-    :param bases: set
-    :return: bool
-    """
-
-    stops = {'TAG', 'TGA', 'TAA'}
-
-    for base in bases:
-
-        # construct possible codons
-        if pos == 0:
-            alt_codon = base + codon[1:]
-        elif pos == 1:
-            alt_codon = codon[0] + base + codon[2]
-        elif pos == 2:
-            alt_codon = codon[0:2] + base
-        else:
-            raise IndexError
-
-        if alt_codon in stops:
-            return True
-
-    return False
-
-
 def cds_snp_coords(vcf):
 
     """
@@ -132,15 +104,17 @@ def cds_snp_coords(vcf):
     return cds_snps_dict
 
 
-def process_transcript(sequence, coords, trans_name, nonsense_data, call_seq, snps, chromo, vcf_records, n, pol):
+def process_transcript(sequence, coords, trans_name, nonsense_data, call_seq, call_counts, snps, chromo,
+                       vcf_records, n, pol):
 
     """
-    calculates length, call sites and nonsense snps for a transcript
+    records length, call sites and nonsense snps for a transcript
     :param sequence: str
     :param coords: list
     :param trans_name: str
     :param nonsense_data: dict
-    :param call_seq: str
+    :param call_seq: ContigMask
+    :param call_counts: dict
     :param snps: set
     :param chromo: str
     :param vcf_records: pysam.VariantFile
@@ -149,62 +123,41 @@ def process_transcript(sequence, coords, trans_name, nonsense_data, call_seq, sn
     :return: None
     """
 
-    if sequence != '' and len(sequence) % 3 == 0 and start_stop_ok(sequence):
-        for i in range(0, len(sequence) - 3, 3):
-
-            length = len(sequence)
-            codon = sequence[i:i + 3]
-
-            # skip codons with Ns
-            if 'N' in codon:
-                continue
-
-            base_pos = coords[i:i + 3]
-
-            for pos in range(0, 3):
-                site_pos = base_pos[pos]
-                if trans_name not in nonsense_data.keys():
-                    nonsense_data[trans_name] = {'length': length, 'call': 0, 'freqs': []}
+    # transcripts are recorded once they have a codon without Ns
+    if trans_name not in nonsense_data.keys():
+        for codon in transcript_codons(sequence, coords):
+            nonsense_data[trans_name] = {'length': len(sequence), 'call': call_counts.get(trans_name, 0),
+                                         'freqs': []}
+            break
 
-                # is a premature stop possible?
-                if prem_stop(codon, pos):
+    for site_pos, codon, pos, base_pos in prem_stop_sites(sequence, coords):
 
-                    # skip if site is not callable
-                    call = call_seq[site_pos - 1]
+        # skip if site is not callable
+        call = call_seq[site_pos - 1]
 
-                    if pol is False:
-                        call = call.upper()
+        if pol is False:
+            call = call.upper()
 
-                    if call != 'K':
-                        continue
-
-                    nonsense_data[trans_name]['call'] += 1
-
-                    # if snp at site
-                    if site_pos in snps[chromo]:
-
-                        # check not an MNP
-                        if multi_nucleotide_poly(site_pos, snps[chromo], pos):
-                            continue
+        if call != 'K':
+            continue
 
-                        # does it introduce a stop?
-                        snp_data = list(vcf_records.fetch(chromo, site_pos - 1, site_pos))
-                        snp_record = snp_data[0]
+        # if snp at site
+        if site_pos in snps[chromo]:
 
-                        # skip snps that don't make stop
-                        if not snp_makes_stop(snp_record, pos, codon, base_pos):
-                            continue
+            # check not an MNP
+            if multi_nucleotide_poly(site_pos, snps[chromo], pos):
+                continue
 
-                        frequency = get_out_freq(snp_record, pol, 'snp', n)
-                        nonsense_data[trans_name]['freqs'].append(frequency)
+            # does it introduce a stop?
+            snp_data = list(vcf_records.fetch(chromo, site_pos - 1, site_pos))
+            snp_record = snp_data[0]
 
-                    # move on if no snp at position
-                    else:
-                        continue
+            # skip snps that don't make stop
+            if not snp_makes_stop(snp_record, pos, codon, base_pos):
+                continue
 
-                # if site cannot give a premature stop
-                else:
-                    continue
+            frequency = get_out_freq(snp_record, pol, 'snp', n)
+            nonsense_data[trans_name]['freqs'].append(frequency)
 
 
 def main():
@@ -216,6 +169,9 @@ def main():
     parser.add_argument('-call_fa', help='Callable sites fasta file', required=True)
     parser.add_argument('-n', help='Sample size', required=True, type=int)
     parser.add_argument('-unfolded', help='If specified outputs unfolded data', default=False, action='store_true')
+    parser.add_argument('-call_table', help='Per transcript callable sites table from transcript_callable.py '
+                                            'with a prem_stop class, if not specified callable premature stop '
+                                            'sites are counted from -call_fa', default=None)
     parser.add_argument('-out', help='output file', required=True)
     args = parser.parse_args()
 
@@ -224,51 +180,25 @@ def main():
     nonsense_data = {}
     snps = cds_snp_coords(args.vcf)
     vcf_records = pysam.VariantFile(args.vcf)
-    call_fa = pysam.FastaFile(args.call_fa)
-    call_seq = call_fa.fetch(args.chr)
+    call_mask = CallableMask(args.call_fa)
+    call_seq = call_mask[args.chr]
     n = args.n
     pol_state = args.unfolded
+    call_column = 'pol' if pol_state else 'all'
 
-    # loop through fasta
-    sequence, chromo, coords, skip, trans_name = '', '', [], False, ''
-
-    for line in gzip.open(fa):
-
-        # skip sequence line following skipped header
-        if skip is True:
-            skip = False
-            continue
-
-        # if a header line
-        if line.startswith('>'):
-
-            # skips records with both and forward and reverse strand in coords
-            if 'complement' in line and 'join' in line:
-                skip = True
-                continue
-
-            # process prev sequence
-            process_transcript(sequence, coords, trans_name, nonsense_data,
-                               call_seq, snps, chromo, vcf_records, n, pol_state)
-
-            # reset holders and store details of next sequence
-            sequence = ''
-            header_info = line.split(';')[1]
-            chromo = header_info.split(':')[0].replace('loc=', '').strip()
-            trans_name = line.split(' ')[0].strip('>')
-            if '(' in header_info:
-                method = header_info.split('(')[0].split(':')[1]
-                coords = cds_coord_to_codon_coords(header_info.split('(')[1].rstrip(')'), method)
-            else:
-                method = 'join'
-                coords = cds_coord_to_codon_coords(header_info.split(':')[1], method)
-
-        # if a sequence line add to seq string
-        else:
-            sequence += line.rstrip()
+    # callable prem stop sites per transcript, from the shared table or counted for this fasta
+    if args.call_table is not None:
+        call_table = read_callable_table(args.call_table)
+        call_counts = {x: call_table[x]['prem_stop'][call_column] for x in call_table
+                       if 'prem_stop' in call_table[x]}
+    else:
+        call_counts = {x: y[call_column] for x, y in
+                       prem_stop_callable_counts(call_mask, fa, args.chr)[0].items()}
 
-    # process final sequence
-    process_transcript(sequence, coords, trans_name, nonsense_data, call_seq, snps, chromo, vcf_records, n, pol_state)
+    # loop through fasta
+    for trans_name, chromo, sequence, coords in cds_transcripts(fa):
+        process_transcript(sequence, coords, trans_name, nonsense_data,
+                           call_seq, call_counts, snps, chromo, vcf_records, n, pol_state)
 
     # output sites
     with open(args.out, 'w') as out:
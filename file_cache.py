@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import argparse
+import hashlib
+import os
+
+READ_BYTES = 16 * 1024 * 1024
+
+
+def file_checksum(file_name):
+
+    """
+    returns the md5 checksum of a file, the result is kept in a <file>.md5 sidecar alongside the
+    file's size and modification time so large files are only read once
+    :param file_name: str
+    :return: str
+    """
+
+    stat = os.stat(file_name)
+    stamp = '{}\t{:.6f}'.format(stat.st_size, stat.st_mtime)
+    sidecar = file_name + '.md5'
+
+    # reuse the stored checksum if the file has not changed since it was taken
+    if os.path.isfile(sidecar):
+        stored = open(sidecar).read().rstrip('\n').split('\t')
+        if len(stored) == 3 and '\t'.join(stored[1:]) == stamp:
+            return stored[0]
+
+    md5 = hashlib.md5()
+    with open(file_name, 'rb') as in_file:
+        while True:
+            chunk = in_file.read(READ_BYTES)
+            if not chunk:
+                break
+            md5.update(chunk)
+    checksum = md5.hexdigest()
+
+    # sidecar is optional, so a read only directory just means no memoisation
+    try:
+        tmp_sidecar = '{}.{}.tmp'.format(sidecar, os.getpid())
+        with open(tmp_sidecar, 'w') as out:
+            print(checksum, stamp, sep='\t', file=out)
+        os.rename(tmp_sidecar, sidecar)
+    except (IOError, OSError):
+        pass
+
+    return checksum
+
+
+def main():
+
+    # arguments
+    parser = argparse.ArgumentParser(description='Prints the (memoised) md5 checksum of a file')
+    parser.add_argument('-file', help='File to checksum', required=True)
+    args = parser.parse_args()
+
+    print(file_checksum(args.file))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,13 +6,15 @@ import pysam
 import argparse
 from cds_vs_neutral_anavar import sfs2counts
 import subprocess
+import numpy
+from callable_mask import CallableMask
 
 
 def bed_call_sites(call_fa, region_bed):
 
     """
     returns number of callable sites for specied region in window
-    :param call_fa: pysam.FastaFile()
+    :param call_fa: CallableMask
     :param region_bed: pysam.TabixFile()
     :return: int
     """
@@ -21,12 +23,13 @@ def bed_call_sites(call_fa, region_bed):
     call_sites = 0
 
     for contig in contigs:
-        call_seq = call_fa.fetch(contig)
-        regions = region_bed.fetch(contig, parser=pysam.asTuple())
+        call_seq = call_fa[contig]
+        regions = [(int(reg[1]), int(reg[2])) for reg in region_bed.fetch(contig, parser=pysam.asTuple())]
+        if len(regions) == 0:
+            continue
 
-        for reg in regions:
-            call_sub_seq = call_seq[int(reg[1]): int(reg[2])]
-            call_sites += call_sub_seq.count('K')
+        starts, ends = numpy.array(regions, dtype=numpy.int64).T
+        call_sites += int(call_seq.count(starts, ends, 'K').sum())
 
     return call_sites
 
@@ -44,7 +47,7 @@ def main():
     # files
     vcf = args.vcf
     bed = pysam.TabixFile(args.fourfold)
-    call = pysam.FastaFile(args.call_fa)
+    call = CallableMask(args.call_fa)
 
     # get callable
     n_call = bed_call_sites(call_fa=call, region_bed=bed)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import gzip
+import numpy
+
+
+def read_bed_intervals(bed_file, chromo):
+
+    """
+    reads the start and end coordinates for one chromosome from a plain text or gzipped bed file
+    :param bed_file: str
+    :param chromo: str
+    :return: numpy.array, numpy.array
+    """
+
+    if bed_file.endswith('.gz'):
+        bed = gzip.open(bed_file)
+    else:
+        bed = open(bed_file)
+
+    starts = []
+    ends = []
+    for line in bed:
+        line = line.split()
+        if line[0] == chromo:
+            starts.append(int(line[1]))
+            ends.append(int(line[2]))
+
+    bed.close()
+
+    return numpy.array(starts, dtype=numpy.int64), numpy.array(ends, dtype=numpy.int64)
+
+
+def merge_intervals(starts, ends):
+
+    """
+    sorts and merges overlapping and adjacent half open intervals
+    :param starts: numpy.array
+    :param ends: numpy.array
+    :return: numpy.array, numpy.array
+    """
+
+    starts = numpy.asarray(starts, dtype=numpy.int64)
+    ends = numpy.asarray(ends, dtype=numpy.int64)
+
+    # drop empty intervals, they contain no bases
+    keep = ends > starts
+    starts, ends = starts[keep], ends[keep]
+
+    if len(starts) == 0:
+        return starts, ends
+
+    order = numpy.argsort(starts, kind='mergesort')
+    starts = starts[order]
+    ends = numpy.maximum.accumulate(ends[order])
+
+    # a new block starts wherever an interval begins after everything before it has ended
+    new_block = numpy.empty(len(starts), dtype=bool)
+    new_block[0] = True
+    new_block[1:] = starts[1:] > ends[:-1]
+
+    block_starts = numpy.flatnonzero(new_block)
+    block_ends = numpy.append(block_starts[1:], len(starts)) - 1
+
+    return starts[block_starts], ends[block_ends]
+
+
+def in_intervals(positions, starts, ends):
+
+    """
+    returns a boolean array marking which positions fall within a set of merged intervals
+    :param positions: numpy.array
+    :param starts: numpy.array
+    :param ends: numpy.array
+    :return: numpy.array
+    """
+
+    positions = numpy.asarray(positions, dtype=numpy.int64)
+
+    if len(starts) == 0:
+        return numpy.zeros(len(positions), dtype=bool)
+
+    idx = numpy.searchsorted(starts, positions, side='right') - 1
+    hit = idx >= 0
+    hit[hit] = positions[hit] < ends[idx[hit]]
+
+    return hit
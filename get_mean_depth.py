@@ -1,16 +1,50 @@
 #!/usr/bin/env python
 
+from __future__ import print_function
 import argparse
 from qsub import *
+import sys
+import numpy
+import pysam
+from depth_cache import DepthCache, RECORD, REF_N, HAS_DP
 
 # arguments
 parser = argparse.ArgumentParser()
 parser.add_argument('-vcf', help='vcf file to get mean depth for', required=True)
+parser.add_argument('-depth_cache', help='If specified calculates the mean INFO DP per individual across sites '
+                                         'from the per base depth cache of the vcf, rather than submitting a '
+                                         'vcftools job, the cache is extracted on first use',
+                    action='store_true', default=False)
+parser.add_argument('-cache_dir', help='Directory holding depth caches, defaults to the vcf directory', default=None)
 args = parser.parse_args()
 
 # variables
 vcf = args.vcf
 
+# mean depth from the cache
+if args.depth_cache:
+    cache = DepthCache(vcf, args.cache_dir)
+    no_indiv = len(pysam.VariantFile(vcf).header.samples)
+    total_depth = 0
+    total_sites = 0
+
+    print('contig', 'sites', 'mean_depth', sep='\t')
+    for chromo in pysam.TabixFile(vcf).contigs:
+        contig_depth = cache.contig(chromo)
+        flags = numpy.asarray(contig_depth.flags)
+        with_depth = (flags & (RECORD | HAS_DP | REF_N)) == (RECORD | HAS_DP)
+        contig_sites = int(with_depth.sum())
+        contig_total = int(numpy.asarray(contig_depth.depth)[with_depth].sum(dtype=numpy.int64))
+
+        if contig_sites > 0:
+            print(chromo, contig_sites, contig_total / float(contig_sites) / no_indiv, sep='\t')
+        total_depth += contig_total
+        total_sites += contig_sites
+
+    if total_sites > 0:
+        print('ALL', total_sites, total_depth / float(total_sites) / no_indiv, sep='\t')
+    sys.exit()
+
 # vcftools cmd
 vcftools_cmd = 'vcftools --vcf ' + vcf + ' --out ' + vcf.replace('.vcf', '') + ' --depth'
 q_sub([vcftools_cmd], out=vcf.replace('.vcf', '.depth'))
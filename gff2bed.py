@@ -1,13 +1,49 @@
 #!/usr/bin/env python
 
 from __future__ import print_function
+import argparse
 import sys
+from gff_index import GFFIndex, MERGED_REGIONS
 
-for line in sys.stdin:
-    if line.startswith('#'):
-        continue
-    else:
-        line = line.split()
-        chromo, start, end = line[0], int(line[3])-1, line[4]
 
-        print(chromo, start, end, sep='\t')
+def main():
+
+    # arguments
+    parser = argparse.ArgumentParser(description='Converts gff lines read from stdin to bed, or with -gff writes '
+                                                 'the coordinates of a feature type or merged region from the '
+                                                 'compiled gff')
+    parser.add_argument('-gff', help='GFF file to read from the compiled index in place of stdin', default=None)
+    parser.add_argument('-feature', help='Feature type to output, with -gff', default=None)
+    parser.add_argument('-merged', help='Merged region to output, with -gff, intergenic runs to the ##sequence-region '
+                                        'end of each contig, or to its last annotated feature if the gff has no '
+                                        'such pragma', choices=MERGED_REGIONS, default=None)
+    args = parser.parse_args()
+
+    if args.gff is None:
+        for line in sys.stdin:
+            if line.startswith('#'):
+                continue
+            else:
+                line = line.split()
+                chromo, start, end = line[0], int(line[3])-1, line[4]
+
+                print(chromo, start, end, sep='\t')
+        sys.exit()
+
+    if (args.feature is None) == (args.merged is None):
+        sys.exit('one of -feature and -merged must be specified with -gff')
+
+    index = GFFIndex(args.gff)
+    for chromo in index.contigs:
+        if args.merged is not None:
+            starts, ends = index.merged(chromo, args.merged)
+        else:
+            features = index.features(chromo, args.feature)
+            starts, ends = features['starts'], features['ends']
+
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            print(chromo, start, end, sep='\t')
+
+
+if __name__ == '__main__':
+    main()
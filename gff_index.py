@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import argparse
+import gzip
+import os
+import numpy
+from file_cache import file_checksum
+from depth_cache import save_array
+from genomic_intervals import merge_intervals
+
+FIELDS = ['starts', 'ends', 'strands', 'frames', 'parents']
+
+# merged regions kept for each contig, all_feat is every feature merged, intergenic lies between merged genes
+MERGED_REGIONS = ['CDS', 'intron', 'gene', 'all_feat', 'intergenic']
+
+NO_FRAME = -1
+NO_PARENT = -1
+
+# written to index.done, an index compiled by an older version is compiled again
+INDEX_VERSION = 2
+
+
+def index_path(gff_file, cache_dir=None):
+
+    """
+    returns the compiled index directory of a gff, named by its checksum so an edited gff never reads a stale index
+    :param gff_file: str
+    :param cache_dir: str
+    :return: str
+    """
+
+    if cache_dir is None:
+        cache_dir = os.path.dirname(os.path.abspath(gff_file))
+
+    return os.path.join(cache_dir, '{}.{}.gff_index'.format(os.path.basename(gff_file), file_checksum(gff_file)))
+
+
+def gff_records(gff_file, sequence_regions=None):
+
+    """
+    yields the split feature lines of a plain text or gzipped gff, stopping at any fasta section,
+    skipping comments, short lines and features with negative coordinates. The end of each
+    ##sequence-region pragma is stored by contig in sequence_regions if a dict is given
+    :param gff_file: str
+    :param sequence_regions: dict
+    :return: generator
+    """
+
+    if gff_file.endswith('.gz'):
+        gff = gzip.open(gff_file)
+    else:
+        gff = open(gff_file)
+
+    for line in gff:
+        if line.startswith('##FASTA'):
+            break
+        if line.startswith('##sequence-region') and sequence_regions is not None:
+            pragma = line.split()
+            if len(pragma) == 4:
+                sequence_regions[pragma[1]] = int(pragma[3])
+        if line.startswith('#'):
+            continue
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) < 5:
+            continue
+        if int(fields[3]) < 0 or int(fields[4]) < 0:
+            continue
+        yield fields
+
+    gff.close()
+
+
+def record_parent(fields):
+
+    """
+    returns the Parent attribute of a split gff line, None if it has none
+    :param fields: list
+    :return: str
+    """
+
+    if len(fields) < 9:
+        return None
+
+    for attribute in fields[8].split(';'):
+        if attribute.startswith('Parent='):
+            return attribute[7:]
+
+    return None
+
+
+def compile_gff(gff_file, index_dir):
+
+    """
+    compiles a gff in one pass to memory mapped arrays of the 0-based start, end, strand, frame and parent of
+    every feature type, ordered by contig and start with ties in file order, along with the merged CDS, intron,
+    gene, all feature and intergenic intervals of each contig. Intergenic intervals run to the contig end given
+    by a ##sequence-region pragma, or to the end of the last feature of contigs without one
+    :param gff_file: str
+    :param index_dir: str
+    :return: int
+    """
+
+    if not os.path.isdir(index_dir):
+        try:
+            os.makedirs(index_dir)
+        except OSError:
+            if not os.path.isdir(index_dir):
+                raise
+
+    contig_ids = {}
+    parent_ids = {}
+    columns = {}
+    sequence_regions = {}
+    for fields in gff_records(gff_file, sequence_regions):
+        if fields[0] not in contig_ids:
+            contig_ids[fields[0]] = len(contig_ids)
+        if fields[2] not in columns:
+            columns[fields[2]] = ([], [], [], [], [], [])
+
+        parent = record_parent(fields)
+        if parent is not None and parent not in parent_ids:
+            parent_ids[parent] = len(parent_ids)
+
+        feature = columns[fields[2]]
+        feature[0].append(contig_ids[fields[0]])
+        feature[1].append(int(fields[3]) - 1)
+        feature[2].append(int(fields[4]))
+        feature[3].append(fields[6] if len(fields) > 6 else '.')
+        feature[4].append(int(fields[7]) if len(fields) > 7 and fields[7].isdigit() else NO_FRAME)
+        feature[5].append(NO_PARENT if parent is None else parent_ids[parent])
+
+    contigs = sorted(contig_ids, key=lambda x: contig_ids[x])
+    feature_types = sorted(columns)
+    n_features = 0
+    contig_features = {x: {} for x in contigs}
+    for i, feature_type in enumerate(feature_types):
+        contig_col, starts, ends, strands, frames, parents = columns.pop(feature_type)
+        contig_col = numpy.array(contig_col, dtype=numpy.int64)
+        starts = numpy.array(starts, dtype=numpy.int64)
+        order = numpy.lexsort((starts, contig_col))
+
+        arrays = {'starts': starts[order],
+                  'ends': numpy.array(ends, dtype=numpy.int64)[order],
+                  'strands': numpy.array(strands, dtype='S1')[order],
+                  'frames': numpy.array(frames, dtype=numpy.int8)[order],
+                  'parents': numpy.array(parents, dtype=numpy.int32)[order],
+                  'offsets': numpy.searchsorted(contig_col[order], numpy.arange(len(contigs) + 1))}
+        for name, array in arrays.items():
+            save_array(os.path.join(index_dir, '{}.{}.npy'.format(i, name)), array)
+
+        # per contig views for the merged regions
+        for c, chromo in enumerate(contigs):
+            low, high = arrays['offsets'][c], arrays['offsets'][c + 1]
+            if high > low:
+                contig_features[chromo][feature_type] = (arrays['starts'][low:high], arrays['ends'][low:high])
+        n_features += len(starts)
+
+    merged = {x: ([], [], [0]) for x in MERGED_REGIONS}
+    for chromo in contigs:
+        features = contig_features.pop(chromo)
+        regions = {}
+        for region in ['CDS', 'intron', 'gene']:
+            regions[region] = merge_intervals(*features.get(region, ([], [])))
+        regions['all_feat'] = merge_intervals(numpy.concatenate([x[0] for x in features.values()]),
+                                              numpy.concatenate([x[1] for x in features.values()]))
+
+        # gaps between genes up to the contig end, or the end of the last feature of the contig if not known
+        gene_starts, gene_ends = regions['gene']
+        contig_end = regions['all_feat'][1][-1] if len(regions['all_feat'][1]) else 0
+        contig_end = max(contig_end, sequence_regions.get(chromo, 0))
+        regions['intergenic'] = merge_intervals(numpy.append(0, gene_ends), numpy.append(gene_starts, contig_end))
+
+        for region in MERGED_REGIONS:
+            merged[region][0].append(regions[region][0])
+            merged[region][1].append(regions[region][1])
+            merged[region][2].append(merged[region][2][-1] + len(regions[region][0]))
+
+    for region in MERGED_REGIONS:
+        starts, ends, offsets = merged[region]
+        for name, array in [('starts', starts), ('ends', ends)]:
+            array = numpy.concatenate(array) if len(array) else numpy.array([], dtype=numpy.int64)
+            save_array(os.path.join(index_dir, 'merged.{}.{}.npy'.format(region, name)), array)
+        save_array(os.path.join(index_dir, 'merged.{}.offsets.npy'.format(region)),
+                   numpy.array(offsets, dtype=numpy.int64))
+
+    for name, values in [('contigs', contigs), ('features', feature_types),
+                         ('parents', sorted(parent_ids, key=lambda x: parent_ids[x]))]:
+        with open(os.path.join(index_dir, name + '.txt'), 'w') as out:
+            for value in values:
+                print(value, file=out)
+
+    # written last, marks the index as complete
+    with open(os.path.join(index_dir, 'index.done'), 'w') as done:
+        print(INDEX_VERSION, n_features, sep='\t', file=done)
+
+    return n_features
+
+
+class GFFIndex(object):
+
+    """
+    compiled gff, compiled from the gff on first use and read back as memory mapped arrays
+    """
+
+    def __init__(self, gff_file, cache_dir=None):
+
+        """
+        :param gff_file: str
+        :param cache_dir: str
+        """
+
+        self.gff_file = gff_file
+        self.index_dir = index_path(gff_file, cache_dir)
+        done = os.path.join(self.index_dir, 'index.done')
+        if not os.path.isfile(done) or open(done).read().split('\t')[0] != str(INDEX_VERSION):
+            compile_gff(gff_file, self.index_dir)
+
+        self.contigs = self.read_list('contigs')
+        self.contig_ids = {x: i for i, x in enumerate(self.contigs)}
+        self.feature_ids = {x: i for i, x in enumerate(self.read_list('features'))}
+        self.parent_ids = None
+        self.loaded = {}
+
+    def read_list(self, name):
+        return [x.rstrip('\n') for x in open(os.path.join(self.index_dir, name + '.txt'))]
+
+    def __contains__(self, chromo):
+        return chromo in self.contig_ids
+
+    @property
+    def feature_types(self):
+        return sorted(self.feature_ids)
+
+    def load(self, prefix, names):
+
+        """
+        returns the memory mapped arrays of one feature type or merged region, loaded once
+        :param prefix: str
+        :param names: list
+        :return: dict
+        """
+
+        if prefix not in self.loaded:
+            self.loaded[prefix] = {x: numpy.load(os.path.join(self.index_dir, '{}.{}.npy'.format(prefix, x)),
+                                                 mmap_mode='r')
+                                   for x in names}
+
+        return self.loaded[prefix]
+
+    def features(self, chromo, feature_type):
+
+        """
+        returns views of the 0-based start, end, strand, frame (NO_FRAME if none) and parent id index (NO_PARENT
+        if none) of the features of one type on a contig, ordered by start with ties in file order,
+        empty arrays if the contig has none
+        :param chromo: str
+        :param feature_type: str
+        :return: dict
+        """
+
+        if feature_type not in self.feature_ids:
+            arrays = {'starts': numpy.array([], dtype=numpy.int64), 'ends': numpy.array([], dtype=numpy.int64),
+                      'strands': numpy.array([], dtype='S1'), 'frames': numpy.array([], dtype=numpy.int8),
+                      'parents': numpy.array([], dtype=numpy.int32)}
+            return arrays
+
+        arrays = self.load(str(self.feature_ids[feature_type]), FIELDS + ['offsets'])
+        c = self.contig_ids.get(chromo)
+        low, high = (0, 0) if c is None else (arrays['offsets'][c], arrays['offsets'][c + 1])
+
+        return {x: arrays[x][low:high] for x in FIELDS}
+
+    def merged(self, chromo, region):
+
+        """
+        returns the merged, sorted 0-based half open intervals of one of MERGED_REGIONS on a contig,
+        empty arrays if the contig is not in the gff
+        :param chromo: str
+        :param region: str
+        :return: numpy.array, numpy.array
+        """
+
+        arrays = self.load('merged.' + region, ['starts', 'ends', 'offsets'])
+        c = self.contig_ids.get(chromo)
+        low, high = (0, 0) if c is None else (arrays['offsets'][c], arrays['offsets'][c + 1])
+
+        return arrays['starts'][low:high], arrays['ends'][low:high]
+
+    def parents(self, parent_indexes):
+
+        """
+        returns the parent IDs of a set of parent id indexes, None for NO_PARENT
+        :param parent_indexes: numpy.array
+        :return: list
+        """
+
+        if self.parent_ids is None:
+            self.parent_ids = self.read_list('parents')
+
+        return [None if x == NO_PARENT else self.parent_ids[x] for x in parent_indexes]
+
+
+def gff_regions(gff_file, chr_list=None):
+
+    """
+    returns the merged, sorted 0-based half open intervals of each feature type for each chromosome
+    from the compiled gff, for every chromosome in the gff if no list is given
+    :param gff_file: str
+    :param chr_list: list
+    :return: dict
+    """
+
+    index = GFFIndex(gff_file)
+    if chr_list is None:
+        chr_list = index.contigs
+
+    return {x: {y: index.merged(x, y) for y in ['CDS', 'intron', 'gene', 'all_feat']} for x in chr_list}
+
+
+def main():
+
+    # arguments
+    parser = argparse.ArgumentParser(description='Compiles a gff to memory mapped arrays of each feature type, '
+                                                 'used in place of the gff by the annotation scripts')
+    parser.add_argument('-gff', help='Plain text or gzipped GFF file', required=True)
+    parser.add_argument('-cache_dir', help='Directory to hold the index, defaults to the gff directory',
+                        default=None)
+    args = parser.parse_args()
+
+    index = GFFIndex(args.gff, args.cache_dir)
+    for feature_type in index.feature_types:
+        arrays = index.load(str(index.feature_ids[feature_type]), ['offsets'])
+        print(feature_type, arrays['offsets'][-1], sep='\t')
+    print(index.index_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -56,6 +56,22 @@ def indel_type(vcf_line):
         return None
 
 
+def is_hetero(variant):
+
+    """
+    checks if any sample carries a heterozygous genotype
+    :param variant: pysam variant
+    :return: bool
+    """
+
+    for sample in variant.samples.values():
+        alleles = [x for x in sample['GT'] if x is not None]
+        if len(set(alleles)) > 1:
+            return True
+
+    return False
+
+
 def main():
 
     # arguments
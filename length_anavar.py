@@ -3,58 +3,144 @@
 from __future__ import print_function
 import anavar_utils as an
 import argparse
+import numpy
+import pysam
 from qsub import q_sub
-from vcf2raw_sfs import vcf2sfs
-from cds_vs_neutral_anavar import read_callable_csv, sfs2counts
+from vcf2raw_sfs import get_out_freq, is_auto
+from cds_vs_neutral_anavar import read_callable_csv
+from indel_lengths import indel_type, indel_length, is_hetero
+from sfs_cache import cached_arrays
 
+# regions of selected and neutral indels, axes of the length sfs tensor
+SEL_REGIONS = {'CDS_frameshift', 'CDS_non_frameshift'}
+NEU_REGIONS = {'intergenic', 'intron'}
+MUTE_TYPES = ['ins', 'del']
 
-def prepare_indel_sfs(vcf, call, n, length_list):
+LENGTH_COMBOS = [['_len1bp', (1, )], ['_len2bp', (2, )], ['_len3bp', (3, )],
+                 ['_len4bp+shift', set(range(4, 51, 3) + range(5, 51, 3))],
+                 ['_len6bp+inframe', set(range(6, 51, 3))]]
+
+
+def length_sfs_tensor(vcf, n):
 
     """
-    gets sfs from vcf and prepares as anavar input
+    counts the polarised autosomal indels without heterozygous calls in one pass of a vcf, as a tensor of
+    [length, ins/del, selected/neutral, frequency] holding the sfs2counts bins 1/n to (n-1)/n, lengths
+    index the first axis directly. Frequencies are taken over the samples of the vcf, as by vcf2sfs, with n
+    only setting the bins. Read from the sfs cache after the first pass of a vcf
     :param vcf: str
-    :param call: dict
     :param n: int
-    :param length_list: set
-    :return: dict
+    :return: numpy.array
     """
 
-    # extract site frequencies
-    del_sfs = vcf2sfs(vcf_name=vcf, mode='del',
-                      auto_only=True, skip_hetero=True, lengths=length_list,
-                      regions=['CDS_frameshift', 'CDS_non_frameshift'])
+    n = int(n)
+
+    def build():
+        freq_bins = {str(round(i / float(n), 3)): i - 1 for i in range(1, n)}
+        indexes = ([], [], [], [])
+        vcf_file = pysam.VariantFile(vcf)
+        n_samples = len(vcf_file.header.samples)
+        for variant in vcf_file:
+            if not is_auto(variant):
+                continue
+            if variant.alts is None or len(variant.alts) != 1:
+                continue
+            if len(variant.ref) == 1 and len(variant.alts[0]) == 1:
+                continue
+
+            anno = variant.info.get('ANNO')
+            if anno in SEL_REGIONS:
+                sel_or_neu = 0
+            elif anno in NEU_REGIONS:
+                sel_or_neu = 1
+            else:
+                continue
+
+            ins_or_del = indel_type(variant)
+            if ins_or_del is None or is_hetero(variant):
+                continue
+
+            # frequencies outside the bins are dropped, as by sfs2counts
+            freq_bin = freq_bins.get(str(get_out_freq(variant, True, ins_or_del, n_samples)))
+            if freq_bin is None:
+                continue
 
-    n_d_sfs = vcf2sfs(vcf_name=vcf, mode='del',
-                      auto_only=True, skip_hetero=True, lengths=length_list,
-                      regions=['intergenic', 'intron'])
+            for axis, index in enumerate([indel_length(variant), MUTE_TYPES.index(ins_or_del),
+                                          sel_or_neu, freq_bin]):
+                indexes[axis].append(index)
 
-    ins_sfs = vcf2sfs(vcf_name=vcf, mode='ins',
-                      auto_only=True, skip_hetero=True, lengths=length_list,
-                      regions=['CDS_frameshift', 'CDS_non_frameshift'])
+        max_length = max(indexes[0]) if len(indexes[0]) else 0
+        counts = numpy.zeros((max_length + 1, len(MUTE_TYPES), 2, n - 1), dtype=numpy.int64)
+        numpy.add.at(counts, indexes, 1)
 
-    n_i_sfs = vcf2sfs(vcf_name=vcf, mode='ins',
-                      auto_only=True, skip_hetero=True, lengths=length_list,
-                      regions=['intergenic', 'intron'])
+        return {'counts': counts}
 
-    # convert to correct format for anavar
-    sfs_i = sfs2counts(ins_sfs, n)
-    sfs_d = sfs2counts(del_sfs, n)
-    sfs_ni = sfs2counts(n_i_sfs, n)
-    sfs_nd = sfs2counts(n_d_sfs, n)
+    return cached_arrays(vcf, 'length_sfs_tensor', {'n': n}, build)['counts']
+
+
+def length_class_sfs(sfs_tensor, call, length_list):
+
+    """
+    sums the length sfs tensor over a set of lengths and prepares the result as anavar input
+    :param sfs_tensor: numpy.array
+    :param call: dict
+    :param length_list: set
+    :return: dict
+    """
+
+    lengths = numpy.array(sorted(x for x in length_list if x < len(sfs_tensor)), dtype=numpy.int64)
+    counts = sfs_tensor[lengths].sum(axis=0)
 
     # get callable sites
     sel_m = call['ALL']['CDS']['pol']
     neu_m = call['ALL']['intergenic']['pol'] + call['ALL']['intron']['pol']
 
     # construct control file sfs
-    sfs_m = {'selected_INS': (sfs_i, sel_m), 'selected_DEL': (sfs_d, sel_m),
-             'neutral_INS': (sfs_ni, neu_m), 'neutral_DEL': (sfs_nd, neu_m)}
+    ins, dels = MUTE_TYPES.index('ins'), MUTE_TYPES.index('del')
+    sfs_m = {'selected_INS': (counts[ins, 0].tolist(), sel_m), 'selected_DEL': (counts[dels, 0].tolist(), sel_m),
+             'neutral_INS': (counts[ins, 1].tolist(), neu_m), 'neutral_DEL': (counts[dels, 1].tolist(), neu_m)}
 
     return sfs_m
 
 
+def prepare_indel_sfs(vcf, call, n, length_list):
+
+    """
+    gets sfs from vcf and prepares as anavar input
+    :param vcf: str
+    :param call: dict
+    :param n: int
+    :param length_list: set
+    :return: dict
+    """
+
+    return length_class_sfs(length_sfs_tensor(vcf, n), call, length_list)
+
+
+def parse_length_combo(combo):
+
+    """
+    parses a length class given as label=lengths, lengths being comma separated lengths or inclusive ranges
+    start-end with an optional step start-end/step, eg. _len4bp+shift=4-50/3,5-50/3
+    :param combo: str
+    :return: list
+    """
+
+    label, length_str = combo.split('=')
+    lengths = set()
+    for part in length_str.split(','):
+        if '-' in part:
+            bounds, step = part.split('/') if '/' in part else (part, 1)
+            start, end = bounds.split('-')
+            lengths |= set(range(int(start), int(end) + 1, int(step)))
+        else:
+            lengths.add(int(part))
+
+    return [label, lengths]
+
+
 def sel_v_neu_anavar(vcf, call, constraint, n, c, dfe, alg, nnoimp, maximp,
-                     out_stem, search, degree, spread, evolgen):
+                     out_stem, search, degree, spread, evolgen, length_combos=None):
 
     """
     submits anavar jobs to cluster after writing required files etc
@@ -72,6 +158,7 @@ def sel_v_neu_anavar(vcf, call, constraint, n, c, dfe, alg, nnoimp, maximp,
     :param degree: int
     :param spread: int
     :param evolgen: bool
+    :param length_combos: list
     :return: None
     """
 
@@ -79,11 +166,13 @@ def sel_v_neu_anavar(vcf, call, constraint, n, c, dfe, alg, nnoimp, maximp,
 
     anavar_cmd = '{path}anavar1.22 {ctl} {rslts} {log} {seed}'
 
-    # loop through all length combinations
-    length_combos = [['_len1bp', (1, )], ['_len2bp', (2, )], ['_len3bp', (3, )],
-                     ['_len4bp+shift', set(range(4, 51, 3) + range(5, 51, 3))],
-                     ['_len6bp+inframe', set(range(6, 51, 3))]]
+    if length_combos is None:
+        length_combos = LENGTH_COMBOS
 
+    # sfs of every length from one pass of the vcf, summed for each length combination
+    sfs_tensor = length_sfs_tensor(vcf, n)
+
+    # loop through all length combinations
     for lengths in length_combos:
 
         # sort file names
@@ -91,7 +180,7 @@ def sel_v_neu_anavar(vcf, call, constraint, n, c, dfe, alg, nnoimp, maximp,
         ctl_name = len_out_stem + '.control.txt'
 
         # make control file
-        sfs_data = prepare_indel_sfs(vcf, call, n, lengths[1])
+        sfs_data = length_class_sfs(sfs_tensor, call, lengths[1])
 
         ctl = an.IndelNeuSelControlFile()
 
@@ -158,6 +247,10 @@ def main():
                                        'with a different seed given to anavar', default=1, type=int)
     parser.add_argument('-degree', help='changes degree setting in anavar', default=50, type=int)
     parser.add_argument('-out_pre', help='File path and prefix for output', required=True)
+    parser.add_argument('-length_combo', help='Length class to run, as label=lengths with lengths comma separated '
+                                              'lengths or start-end/step ranges, eg. _len4bp+shift=4-50/3,5-50/3, '
+                                              'can be given multiple times, defaults to the 1, 2, 3bp, frameshift '
+                                              'and in frame classes', action='append', default=None)
     parser.add_argument('-evolgen', help='If specified will run on evolgen', default=False, action='store_true')
     args = parser.parse_args()
 
@@ -175,7 +268,9 @@ def main():
                      search=args.n_search,
                      degree=args.degree,
                      spread=args.split,
-                     evolgen=args.evolgen)
+                     evolgen=args.evolgen,
+                     length_combos=None if args.length_combo is None else
+                     [parse_length_combo(x) for x in args.length_combo])
 
 if __name__ == '__main__':
     main()
@@ -4,7 +4,7 @@ from __future__ import print_function
 import anavar_utils as an
 import argparse
 from qsub import q_sub
-from vcf2raw_sfs import vcf2sfs
+from sfs_cache import cached_vcf2sfs
 from cds_vs_neutral_anavar import read_callable_csv, sfs2counts
 from nonsense_stats import prem_freqs_call, gather_chromo_prems
 
@@ -22,9 +22,9 @@ def prepare_nonsense_snp_sfs(vcf, call, n, sel_sfs, sel_m):
     """
 
     # extract site frequencies
-    neu_sfs = vcf2sfs(vcf_name=vcf, mode='snp',
-                      auto_only=True, skip_hetero=True,
-                      degen=4)
+    neu_sfs = cached_vcf2sfs(vcf_name=vcf, mode='snp',
+                             auto_only=True, skip_hetero=True,
+                             degen=4)
 
     # convert to correct format for anavar
     sfs_sel = sfs2counts(sel_sfs, n)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import argparse
+import os
+import numpy
+from wga_index import WGAIndex, GAP, MISSING, MULTI, upper_lookup
+from depth_cache import save_array
+
+# mask columns
+REF = 0
+OUTGROUP = 1
+FLAGS = 2
+
+# mask flags
+MONO_OK = 1
+FULL_CHECK = 2
+
+CHUNK_SITES = 16 * 1024 * 1024
+
+
+def row_polarisability(contig):
+
+    """
+    works out for each alignment row the upper case reference base that a monomorphic or SNP record must match,
+    0 if no such record can be polarised, the outgroup base that SNP alleles are polarised against, 0 if the
+    outgroups disagree, and flags for monomorphic sites and rows that need the full per record check
+    :param contig: ContigAlignment
+    :return: numpy.array
+    """
+
+    flags = numpy.asarray(contig.flags)
+    bases = upper_lookup[numpy.asarray(contig.bases)]
+    n_species = numpy.array([len(x) for x in contig.species_sets], dtype=numpy.int64)[contig.species_ids]
+
+    rows = numpy.zeros((len(flags), 3), dtype=numpy.uint8)
+
+    # one base per species, outgroups agree if every outgroup base matches the first
+    one_base = (flags & (MISSING | MULTI)) == 0
+    for n in numpy.unique(n_species[one_base]):
+        of_size = numpy.flatnonzero(one_base & (n_species == n))
+        rows[of_size, REF] = bases[of_size, 0]
+        if n < 2:
+            continue
+        outgroups = bases[of_size, 1:n]
+        agree = (outgroups == outgroups[:, :1]).all(axis=1)
+        rows[of_size[agree], FLAGS] |= MONO_OK
+        consensus = agree & (outgroups[:, 0] != ord('-'))
+        rows[of_size[consensus], OUTGROUP] = outgroups[consensus, 0]
+
+    # rows with more than one base for any species follow polarisable() line by line
+    for row in numpy.flatnonzero(flags & MULTI):
+        if flags[row] & MISSING:
+            continue
+        sequences = contig.sequences(row)
+        if flags[row] & GAP and '-' in ''.join([x.rstrip('-') for x in sequences]):
+            continue
+        if len(sequences[0]) != 1:
+            continue
+        rows[row, REF] = ord(sequences[0])
+
+        out_group_seqs = sequences[1:]
+        if len(set(out_group_seqs)) == 1:
+            rows[row, FLAGS] |= MONO_OK
+
+        stripped = {x.rstrip('-') for x in out_group_seqs}
+        if len(stripped) == 1:
+            consensus = stripped.pop()
+            if len(consensus) == 1:
+                rows[row, OUTGROUP] = ord(consensus)
+            elif len(consensus) > 1:
+                rows[row, FLAGS] |= FULL_CHECK
+
+    # a gap in the reference never matches a vcf allele
+    rows[rows[:, REF] == ord('-'), REF] = 0
+
+    return rows
+
+
+def build_snp_mask(contig, out_file, chunk_sites=CHUNK_SITES):
+
+    """
+    writes the per base polarisability of a contig, a base takes the values of its alignment row
+    where exactly one row covers it, bases in more than one row or none can not be polarised
+    :param contig: ContigAlignment
+    :param out_file: str
+    :param chunk_sites: int
+    :return: int
+    """
+
+    starts = numpy.asarray(contig.starts)
+    ends = numpy.asarray(contig.ends)
+    length = int(contig.max_ends[-1]) if len(contig) else 0
+
+    # rows covering each base from the running sum of row opens and closes
+    has_length = ends > starts
+    coverage = numpy.cumsum(numpy.bincount(starts[has_length], minlength=length + 1)[:length + 1] -
+                            numpy.bincount(ends[has_length], minlength=length + 1)[:length + 1])
+
+    rows = row_polarisability(contig)
+    mask = numpy.zeros((length, 3), dtype=numpy.uint8)
+    for low in range(0, length, chunk_sites):
+        high = min(low + chunk_sites, length)
+        single_row = numpy.flatnonzero(coverage[low:high] == 1) + low
+        mask[single_row] = rows[contig.first_rows(single_row)]
+
+    save_array(out_file, mask)
+
+    return length
+
+
+class SNPPolarisableMask(object):
+
+    """
+    per base record of whether monomorphic and SNP sites can be polarised, kept alongside
+    a compiled whole genome alignment and built from it on first use
+    """
+
+    def __init__(self, wga_index):
+
+        """
+        :param wga_index: WGAIndex
+        """
+
+        self.wga_index = wga_index
+        self.loaded = {}
+
+    def mask_file(self, chromo):
+        return os.path.join(self.wga_index.index_dir, chromo + '.snp_mask.npy')
+
+    def has_contig(self, chromo):
+        return os.path.isfile(self.mask_file(chromo))
+
+    def build(self, chromo):
+
+        """
+        builds the mask of one contig
+        :param chromo: str
+        :return: int
+        """
+
+        return build_snp_mask(self.wga_index[chromo], self.mask_file(chromo))
+
+    def contig(self, chromo):
+
+        """
+        returns the memory mapped mask of a contig, building it if needed
+        :param chromo: str
+        :return: numpy.array
+        """
+
+        if chromo not in self.loaded:
+            if not self.has_contig(chromo):
+                self.build(chromo)
+            self.loaded[chromo] = numpy.load(self.mask_file(chromo), mmap_mode='r')
+
+        return self.loaded[chromo]
+
+    def polarisable(self, chromo, positions, ref_first, ref_single, alt_first, alt_single, mono):
+
+        """
+        returns whether each monomorphic or SNP record can be polarised, matching polarisable(), and which
+        records still need the full per record check, which is every INDEL record
+        :param chromo: str
+        :param positions: numpy.array
+        :param ref_first: numpy.array
+        :param ref_single: numpy.array
+        :param alt_first: numpy.array
+        :param alt_single: numpy.array
+        :param mono: numpy.array
+        :return: numpy.array, numpy.array
+        """
+
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        sites = numpy.zeros((len(positions), 3), dtype=numpy.uint8)
+        if chromo in self.wga_index:
+            mask = self.contig(chromo)
+            in_mask = (positions >= 0) & (positions < len(mask))
+            sites[in_mask] = mask[positions[in_mask]]
+
+        ref_match = (sites[:, REF] != 0) & (sites[:, REF] == ref_first)
+        outgroup = sites[:, OUTGROUP]
+
+        mono_ok = ref_match & ((sites[:, FLAGS] & MONO_OK) > 0)
+        snp_ok = (ref_match & ref_single & (outgroup != 0) &
+                  ((outgroup == ref_first) != (alt_single & (outgroup == alt_first))))
+        full_check = ~mono & (~ref_single | ((sites[:, FLAGS] & FULL_CHECK) > 0))
+
+        return numpy.where(mono, mono_ok, snp_ok) & ~full_check, full_check
+
+
+def main():
+
+    # arguments
+    parser = argparse.ArgumentParser(description='Builds the per base mask of whether monomorphic and SNP sites '
+                                                 'can be polarised from a whole genome alignment, used by '
+                                                 'callable_sites_from_vcf.py -pol')
+    parser.add_argument('-wga_bed', help='Tabix indexed whole genome alignment bed file', required=True)
+    parser.add_argument('-chr', help='Contig to build, can be specified more than once, defaults to all contigs',
+                        action='append', default=[])
+    parser.add_argument('-cache_dir', help='Directory holding the compiled alignment, defaults to the bed directory',
+                        default=None)
+    args = parser.parse_args()
+
+    snp_mask = SNPPolarisableMask(WGAIndex(args.wga_bed, args.cache_dir))
+    chromos = args.chr if len(args.chr) else sorted(snp_mask.wga_index.contigs)
+    for chromo in chromos:
+        print(chromo, snp_mask.build(chromo), sep='\t')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,168 +3,333 @@
 import argparse
 from qsub import *
 import sys
+import os
+import shutil
+from multiprocessing import Pool
+import numpy
 import pysam
+from wga_index import WGAIndex
+from vcf_io import BGZFWriter, TabixIndexBuilder, BGZF_EOF, add_info_lines, vcf_record_span
+
+COUNTERS = ['counter', 'match', 'no_hotspot', 'low_coverage', 'ambiguous']
+
+
+def polarise_header(header_lines):
+
+    """
+    adds the AA INFO line to a vcf header, ahead of the contig lines
+    :param header_lines: list
+    :return: list
+    """
+
+    return add_info_lines(header_lines, Polariser.info_lines)
+
+
+def ancestral_allele(chrom, pos, ref, alt, wga_bed, counts):
+
+    """
+    returns the ancestral allele of a variant if it can be polarised, None otherwise,
+    adding the outcome to the counters
+    :param chrom: str
+    :param pos: str
+    :param ref: str
+    :param alt: str
+    :param wga_bed: WGAIndex
+    :param counts: dict
+    :return: str
+    """
+
+    counts['counter'] += 1
+
+    if len(ref) > 1:
+        var_type = 'INDEL'
+    else:
+        var_type = 'SNP'
+
+    # get aligned seq for var, contigs missing from the alignment are treated as unaligned
+    try:
+        var_align = wga_bed.alignment(chrom, int(pos) - 1, int(pos) - 1 + len(ref))
+    except ValueError:
+        var_align = []
+
+    # skip if not in alignment
+    if len(var_align) == 0:
+        counts['low_coverage'] += 1
+        return None
+
+    elif len(var_align) > 1:
+        if var_type == 'SNP':
+            counts['no_hotspot'] += 1
+            return None
+
+        # catch deletions rel to ref that uniq to ref spp
+        else:
+            # merge sequences from multiple bed rows
+            merged_align = [''.join(y) for y in zip(*var_align)]
+            if '-' not in ''.join(merged_align):
+                var_align = merged_align
+            else:
+                counts['no_hotspot'] += 1
+                return None
+
+    else:
+        var_align = var_align[0]
+
+    # skip positions without full coverage
+    if '?' in ''.join(var_align):
+        counts['low_coverage'] += 1
+        return None
+
+    # skip indel hotspots
+    indel_sequences = [y.rstrip('-') for y in var_align]
+    if '-' in ''.join(indel_sequences):
+        counts['no_hotspot'] += 1
+        return None
+
+    # skips sites where ref allele differs from that in alignment, ie insertion within INDEL
+    if ref != var_align[0].upper():
+        counts['no_hotspot'] += 1
+        return None
+
+    # identify if ref or alt is ancestral
+    out_group_seqs = var_align[1:]
+    ref_anc = True
+    alt_anc = True
+
+    # identify ref ancestral
+    for sequence in out_group_seqs:
+        if var_type == 'INDEL':
+            if len(ref) != len(sequence.rstrip('-')):
+                ref_anc = False
+                break
+        else:
+            if ref != sequence.rstrip('-'):
+                ref_anc = False
+                break
+
+    # identify alt ancestral
+    for sequence in out_group_seqs:
+        if var_type == 'INDEL':
+            if len(alt) != len(sequence.rstrip('-')):
+                alt_anc = False
+                break
+        else:
+            if alt != sequence.rstrip('-'):
+                alt_anc = False
+                break
+
+    # skip ambiguous sites
+    if alt_anc is ref_anc:
+        counts['ambiguous'] += 1
+        return None
+
+    # set AA annotation
+    counts['match'] += 1
+    if ref_anc is True:
+        return ref
+    else:
+        return alt
+
+
+def polarise_line(line, wga_bed, counts):
+
+    """
+    returns a vcf line with the ancestral allele added to INFO if the variant can be polarised,
+    adding the outcome to the counters
+    :param line: str
+    :param wga_bed: WGAIndex
+    :param counts: dict
+    :return: str
+    """
+
+    line = line.split('\t')
+    aa = ancestral_allele(line[0], line[1], line[3], line[4], wga_bed, counts)
+    if aa is None:
+        return '\t'.join(line)
+
+    return '\t'.join(line[0:7]) + '\t' + line[7] + ';AA=' + aa + '\t' + '\t'.join(line[8:])
+
+
+def polarise_summary(counts):
+
+    """
+    returns the summary of the polarisation counters
+    :param counts: dict
+    :return: str
+    """
+
+    return ('\n'
+            'Total no INDELs  : ' + str(counts['counter']) + '\n'
+            'INDELs polarised : ' + str(counts['match']) + '\n'
+            'Hotspots         : ' + str(counts['no_hotspot']) + '\n'
+            'Low spp coverage : ' + str(counts['low_coverage']) + '\n'
+            'Ambiguous        : ' + str(counts['ambiguous']) + '\n'
+            'Total unpolarised: ' + str(counts['counter'] - counts['match']) + '\n')
+
+
+class Polariser(object):
+
+    """
+    AA annotation of the ancestral allele of each record, for annotate_vcf.py
+    """
+
+    name = 'AA'
+    suffix = '.polarised'
+    info_lines = ['##INFO=<ID=AA,Number=1,Type=String,Description="Ancestral Allele">']
+
+    def __init__(self, wga_file):
+
+        """
+        :param wga_file: str
+        """
+
+        self.wga_bed = WGAIndex(wga_file)
+        self.counts = dict.fromkeys(COUNTERS, 0)
+
+    def annotate(self, fields):
+
+        """
+        adds the ancestral allele to the INFO of a split record, returns False if the record is to be dropped
+        :param fields: list
+        :return: bool
+        """
+
+        aa = ancestral_allele(fields[0], fields[1], fields[3], fields[4], self.wga_bed, self.counts)
+        if aa is not None:
+            fields[7] += ';AA=' + aa
+
+        return True
+
+    def summary(self):
+        return polarise_summary(self.counts)
+
+
+def polarise_contig(job):
+
+    """
+    polarises the records of one contig of a bgzipped, tabix indexed vcf to a bgzf part file without
+    an end of file marker, returning the part size, counters and the tabix entries of its records
+    :param job: tuple
+    :return: tuple
+    """
+
+    vcf_file, wga_file, chromo, part_file = job
+    wga_bed = WGAIndex(wga_file)
+    counts = dict.fromkeys(COUNTERS, 0)
+
+    entries = []
+    with open(part_file, 'wb') as part:
+        writer = BGZFWriter(part)
+        for line in pysam.TabixFile(vcf_file).fetch(chromo):
+            out_line = polarise_line(line + '\n', wga_bed, counts)
+            start_offset = writer.tell()
+            writer.write(out_line)
+            entries.append(vcf_record_span(out_line) + (start_offset, writer.tell()))
+        part_size = writer.close(eof=False)
+
+    entries = numpy.array(entries, dtype=numpy.int64).reshape(-1, 4)
+
+    return chromo, part_file, part_size, counts, entries.T
+
+
+def polarise_bgzipped(vcf_file, wga_file, out_vcf, threads=1):
+
+    """
+    polarises a bgzipped, tabix indexed vcf contig by contig, with more than one thread contigs are
+    processed in a pool, parts are concatenated in contig order and the tabix index is built from
+    the record offsets taken as they were written
+    :param vcf_file: str
+    :param wga_file: str
+    :param out_vcf: str
+    :param threads: int
+    :return: dict
+    """
+
+    tabix = pysam.TabixFile(vcf_file)
+    header = polarise_header([x + '\n' for x in tabix.header])
+    jobs = [(vcf_file, wga_file, x, '{}.{}.part'.format(out_vcf, x)) for x in tabix.contigs]
+
+    pool = None
+    if threads > 1:
+        pool = Pool(processes=threads)
+        results = pool.imap(polarise_contig, jobs)
+    else:
+        results = (polarise_contig(x) for x in jobs)
+
+    counts = dict.fromkeys(COUNTERS, 0)
+    index = TabixIndexBuilder()
+    with open(out_vcf, 'wb') as out_file:
+        writer = BGZFWriter(out_file)
+        writer.write(''.join(header))
+        offset = writer.close(eof=False)
+
+        for chromo, part_file, part_size, part_counts, entries in results:
+            with open(part_file, 'rb') as part:
+                shutil.copyfileobj(part, out_file)
+            os.remove(part_file)
+
+            beg, end, start_offsets, end_offsets = entries
+            index.add(chromo, beg, end, start_offsets + (offset << 16), end_offsets + (offset << 16))
+            offset += part_size
+            for x in COUNTERS:
+                counts[x] += part_counts[x]
+
+        out_file.write(BGZF_EOF)
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    index.write(out_vcf + '.tbi')
+
+    return counts
 
 
 def main():
 
     # arguments
     parser = argparse.ArgumentParser()
-    parser.add_argument('-vcf', help='VCF file containing insertion and deletion variants to polarise', required=True)
-    parser.add_argument('-wga_bed', help='tabix indexed whole genome alignment bed file', required=True)
+    parser.add_argument('-vcf', help='VCF file containing insertion and deletion variants to polarise, if bgzipped '
+                                     'and tabix indexed contigs are processed in parallel and the output is '
+                                     'bgzipped and indexed', required=True)
+    parser.add_argument('-wga_bed', help='tabix indexed whole genome alignment bed file, compiled to an index '
+                                         'next to the bed on first use', required=True)
+    parser.add_argument('-threads', help='Number of contigs to polarise at once, bgzipped vcfs only',
+                        default=1, type=int)
     parser.add_argument('-sub', help='If specified will submit script to cluster', action='store_true', default=False)
     args = parser.parse_args()
 
     # submission loop
     if args.sub is True:
         command_line = [' '.join([x for x in sys.argv if x != '-sub'])]
-        q_sub(command_line, out=args.vcf.replace('.vcf', 'polarisation'))
+        q_sub(command_line, out=args.vcf.replace('.vcf', 'polarisation'), tr=args.threads)
         sys.exit()
 
     # variables
     vcf_file = args.vcf
     out_vcf = vcf_file.replace('.vcf', '.polarised.vcf')
-    wga_bed = pysam.TabixFile(args.wga_bed)
 
-    # counters
-    counter = 0
-    match = 0
-    no_hotspot = 0
-    low_coverage = 0
-    ambiguous = 0
+    # bgzipped vcf straight to bgzipped output
+    if vcf_file.endswith('.gz'):
+        counts = polarise_bgzipped(vcf_file, args.wga_bed, out_vcf, args.threads)
 
     # loop through vcf file and annotate INDELs
-    previous_line = ''
-    with open(out_vcf, 'w') as annotated_vcf:
-        for line in open(vcf_file):
-
-            # added new header line
-            if line.startswith('#'):
-                if line.startswith('##contig') and previous_line.startswith('##INFO'):
-                    new_info = '##INFO=<ID=AA,Number=1,Type=String,Description="Ancestral Allele">\n'
-                    annotated_vcf.write(new_info)
-                previous_line = line
-                annotated_vcf.write(line)
-
-            # process variants
-            else:
-                counter += 1
-                orig_line = line
-                line = line.split('\t')
-                chrom, pos, ref, alt, info = line[0], line[1], line[3], line[4], line[7]
-
-                if len(ref) > 1:
-                    var_type = 'INDEL'
-                else:
-                    var_type = 'SNP'
-
-                # get aligned seq for var
-                var_align = [x for x in wga_bed.fetch(chrom, int(pos) - 1, int(pos) - 1 + len(ref),
-                                                      parser=pysam.asTuple())]
-
-                # skip if not in alignment
-                if len(var_align) == 0:
-                    annotated_vcf.write(orig_line)
-                    low_coverage += 1
-                    continue
-
-                elif len(var_align) > 1:
-                    if var_type == 'SNP':
-                        annotated_vcf.write(orig_line)
-                        no_hotspot += 1
-                        continue
-
-                    # catch deletions rel to ref that uniq to ref spp
-                    else:
-                        # merge sequences from multiple bed rows
-                        merged_align = [''.join(y) for y in zip(*[x[7].split(',') for x in var_align])]
-                        if '-' not in ''.join(merged_align):
-                            var_align = merged_align
-                        else:
-                            annotated_vcf.write(orig_line)
-                            no_hotspot += 1
-                            continue
-
-                else:
-                    var_align = [x[7] for x in var_align][0].split(',')
-
-                var_align = [x.upper() for x in var_align]
-                # print chrom, pos, len(ref), ref, alt, var_align
-
-                # skip positions without full coverage
-                if '?' in ''.join(var_align):
-                    annotated_vcf.write(orig_line)
-                    low_coverage += 1
-                    continue
-
-                # skip indel hotspots
-                indel_sequences = [y.rstrip('-') for y in var_align]
-                if '-' in ''.join(indel_sequences):
-                    annotated_vcf.write(orig_line)
-                    no_hotspot += 1
-                    continue
-
-                # skips sites where ref allele differs from that in alignment, ie insertion within INDEL
-                if ref != var_align[0].upper():
-                    no_hotspot += 1
-                    annotated_vcf.write(orig_line)
+    else:
+        wga_bed = WGAIndex(args.wga_bed)
+        counts = dict.fromkeys(COUNTERS, 0)
+        header = []
+        with open(out_vcf, 'w') as annotated_vcf:
+            for line in open(vcf_file):
+                if line.startswith('#'):
+                    header.append(line)
                     continue
+                if len(header):
+                    annotated_vcf.write(''.join(polarise_header(header)))
+                    header = []
+                annotated_vcf.write(polarise_line(line, wga_bed, counts))
+            annotated_vcf.write(''.join(polarise_header(header)))
 
-                else:
-                    # identify if ref or alt is ancestral
-                    out_group_seqs = var_align[1:]
-                    ref_anc = True
-                    alt_anc = True
-
-                    # identify ref ancestral
-                    for sequence in out_group_seqs:
-                        if var_type == 'INDEL':
-                            if len(ref) != len(sequence.rstrip('-')):
-                                ref_anc = False
-                                break
-                        else:
-                            if ref != sequence.rstrip('-'):
-                                ref_anc = False
-                                break
-
-                    # identify alt ancestral
-                    for sequence in out_group_seqs:
-                        if var_type == 'INDEL':
-                            if len(alt) != len(sequence.rstrip('-')):
-                                alt_anc = False
-                                break
-                        else:
-                            if alt != sequence.rstrip('-'):
-                                alt_anc = False
-                                break
-
-                    # skip ambiguous sites
-                    if alt_anc is ref_anc:
-                        ambiguous += 1
-                        annotated_vcf.write(orig_line)
-                        continue
-
-                    # set AA annotation
-                    aa = 'NONE'
-                    if ref_anc is True:
-                        aa = ';AA=' + ref
-                    elif alt_anc is True:
-                        aa = ';AA=' + alt
-
-                    # write annotation
-                    if not aa == 'NONE':
-                        polarised_line = '\t'.join(line[0:7]) + '\t' + info + aa + '\t' + '\t'.join(line[8:])
-                        annotated_vcf.write(polarised_line)
-                        match += 1
-                        # print ref, alt, aa
-
-    print('\n'
-          'Total no INDELs  : ' + str(counter) + '\n'
-          'INDELs polarised : ' + str(match) + '\n'
-          'Hotspots         : ' + str(no_hotspot) + '\n'
-          'Low spp coverage : ' + str(low_coverage) + '\n'
-          'Ambiguous        : ' + str(ambiguous) + '\n'
-          'Total unpolarised: ' + str(counter - match) + '\n')
+    print(polarise_summary(counts))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import numpy
+
+
+def sfs_vector(site_freqs):
+
+    """
+    condenses a list of site frequencies to its distinct frequencies and the number of sites at each
+    :param site_freqs: list
+    :return: numpy.array, numpy.array
+    """
+
+    return numpy.unique(numpy.asarray(site_freqs, dtype=numpy.float64), return_counts=True)
+
+
+def resample_counts(counts, n_reps, rng=None, n_sites=None):
+
+    """
+    resamples sites with replacement n_reps times as one multinomial draw per replicate over the bins of an sfs,
+    which matches drawing every site at random from the list of sites. Sites outside the bins, where n_sites
+    exceeds the binned total, are drawn too and then dropped, as a list resample binned afterwards would do
+    :param counts: numpy.array
+    :param n_reps: int
+    :param rng: numpy.random.RandomState
+    :param n_sites: int
+    :return: numpy.array
+    """
+
+    # module level draws share numpy's global state
+    if rng is None:
+        rng = numpy.random
+
+    counts = numpy.asarray(counts, dtype=numpy.int64)
+    total = int(counts.sum())
+    if n_sites is None:
+        n_sites = total
+    if n_sites == 0:
+        return numpy.zeros((n_reps, len(counts)), dtype=numpy.int64)
+
+    probs = numpy.append(counts, n_sites - total) / float(n_sites)
+
+    return rng.multinomial(n_sites, probs, size=n_reps)[:, :len(counts)]
+
+
+def tajima_constants(n):
+
+    """
+    returns the a1, e1 and e2 constants of theta_w and Tajima's D for a sample size
+    :param n: int
+    :return: float, float, float
+    """
+
+    a1 = sum(1.0/z for z in range(1, n))
+    a2 = sum(1.0/z**2 for z in range(1, n))
+
+    e1 = (1.0 / a1) * (((n + 1.0) / (3.0 * (n - 1.0))) - (1.0 / a1))
+    e2 = (1.0 / (a1**2 + a2)) * \
+         (((2.0 * (n**2 + n + 3.0)) / ((9.0 * n) * (n - 1.0))) -
+          ((n + 2.0) / (n * a1)) +
+          (a2 / a1**2))
+
+    return a1, e1, e2
+
+
+def diversity_stats(n, freqs, count_matrix):
+
+    """
+    returns theta_w, pi and Tajima's D for every row of a matrix of site counts over a set of frequencies,
+    D is 0 for rows with too few sites to compute it
+    :param n: int
+    :param freqs: numpy.array
+    :param count_matrix: numpy.array
+    :return: numpy.array, numpy.array, numpy.array
+    """
+
+    freqs = numpy.asarray(freqs, dtype=numpy.float64)
+    count_matrix = numpy.atleast_2d(count_matrix)
+    a1, e1, e2 = tajima_constants(n)
+
+    segsites = count_matrix.sum(axis=1).astype(numpy.float64)
+    tw = segsites / a1
+    pi_val = count_matrix.dot((1.0 - freqs**2 - (1.0-freqs)**2) * (n/(n-1.0)))
+
+    vd = (e1 * segsites) + ((e2 * segsites) * (segsites - 1.0))
+    tajd = numpy.zeros(len(segsites))
+    tajd[vd > 0] = (pi_val - tw)[vd > 0] / numpy.sqrt(vd[vd > 0])
+
+    return tw, pi_val, tajd
+
+
+def bootstrap_cis(n, site_freqs, n_callable, n_reps, rng=None):
+
+    """
+    returns the 95% percentile intervals of theta_w and pi per callable site and of Tajima's D from
+    resampling sites with replacement, all replicates are drawn and computed at once
+    :param n: int
+    :param site_freqs: list
+    :param n_callable: float
+    :param n_reps: int
+    :param rng: numpy.random.RandomState
+    :return: numpy.array, numpy.array, numpy.array
+    """
+
+    freqs, counts = sfs_vector(site_freqs)
+    tw, pi_val, tajd = diversity_stats(n, freqs, resample_counts(counts, n_reps, rng))
+
+    return (numpy.percentile(tw / n_callable, [2.5, 97.5]),
+            numpy.percentile(pi_val / n_callable, [2.5, 97.5]),
+            numpy.percentile(tajd, [2.5, 97.5]))
+
+
+def sfs_replicates(counts, n_reps, rng=None, n_sites=None):
+
+    """
+    returns the observed sfs followed by n_reps resampled sfs, as lists of counts per bin
+    :param counts: list
+    :param n_reps: int
+    :param rng: numpy.random.RandomState
+    :param n_sites: int
+    :return: list
+    """
+
+    return [list(counts)] + resample_counts(counts, n_reps, rng, n_sites).tolist()
+
+
+def block_sfs(site_freqs, site_blocks, n_blocks):
+
+    """
+    condenses site frequencies to a matrix of the number of sites at each distinct frequency in each block,
+    sites with a block index of -1 are left out
+    :param site_freqs: list
+    :param site_blocks: list
+    :param n_blocks: int
+    :return: numpy.array, numpy.array
+    """
+
+    site_freqs = numpy.asarray(site_freqs, dtype=numpy.float64)
+    site_blocks = numpy.asarray(site_blocks, dtype=numpy.int64)
+    in_block = site_blocks >= 0
+    freqs, bins = numpy.unique(site_freqs[in_block], return_inverse=True)
+    counts = numpy.bincount(site_blocks[in_block] * len(freqs) + bins, minlength=n_blocks * len(freqs))
+
+    return freqs, counts.reshape(n_blocks, len(freqs))
+
+
+def block_bootstrap_cis(n, freqs, block_counts, block_callable, n_reps, rng=None):
+
+    """
+    returns the 95% percentile intervals of theta_w and pi per callable site and of Tajima's D from resampling
+    blocks with replacement, each replicate sums the sfs counts and callable sites of its blocks
+    :param n: int
+    :param freqs: numpy.array
+    :param block_counts: numpy.array
+    :param block_callable: numpy.array
+    :param n_reps: int
+    :param rng: numpy.random.RandomState
+    :return: numpy.array, numpy.array, numpy.array
+    """
+
+    if rng is None:
+        rng = numpy.random
+
+    n_blocks = len(block_callable)
+    if n_blocks == 0:
+        return numpy.zeros(2), numpy.zeros(2), numpy.zeros(2)
+
+    # number of times each block is drawn in each replicate
+    draws = rng.multinomial(n_blocks, numpy.full(n_blocks, 1.0 / n_blocks), size=n_reps)
+    n_callable = draws.dot(numpy.asarray(block_callable, dtype=numpy.float64))
+    tw, pi_val, tajd = diversity_stats(n, freqs, draws.dot(block_counts))
+
+    has_callable = n_callable > 0
+    tw[has_callable] /= n_callable[has_callable]
+    pi_val[has_callable] /= n_callable[has_callable]
+    tw[~has_callable] = 0.0
+    pi_val[~has_callable] = 0.0
+
+    return (numpy.percentile(tw, [2.5, 97.5]),
+            numpy.percentile(pi_val, [2.5, 97.5]),
+            numpy.percentile(tajd, [2.5, 97.5]))
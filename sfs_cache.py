@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import argparse
+import hashlib
+import os
+import time
+import numpy
+from file_cache import file_checksum
+from vcf2raw_sfs import vcf2sfs
+
+# cache is trimmed back to this many bytes, least recently used entries first
+MAX_BYTES = 1024 ** 3
+
+KEY_ARRAY = '__key__'
+
+
+def default_cache_dir(vcf_file):
+
+    """
+    returns the cache directory shared by all vcfs in a directory
+    :param vcf_file: str
+    :return: str
+    """
+
+    return os.path.join(os.path.dirname(os.path.abspath(vcf_file)), 'sfs_cache')
+
+
+def cache_key(vcf_file, kind, params):
+
+    """
+    returns the description of a cached result, made of the vcf checksum, the kind of result and its sorted
+    parameters, the entry is named by the md5 of the description so a copied vcf shares its entries
+    :param vcf_file: str
+    :param kind: str
+    :param params: dict
+    :return: str
+    """
+
+    fields = [kind, file_checksum(vcf_file)] + ['{}={}'.format(x, params[x]) for x in sorted(params)]
+
+    return '\t'.join(fields)
+
+
+def entry_path(cache_dir, key):
+    return os.path.join(cache_dir, hashlib.md5(key.encode()).hexdigest() + '.npz')
+
+
+def cache_entries(cache_dir):
+
+    """
+    returns the path, size and last use time of every entry in a cache, least recently used first
+    :param cache_dir: str
+    :return: list
+    """
+
+    entries = []
+    if not os.path.isdir(cache_dir):
+        return entries
+
+    for file_name in os.listdir(cache_dir):
+        if not file_name.endswith('.npz'):
+            continue
+        path = os.path.join(cache_dir, file_name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((path, stat.st_size, stat.st_mtime))
+
+    return sorted(entries, key=lambda x: x[2])
+
+
+def evict(cache_dir, max_bytes=MAX_BYTES, keep=None):
+
+    """
+    removes the least recently used entries of a cache until it holds no more than max_bytes,
+    the entry just written is kept regardless
+    :param cache_dir: str
+    :param max_bytes: int
+    :param keep: str
+    :return: int
+    """
+
+    entries = cache_entries(cache_dir)
+    total = sum(x[1] for x in entries)
+    n_removed = 0
+    for path, size, last_used in entries:
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            # already evicted by another job
+            pass
+        total -= size
+        n_removed += 1
+
+    return n_removed
+
+
+def cached_arrays(vcf_file, kind, params, build, cache_dir=None, max_bytes=MAX_BYTES):
+
+    """
+    returns a dict of arrays computed from a vcf by build(), read from the cache if the same vcf and
+    parameters have been seen before, otherwise built, stored and the cache trimmed to max_bytes
+    :param vcf_file: str
+    :param kind: str
+    :param params: dict
+    :param build: function
+    :param cache_dir: str
+    :param max_bytes: int
+    :return: dict
+    """
+
+    if cache_dir is None:
+        cache_dir = default_cache_dir(vcf_file)
+
+    key = cache_key(vcf_file, kind, params)
+    path = entry_path(cache_dir, key)
+
+    # a hit refreshes the last use time of the entry, an entry evicted meanwhile is rebuilt
+    try:
+        with numpy.load(path) as entry:
+            arrays = {x: entry[x] for x in entry.files if x != KEY_ARRAY}
+    except (IOError, OSError):
+        arrays = None
+
+    if arrays is not None:
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return arrays
+
+    arrays = build()
+
+    # cache is optional, so a read only directory just means no reuse
+    try:
+        if not os.path.isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                if not os.path.isdir(cache_dir):
+                    raise
+        tmp_file = '{}.{}.tmp.npz'.format(path, os.getpid())
+        entry = dict(arrays)
+        entry[KEY_ARRAY] = numpy.array(key)
+        numpy.savez(tmp_file, **entry)
+        os.rename(tmp_file, path)
+        evict(cache_dir, max_bytes, keep=path)
+    except (IOError, OSError):
+        pass
+
+    return arrays
+
+
+def cached_vcf2sfs(vcf_name, mode, regions=(), degen=(), lengths=(), auto_only=False, skip_hetero=False,
+                   cache_dir=None, max_bytes=MAX_BYTES):
+
+    """
+    returns the site frequencies vcf2sfs gives for a vcf and set of arguments, from the sfs cache where possible
+    :param vcf_name: str
+    :param mode: str
+    :param regions: list
+    :param degen: int or list
+    :param lengths: set
+    :param auto_only: bool
+    :param skip_hetero: bool
+    :param cache_dir: str
+    :param max_bytes: int
+    :return: list
+    """
+
+    # only the arguments given are passed on, leaving the rest to the vcf2sfs defaults
+    kwargs = {'vcf_name': vcf_name, 'mode': mode, 'auto_only': auto_only, 'skip_hetero': skip_hetero}
+    for name, value in [('regions', regions), ('degen', degen), ('lengths', lengths)]:
+        if value is not None and value != () and value != []:
+            kwargs[name] = value
+
+    degen_list = [degen] if isinstance(degen, int) else degen
+    params = {'mode': mode, 'auto_only': auto_only, 'skip_hetero': skip_hetero,
+              'regions': ','.join(sorted(regions or [])),
+              'degen': ','.join(str(x) for x in sorted(degen_list or [])),
+              'lengths': ','.join(str(x) for x in sorted(lengths or []))}
+
+    def build():
+        return {'freqs': numpy.array(list(vcf2sfs(**kwargs)), dtype=numpy.float64)}
+
+    return cached_arrays(vcf_name, 'vcf2sfs', params, build, cache_dir, max_bytes)['freqs'].tolist()
+
+
+def main():
+
+    # arguments
+    parser = argparse.ArgumentParser(description='Prints the sfs of a vcf from the sfs cache, counts of each '
+                                                 'frequency as sort | uniq -c would give them, or with -list, '
+                                                 '-trim or -clear inspects and manages the cache')
+    parser.add_argument('-vcf', help='VCF to get the sfs of, or whose cache directory to inspect', default=None)
+    parser.add_argument('-mode', help='Mutation type', choices=['snp', 'ins', 'del', 'indel'], default=None)
+    parser.add_argument('-region', help='Genomic regions to include', action='append', default=[])
+    parser.add_argument('-degen', help='Degeneracy of coding SNPs to include', action='append', type=int,
+                        default=[])
+    parser.add_argument('-length', help='Indel lengths to include', action='append', type=int, default=[])
+    parser.add_argument('-auto_only', help='If specified excludes sex chromosomes', action='store_true',
+                        default=False)
+    parser.add_argument('-skip_hetero', help='If specified skips sites with heterozygous calls',
+                        action='store_true', default=False)
+    parser.add_argument('-cache_dir', help='Cache directory, defaults to sfs_cache in the vcf directory',
+                        default=None)
+    parser.add_argument('-max_bytes', help='Size the cache is trimmed to', type=int, default=MAX_BYTES)
+    parser.add_argument('-list', help='If specified lists the cached entries, least recently used first',
+                        action='store_true', default=False)
+    parser.add_argument('-trim', help='If specified trims the cache to -max_bytes', action='store_true',
+                        default=False)
+    parser.add_argument('-clear', help='If specified removes every cached entry', action='store_true',
+                        default=False)
+    args = parser.parse_args()
+
+    if args.cache_dir is None and args.vcf is None:
+        parser.error('one of -vcf and -cache_dir must be specified')
+    cache_dir = default_cache_dir(args.vcf) if args.cache_dir is None else args.cache_dir
+
+    if args.list:
+        total = 0
+        for path, size, last_used in cache_entries(cache_dir):
+            with numpy.load(path) as entry:
+                key = str(entry[KEY_ARRAY]) if KEY_ARRAY in entry.files else ''
+            print(os.path.basename(path), size, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_used)),
+                  key, sep='\t')
+            total += size
+        print('total', total, sep='\t')
+
+    elif args.trim or args.clear:
+        max_bytes = 0 if args.clear else args.max_bytes
+        print(evict(cache_dir, max_bytes), 'entries removed', sep='\t')
+
+    else:
+        if args.vcf is None or args.mode is None:
+            parser.error('-vcf and -mode must be specified to get an sfs')
+        freqs = cached_vcf2sfs(args.vcf, args.mode, args.region, args.degen, args.length,
+                               args.auto_only, args.skip_hetero, cache_dir, args.max_bytes)
+        counts = {}
+        for freq in freqs:
+            counts[str(freq)] = counts.get(str(freq), 0) + 1
+        for freq in sorted(counts):
+            print('', counts[freq], freq)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,8 @@ import sys
 import gzip
 import pysam
 from summary_stats import pi, theta_w, tajimas_d
+from callable_mask import CallableMask
+from transcript_callable import read_callable_table, bed_callable_counts
 
 
 def bed_to_dict(zero_bed, four_bed):
@@ -35,8 +37,10 @@ def main():
     # arguments
     parser = argparse.ArgumentParser(description='')
     parser.add_argument('-call_fa',
-                        help='Callable sites fasta file',
-                        required=True)
+                        help='Callable sites fasta file, required unless -call_table is specified')
+    parser.add_argument('-call_table',
+                        help='Per transcript callable sites table from transcript_callable.py, if specified '
+                             'callable sites are read from it rather than counted from -call_fa')
     parser.add_argument('-vcf',
                         help='Vcf file to extract site frequencies from',
                         required=True)
@@ -68,39 +72,45 @@ def main():
               mem=15, rmem=15)
         sys.exit()
 
+    if args.call_fa is None and args.call_table is None:
+        sys.exit('one of -call_fa or -call_table must be specified')
+
     # variables
-    call_fa = pysam.FastaFile(args.call_fa)
     vcf = pysam.VariantFile(args.vcf)
     gene_coords = bed_to_dict(args.zbed, args.fbed)
     number_samples = len(vcf.header.samples)
+
+    # callable sites per transcript
+    if args.call_table is not None:
+        call_table = read_callable_table(args.call_table)
+        call_counts = {degen: {x: y[site_class]['all'] for x, y in call_table.items() if site_class in y}
+                       for degen, site_class in [(0, 'zerofold'), (4, 'fourfold')]}
+    else:
+        call_mask = CallableMask(args.call_fa)
+        call_counts = {degen: {x: y['all'] for x, y in bed_callable_counts(call_mask, bed)[0].items()}
+                       for degen, bed in [(0, args.zbed), (4, args.fbed)]}
     out = open(args.out, 'w')
 
     # gene by gene calcs
     print('trans_id', 'pi0', 'pi4', 'theta0', 'theta4', 'tajd0', 'tajd4', sep='\t', file=out)
 
     for chromosome in gene_coords.keys():
-        chr_string = call_fa.fetch(chromosome)
         for trans in gene_coords[chromosome].keys():
             pies = {0: 0, 4: 0}
             thetas = {0: 0, 4: 0}
             tajs = {0: 0, 4: 0}
             for degen in gene_coords[chromosome][trans].keys():
-                call_sites = ''
                 allele_freqs = []
                 for pos in gene_coords[chromosome][trans][degen]:
 
-                    # get callable site
-                    call_pos = chr_string[pos]
-                    call_sites += call_pos
-
                     # get vcf site (try to)
                     var_record = [x for x in vcf.fetch(chromosome, pos, pos+1)]
                     if len(var_record) == 1:
                         allele_freq = round(var_record[0].info['AC'][0] / float(number_samples * 2), 3)
                         allele_freqs.append(allele_freq)
 
-                # count callable sites for transcript
-                n_callable = call_sites.upper().count('K')
+                # callable sites for transcript
+                n_callable = call_counts[degen][trans]
 
                 # calc pi
                 if len(allele_freqs) == 0:
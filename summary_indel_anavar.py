@@ -5,9 +5,10 @@ import anavar_utils as an
 import argparse
 from qsub import *
 import sys
-import random
+import numpy
 from multiprocessing import Pool
 from collections import Counter
+from sfs_bootstrap import sfs_replicates
 
 
 def read_callable_csv(csv):
@@ -23,14 +24,6 @@ def read_callable_csv(csv):
     return call_sites
 
 
-def resample_replace(site_freqs):
-    resamp_sfs = []
-    for i in range(0, len(site_freqs)):
-        random_no = random.randint(0, len(site_freqs) - 1)
-        resamp_sfs.append(site_freqs[random_no])
-    return resamp_sfs
-
-
 def sfs2counts(freq_list, n):
     pos_biallelic_freqs = [round(i / float(n), 3) for i in range(1, int(n))]
 
@@ -50,7 +43,7 @@ def sfs2counts(freq_list, n):
 
 
 def indel_anavar(arg_tuple):
-    ins_sfs, ins_m, del_sfs, del_m, bootstrap, n, region, c, out_stem = arg_tuple
+    ins_reps, ins_m, del_reps, del_m, n, region, c, out_stem = arg_tuple
 
     anavar_path = '/shared/evolgen1/shared_data/program_files/iceberg/'
 
@@ -58,19 +51,8 @@ def indel_anavar(arg_tuple):
 
     results = []
 
-    for i in [0] + range(1, bootstrap+1):
-
-        # sort sfs
-        if i == 0:
-            sfs_i = ins_sfs
-            sfs_d = del_sfs
-        else:
-            sfs_i = resample_replace(ins_sfs)
-            sfs_d = resample_replace(del_sfs)
-
-        # convert to correct format for anavar
-        sfs_i = sfs2counts(sfs_i, n)
-        sfs_d = sfs2counts(sfs_d, n)
+    # observed sfs then bootstrap replicates
+    for i, (sfs_i, sfs_d) in enumerate(zip(ins_reps, del_reps)):
 
         # sort file names
         ctl_name = out_stem + '.rep{}.control.txt'.format(i)
@@ -109,6 +91,8 @@ def main():
     parser.add_argument('-c', help='Number of classes to run model with', required=True, type=int)
     parser.add_argument('-call_csv', help='Callable sites summary file', required=True)
     parser.add_argument('-bootstrap', help='Number of bootstrap replicates', default=0, type=int)
+    parser.add_argument('-seed', help='Random seed for bootstrapping, for reproducible replicates', type=int,
+                        default=None)
     parser.add_argument('-out_pre', help='File path and prefix for output', required=True)
     parser.add_argument('-sub', help='If specified will submit script to cluster', action='store_true', default=False)
     parser.add_argument('-evolgen', help='If specified will run on evolgen', default=False, action='store_true')
@@ -123,6 +107,7 @@ def main():
     # variables
     call_site_dict = read_callable_csv(args.call_csv)
     out_pre = args.out_pre
+    rng = numpy.random.RandomState(args.seed)
     processes_args = []
 
     # set up each region run
@@ -158,8 +143,12 @@ def main():
         del_m = call_site_dict['ALL'][region]['pol']
         ins_m = call_site_dict['ALL'][region]['pol']
 
+        # anavar format sfs and all bootstrap replicates, resampled from the sites of each sfs
+        ins_reps = sfs_replicates(sfs2counts(ins_sfs, args.n), args.bootstrap, rng, len(ins_sfs))
+        del_reps = sfs_replicates(sfs2counts(del_sfs, args.n), args.bootstrap, rng, len(del_sfs))
+
         # construct process
-        anavar_args = (ins_sfs, ins_m, del_sfs, del_m, args.bootstrap, args.n, region, args.c, file_stem)
+        anavar_args = (ins_reps, ins_m, del_reps, del_m, args.n, region, args.c, file_stem)
         processes_args.append(anavar_args)
 
     # initiate pool and run processes
@@ -28,13 +28,13 @@ for m in mode_dict[mode]:
         new_out = '{}{}_{}_{}.sfs.txt'.format(out, spp, m, r.replace('_', ''))
         if r == 'ar':
             r = 'intergenic_ar -region intron_ar'
-        sfs_cmd = ('~/sfs_utils/vcf2raw_sfs.py '
+        # counts of each frequency from the sfs cache, as sort | uniq -c on the vcf2raw_sfs.py output gave them
+        sfs_cmd = ('sfs_cache.py '
                    '-vcf {} '
                    '-mode {} '
                    '-auto_only '
                    '-skip_hetero '
                    '-region {} '
-                   '| sort | uniq -c | while read i; do echo " "$i; done | tr -s " " '
                    '> {}').format(vcf, m, r, new_out)
 
         if r == 'ALL':
@@ -4,14 +4,26 @@ from __future__ import print_function
 import argparse
 from qsub import *
 import math
-import random
 import numpy
 import sys
-
-
-def popen_grab(cmd):
-    output_lines_list = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE).communicate()[0].split('\n')[:-1]
-    return output_lines_list
+import pysam
+from vcf2raw_sfs import get_out_freq, is_auto
+from callable_mask import CallableMask, letters_to_codes
+from gff_index import gff_regions
+from degen_to_bed import DegeneracyTrack
+from indel_lengths import indel_type, is_hetero
+from sfs_bootstrap import bootstrap_cis, block_sfs, block_bootstrap_cis
+from sfs_cache import cached_arrays
+
+# ANNO values making up each region, regions absent here are made up of DEGEN values, ALL takes every variant
+REGION_ANNOS = {'CDS': {'CDS_frameshift', 'CDS_non_frameshift'},
+                'CDS_frameshift': {'CDS_frameshift'},
+                'CDS_non_frameshift': {'CDS_non_frameshift'},
+                'intron': {'intron'},
+                'intergenic': {'intergenic'},
+                'non-coding': {'intergenic', 'intron'},
+                'AR': {'intergenic_ar', 'intron_ar'}}
+REGION_DEGENS = {'zerofold': 0, 'fourfold': 4}
 
 
 def theta_w(n, segsites):
@@ -59,22 +71,371 @@ def read_callable_csv(csv):
     return call_sites
 
 
-def resample_replace(site_freqs):
-    resamp_sfs = []
-    for i in range(0, len(site_freqs)):
-        random_no = random.randint(0, len(site_freqs) - 1)
-        resamp_sfs.append(site_freqs[random_no])
-    return resamp_sfs
+def window_bounds(call_prefix, size, step, callable_windows=False):
+
+    """
+    returns the 0-based half open windows along a chromosome and their callable site counts, windows are
+    either fixed in bp or hold a fixed number of callable sites, with size and step in the same units
+    :param call_prefix: numpy.array
+    :param size: int
+    :param step: int
+    :param callable_windows: bool
+    :return: numpy.array, numpy.array, numpy.array
+    """
+
+    length = len(call_prefix) - 1
+
+    if callable_windows:
+        # window bounds sit on callable sites, the first base after each run of size callable sites
+        total = call_prefix[-1]
+        first = numpy.arange(0, total, step)
+        last = numpy.minimum(first + size, total)
+        starts = numpy.searchsorted(call_prefix, first + 1) - 1
+        ends = numpy.searchsorted(call_prefix, last)
+    else:
+        starts = numpy.arange(0, length, step)
+        ends = numpy.minimum(starts + size, length)
+
+    return starts, ends, call_prefix[ends] - call_prefix[starts]
+
+
+def site_frequencies(vcf_file, chromo, mode, n):
+
+    """
+    streams the biallelic variants of a mode on a chromosome, skipping sites with heterozygous calls,
+    and returns their 0-based positions and folded frequencies
+    :param vcf_file: str
+    :param chromo: str
+    :param mode: str
+    :param n: int
+    :return: numpy.array, list
+    """
+
+    positions = []
+    freqs = []
+    try:
+        variants = pysam.VariantFile(vcf_file).fetch(chromo)
+        for variant in variants:
+            if variant.alts is None or len(variant.alts) != 1:
+                continue
+            is_snp = len(variant.ref) == 1 and len(variant.alts[0]) == 1
+            if is_snp != (mode == 'SNP') or is_hetero(variant):
+                continue
+
+            positions.append(variant.pos - 1)
+            freqs.append(get_out_freq(variant, False, mode.lower(), n))
+
+    # contig without variants
+    except ValueError:
+        pass
+
+    return numpy.array(positions, dtype=numpy.int64), freqs
+
+
+def variant_in_region(region, anno, degen):
+
+    """
+    checks if a variant with an ANNO and DEGEN value, either of which may be None, belongs to a region
+    :param region: str
+    :param anno: str
+    :param degen: int
+    :return: bool
+    """
+
+    if region == 'ALL':
+        return True
+    elif region in REGION_ANNOS:
+        return anno in REGION_ANNOS[region]
+    else:
+        return degen == REGION_DEGENS[region]
+
+
+def region_frequencies(vcf_file, mode, n, regions, per_chromo=False, no_sex=False, block_size=None,
+                       block_offsets=None):
+
+    """
+    reads the site frequencies of every chromosome, region and mutation type in one pass of a vcf, skipping
+    sites with heterozygous calls, as the folded frequencies of snps or indels and the unfolded frequencies
+    of polarised deletions and insertions, returns the chromosomes in file order and the frequencies as
+    {chromo: {region: {mutation type: list}}} with genome wide frequencies under ALL. With a block size the
+    genome wide block index of each site, from the index of the first block of each chromosome, is returned
+    in a dict of the same shape, -1 for sites on chromosomes without blocks
+    :param vcf_file: str
+    :param mode: str
+    :param n: int
+    :param regions: list
+    :param per_chromo: bool
+    :param no_sex: bool
+    :param block_size: int
+    :param block_offsets: dict
+    :return: list, dict, dict
+    """
+
+    chromo_list = []
+    freqs = {'ALL': {x: {} for x in regions}}
+    blocks = {'ALL': {x: {} for x in regions}}
+    for variant in pysam.VariantFile(vcf_file):
+        if variant.chrom not in freqs and per_chromo:
+            chromo_list.append(variant.chrom)
+            freqs[variant.chrom] = {x: {} for x in regions}
+            blocks[variant.chrom] = {x: {} for x in regions}
+
+        # skip sex chromosomes if specified
+        if no_sex and not is_auto(variant):
+            continue
+        if variant.alts is None or len(variant.alts) != 1:
+            continue
+        is_snp = len(variant.ref) == 1 and len(variant.alts[0]) == 1
+        if is_snp != (mode == 'SNP') or is_hetero(variant):
+            continue
+
+        anno = variant.info.get('ANNO')
+        degen = variant.info.get('DEGEN')
+        variant_regions = [x for x in regions if variant_in_region(x, anno, degen)]
+        if len(variant_regions) == 0:
+            continue
+
+        # frequency of each mutation type the variant counts towards
+        site_freqs = [(mode.lower(), get_out_freq(variant, False, mode.lower(), n))]
+        if mode == 'INDEL':
+            ins_or_del = indel_type(variant)
+            if ins_or_del is not None:
+                site_freqs.append((ins_or_del, get_out_freq(variant, True, ins_or_del, n)))
+
+        block = -1
+        if block_size is not None and variant.chrom in block_offsets:
+            block = block_offsets[variant.chrom] + (variant.pos - 1) // block_size
+
+        for chromo in ([variant.chrom, 'ALL'] if per_chromo else ['ALL']):
+            for region in variant_regions:
+                for mute_type, freq in site_freqs:
+                    if freq is None:
+                        continue
+                    if mute_type not in freqs[chromo][region]:
+                        freqs[chromo][region][mute_type] = []
+                        blocks[chromo][region][mute_type] = []
+                    freqs[chromo][region][mute_type].append(freq)
+                    blocks[chromo][region][mute_type].append(block)
+
+    return chromo_list, freqs, blocks
+
+
+def cached_region_frequencies(vcf_file, mode, n, regions, per_chromo=False, no_sex=False, block_size=None,
+                              block_offsets=None):
+
+    """
+    returns the chromosomes, site frequencies and site blocks of region_frequencies() from the sfs cache,
+    reading the vcf only the first time a vcf is summarised with a set of arguments
+    :param vcf_file: str
+    :param mode: str
+    :param n: int
+    :param regions: list
+    :param per_chromo: bool
+    :param no_sex: bool
+    :param block_size: int
+    :param block_offsets: dict
+    :return: list, dict, dict
+    """
+
+    params = {'mode': mode, 'n': n, 'regions': ','.join(regions), 'per_chromo': per_chromo, 'no_sex': no_sex,
+              'block_size': block_size,
+              'block_offsets': None if block_offsets is None else sorted(block_offsets.items())}
+
+    # each list stored as an array named by its chromosome, region and mutation type
+    def build():
+        chromo_list, freqs, blocks = region_frequencies(vcf_file, mode, n, regions, per_chromo, no_sex,
+                                                        block_size, block_offsets)
+        arrays = {'chromo_list': numpy.array(chromo_list, dtype=str)}
+        for chromo in freqs:
+            for region in freqs[chromo]:
+                for mute_type in freqs[chromo][region]:
+                    name = '|'.join([chromo, region, mute_type])
+                    arrays['freqs|' + name] = numpy.array(freqs[chromo][region][mute_type], dtype=numpy.float64)
+                    arrays['blocks|' + name] = numpy.array(blocks[chromo][region][mute_type], dtype=numpy.int64)
+        return arrays
+
+    arrays = cached_arrays(vcf_file, 'region_frequencies', params, build)
+
+    chromo_list = arrays['chromo_list'].tolist()
+    freqs = {x: {y: {} for y in regions} for x in ['ALL'] + chromo_list}
+    blocks = {x: {y: {} for y in regions} for x in ['ALL'] + chromo_list}
+    for name in arrays:
+        if name.startswith('freqs|'):
+            chromo, region, mute_type = name.split('|')[1:]
+            freqs[chromo][region][mute_type] = arrays[name].tolist()
+            blocks[chromo][region][mute_type] = arrays['blocks|' + name[6:]].tolist()
+
+    return chromo_list, freqs, blocks
+
+
+def block_interval_counts(prefix, starts, ends, bounds):
+
+    """
+    sums the sites counted by a cumulative count array over a set of sorted, merged intervals
+    within each block between consecutive bounds
+    :param prefix: numpy.array
+    :param starts: numpy.array
+    :param ends: numpy.array
+    :param bounds: numpy.array
+    :return: numpy.array
+    """
+
+    starts = numpy.clip(numpy.asarray(starts, dtype=numpy.int64), 0, len(prefix) - 1)
+    ends = numpy.clip(numpy.asarray(ends, dtype=numpy.int64), 0, len(prefix) - 1)
+
+    # count at each bound is that of every interval ended by then, plus the part of any interval it falls in
+    done = numpy.zeros(len(starts) + 1, dtype=numpy.int64)
+    numpy.cumsum(prefix[ends] - prefix[starts], out=done[1:])
+    i = numpy.searchsorted(ends, bounds, side='right')
+    at_bounds = done[i]
+    partial = i < len(starts)
+    partial[partial] = starts[i[partial]] < bounds[partial]
+    at_bounds[partial] += prefix[bounds[partial]] - prefix[starts[i[partial]]]
+
+    return numpy.diff(at_bounds)
+
+
+def block_callable(call_fa, gff, block_size, degen_track=None):
+
+    """
+    counts the callable sites of each region in blocks of block_size bp along each chromosome, in one pass of
+    the callable fasta, as {region: {'all': numpy.array, 'pol': numpy.array}} over the blocks of all chromosomes
+    in fasta order, regions are those of the callable sites summary, with zerofold and fourfold from a degeneracy
+    track directory if given. Returns the chromosome of each block and the index of the first block of each
+    chromosome
+    :param call_fa: str
+    :param gff: str
+    :param block_size: int
+    :param degen_track: str
+    :return: numpy.array, dict, dict
+    """
+
+    call_mask = CallableMask(call_fa)
+    chromos = call_mask.contigs
+    chr_regions = gff_regions(gff, chromos)
+    degen_regions = {}
+    if degen_track is not None:
+        degen_track = DegeneracyTrack(degen_track)
+        degen_regions = {'zerofold': 0, 'fourfold': 4}
+
+    block_chromos = []
+    block_offsets = {}
+    counts = {x: {'all': [], 'pol': []} for x in ['ALL', 'CDS', 'intron', 'intergenic', 'AR'] + sorted(degen_regions)}
+    for chromo in chromos:
+        call_seq = call_mask[chromo]
+        bounds = numpy.append(numpy.arange(0, len(call_seq), block_size), len(call_seq))
+        n_blocks = len(bounds) - 1
+        block_offsets[chromo] = len(block_chromos)
+        block_chromos += [chromo] * n_blocks
+
+        for pol, letters, ar_letters in [('all', 'kK', 'rR'), ('pol', 'K', 'R')]:
+            prefix = call_seq.cumulative_counts(letters)
+            chromo_counts = {'ALL': numpy.diff(prefix[bounds])}
+
+            for region in ['CDS', 'intron']:
+                region_starts, region_ends = chr_regions[chromo][region]
+                chromo_counts[region] = block_interval_counts(prefix, region_starts, region_ends, bounds)
+
+            # sites outside genes
+            gene_starts, gene_ends = chr_regions[chromo]['gene']
+            if len(gene_starts) == 0:
+                gene_starts, gene_ends = chr_regions[chromo]['all_feat']
+            chromo_counts['intergenic'] = chromo_counts['ALL'] - block_interval_counts(prefix, gene_starts,
+                                                                                       gene_ends, bounds)
+
+            ar_prefix = call_seq.cumulative_counts(ar_letters)
+            chromo_counts['AR'] = numpy.diff(ar_prefix[bounds])
+
+            for region, degen in degen_regions.items():
+                track = degen_track.contig(chromo)[:len(call_seq)]
+                degen_sites = numpy.flatnonzero(track == degen)
+                degen_sites = degen_sites[numpy.in1d(call_seq.codes_at(degen_sites), letters_to_codes(letters))]
+                chromo_counts[region] = numpy.bincount(degen_sites // block_size, minlength=n_blocks)
+
+            for region in counts:
+                counts[region][pol].append(chromo_counts[region])
+
+    counts = {x: {y: numpy.concatenate(counts[x][y]) if len(counts[x][y]) else numpy.array([], dtype=numpy.int64)
+                  for y in ['all', 'pol']} for x in counts}
+
+    return numpy.array(block_chromos), counts, block_offsets
+
+
+def window_stats(n, positions, freqs, starts, ends, call_counts):
+
+    """
+    bins site frequencies into windows and yields the segregating sites, theta_w, pi and Tajima's D of each
+    :param n: int
+    :param positions: numpy.array
+    :param freqs: list
+    :param starts: numpy.array
+    :param ends: numpy.array
+    :param call_counts: numpy.array
+    :return: generator
+    """
+
+    lows = numpy.searchsorted(positions, starts)
+    highs = numpy.searchsorted(positions, ends)
+
+    for low, high, n_callable in zip(lows, highs, call_counts):
+        window_freqs = freqs[low: high]
+        try:
+            tw = theta_w(n, len(window_freqs)) / n_callable
+            pi_val = pi(n, window_freqs) / n_callable
+            tajd = tajimas_d(n, window_freqs)
+        except ZeroDivisionError:
+            tw, pi_val, tajd = 0.0, 0.0, 0.0
+
+        yield len(window_freqs), tw, pi_val, tajd
+
+
+def windowed_summary(vcf_file, call_fa, mode, n, size, step, callable_windows=False, no_sex=False):
+
+    """
+    prints a bedgraph style table of callable sites, theta_w, pi and Tajima's D in windows along each
+    chromosome of the callable fasta, callable sites and site frequencies are both read a chromosome at a time
+    :param vcf_file: str
+    :param call_fa: str
+    :param mode: str
+    :param n: int
+    :param size: int
+    :param step: int
+    :param callable_windows: bool
+    :param no_sex: bool
+    :return: None
+    """
+
+    sex_chromos = {'chrZ', 'Z', 'chrW', 'W', 'X', 'XHet', 'Y', 'YHet'}
+    call_mask = CallableMask(call_fa)
+
+    print('#chromo', 'start', 'end', 'callable', 'seg_sites', 'theta_w', 'pi', 'tajD', sep='\t')
+    for chromo in call_mask.contigs:
+
+        # skip sex chromosome if specified
+        if no_sex and chromo in sex_chromos:
+            continue
+
+        starts, ends, call_counts = window_bounds(call_mask[chromo].cumulative_counts('kK'), size, step,
+                                                  callable_windows)
+        positions, freqs = site_frequencies(vcf_file, chromo, mode, n)
+
+        for window in zip(starts, ends, call_counts, window_stats(n, positions, freqs, starts, ends, call_counts)):
+            start, end, n_callable, stats = window
+            print(chromo, start, end, n_callable, stats[0], round(stats[1], 10), round(stats[2], 10),
+                  round(stats[3], 10), sep='\t')
 
 
 def main():
     # arguments
     parser = argparse.ArgumentParser()
     parser.add_argument('-vcf', help='Vcf file to get summary stats for', required=True)
-    parser.add_argument('-call_csv', help='CSV file of callable sites', required=True)
+    parser.add_argument('-call_csv', help='CSV file of callable sites, required unless -window or -block_size is '
+                                          'specified')
     parser.add_argument('-mode', help='Variant mode', required=True, choices=['SNP', 'INDEL'])
     parser.add_argument('-bootstrap', help='If specified will perform the requested number of rounds of bootstrapping',
                         default=0)
+    parser.add_argument('-seed', help='Random seed for bootstrapping, for reproducible intervals', type=int,
+                        default=None)
     parser.add_argument('-no_sex', help='If specified will skip sex chromosomes', default=False, action='store_true')
     parser.add_argument('-per_chromo', help='If specified will print per chromosome stats as well as genome wide',
                         default=False, action='store_true')
@@ -83,8 +444,31 @@ def main():
     parser.add_argument('-sub', help='If specified will submit script to cluster', action='store_true', default=False)
     parser.add_argument('-evolgen', help='If specified will submit to lab queue', default=False, action='store_true')
     parser.add_argument('-out', help='Output file if submitted')
+    parser.add_argument('-window', help='If specified outputs theta_w, pi and Tajima\'s D in windows of this size '
+                                        'along each chromosome instead of per region', type=int, default=None)
+    parser.add_argument('-step', help='Step between window starts, defaults to the window size', type=int,
+                        default=None)
+    parser.add_argument('-callable_windows', help='If specified -window and -step are numbers of callable sites '
+                                                  'rather than bp', default=False, action='store_true')
+    parser.add_argument('-call_fa', help='Callable sites fasta, required with -window or -block_size')
+    parser.add_argument('-block_size', help='If specified bootstraps by resampling blocks of this size in bp rather '
+                                            'than sites, callable sites of each block are counted from -call_fa '
+                                            'and -gff and used in place of -call_csv', type=int, default=None)
+    parser.add_argument('-gff', help='GFF file to get block region coords from, required with -block_size')
+    parser.add_argument('-degen_track', help='Degeneracy track directory from degen_to_bed.py -track_dir, to count '
+                                             'zerofold and fourfold sites of blocks, required with -block_size '
+                                             'in SNP mode', default=None)
     args = parser.parse_args()
 
+    if args.window is None and args.block_size is None and args.call_csv is None:
+        sys.exit('-call_csv must be specified unless -window or -block_size is specified')
+    if args.window is not None and args.call_fa is None:
+        sys.exit('-call_fa must be specified in conjunction with -window')
+    if args.block_size is not None and (args.call_fa is None or args.gff is None):
+        sys.exit('-call_fa and -gff must be specified in conjunction with -block_size')
+    if args.block_size is not None and args.mode == 'SNP' and args.degen_track is None:
+        sys.exit('-degen_track must be specified in conjunction with -block_size in SNP mode')
+
     # submission loop
     if args.sub is True:
         if args.out is None:
@@ -99,21 +483,18 @@ def main():
 
     # variables
     vcf_file = args.vcf
-    callable_sites = read_callable_csv(args.call_csv)
     mode = args.mode
     markdown = args.md
     bootstrap = int(args.bootstrap)
     no_sex = args.no_sex
-    if no_sex:
-        sex_flag = '-auto_only'
-    else:
-        sex_flag = ''
-    n = int(popen_grab('zgrep ^#CHROM {} | wc -w'.format(vcf_file))[0]) - 9  # 9 columns before sample IDs in VCF
+    rng = numpy.random.RandomState(args.seed)
+    n = len(pysam.VariantFile(vcf_file).header.samples)
 
-    if args.per_chromo:
-        chromo_list = popen_grab('zgrep -v ^# {} | cut -f 1 | uniq'.format(vcf_file))
-    else:
-        chromo_list = []
+    # windowed track
+    if args.window is not None:
+        step = args.window if args.step is None else args.step
+        windowed_summary(vcf_file, args.call_fa, mode, n, args.window, step, args.callable_windows, no_sex)
+        sys.exit()
 
     sex_chromos = {'chrZ', 'Z', 'chrW', 'W', 'X', 'XHet', 'Y', 'YHet'}
 
@@ -122,6 +503,23 @@ def main():
     else:
         regions = ['ALL', 'CDS', 'CDS_frameshift', 'CDS_non_frameshift', 'intron', 'intergenic', 'non-coding', 'AR']
 
+    # callable sites of each region in each block, stored for all replicates to draw on and summed for the
+    # point estimates so both share the same sites
+    block_size = args.block_size
+    block_offsets = None
+    if block_size is not None:
+        block_chromos, block_calls, block_offsets = block_callable(args.call_fa, args.gff, block_size,
+                                                                   args.degen_track)
+        block_calls['non-coding'] = {x: block_calls['intergenic'][x] + block_calls['intron'][x]
+                                     for x in ['all', 'pol']}
+        autosome_blocks = ~numpy.in1d(block_chromos, list(sex_chromos))
+    else:
+        callable_sites = read_callable_csv(args.call_csv)
+
+    # site frequencies of every chromosome, region and mutation type from one pass of the vcf, or the sfs cache
+    chromo_list, freqs, site_blocks = cached_region_frequencies(vcf_file, mode, n, regions, args.per_chromo,
+                                                                no_sex, block_size, block_offsets)
+
     # write header
     if markdown is True:
         print('|region|bin|type|seg_sities|callable|theta_w|t_lwr|t_upr|pi|pi_lwr|pi_upr|tajD|tajD_lwr|tajD_upr|\n'
@@ -132,56 +530,44 @@ def main():
               'pi\tpi_lwr\tpi_upr\t'
               'tajD\ttajD_lwr\ttajD_upr')
 
-    # use sfs script to get freqs per region
+    # stats per region
     for chromo in chromo_list + ['ALL']:
 
         # skip sex chromosome if specified
         if no_sex and chromo in sex_chromos:
             continue
 
+        # blocks of the chromosome, or of the genome
+        if block_size is not None:
+            if chromo == 'ALL':
+                in_row = autosome_blocks if no_sex else numpy.ones(len(block_chromos), dtype=bool)
+            else:
+                in_row = block_chromos == chromo
+
         # for each region
         for region in regions:
 
-            if region == 'ALL':
-                region_flag = ''
-            elif region == 'CDS':
-                region_flag = ' -region CDS_frameshift -region CDS_non_frameshift'
-            elif region == 'AR':
-                region_flag = ' -region intergenic_ar -region intron_ar'
+            call_key = 'non-coding' if region == 'non-coding' else region.split('_')[0]
+            if block_size is not None:
+                all_callable = float(block_calls[call_key]['all'][in_row].sum())
+                pol_callable = float(block_calls[call_key]['pol'][in_row].sum())
             elif region == 'non-coding':
-                region_flag = ' -region intergenic -region intron'
-            elif region == 'zerofold':
-                region_flag = ' -degen 0'
-            elif region == 'fourfold':
-                region_flag = ' -degen 4'
-            else:
-                region_flag = ' -region ' + region
-
-            if region == 'non-coding':
                 all_callable = callable_sites[chromo]['intergenic']['all'] + callable_sites[chromo]['intron']['all']
                 pol_callable = callable_sites[chromo]['intergenic']['pol'] + callable_sites[chromo]['intron']['pol']
             else:
                 all_callable = callable_sites[chromo][region.split('_')[0]]['all']
                 pol_callable = callable_sites[chromo][region.split('_')[0]]['pol']
 
+            region_freqs = freqs[chromo][region]
+            region_blocks = site_blocks[chromo][region]
             if mode == 'SNP':
-                snp_sfs = popen_grab('~/sfs_utils/vcf2raw_sfs.py -vcf {} -chr {}{} -mode snp -skip_hetero -folded {}'
-                                     .format(vcf_file, chromo, region_flag, sex_flag))
-
-                sfs_list = [([float(x) for x in snp_sfs], 'snp', all_callable)]
+                sfs_list = [(region_freqs.get('snp', []), 'snp', all_callable, region_blocks.get('snp', []), 'all')]
 
             else:
-                del_sfs = popen_grab('~/sfs_utils/vcf2raw_sfs.py -vcf {} -chr {}{} -mode del -skip_hetero {}'
-                                     .format(vcf_file, chromo, region_flag, sex_flag))
-                ins_sfs = popen_grab('~/sfs_utils/vcf2raw_sfs.py  -vcf {} -chr {}{} -mode ins -skip_hetero {}'
-                                     .format(vcf_file, chromo, region_flag, sex_flag))
-                indel_sfs = popen_grab('~/sfs_utils/vcf2raw_sfs.py  -vcf {} -chr {}{} -mode indel '
-                                       '-skip_hetero -folded {}'
-                                       .format(vcf_file, chromo, region_flag, sex_flag))
-
-                sfs_list = [([float(x) for x in del_sfs], 'del', pol_callable),
-                            ([float(x) for x in ins_sfs], 'ins', pol_callable),
-                            ([float(x) for x in indel_sfs], 'indel', all_callable)]
+                sfs_list = [(region_freqs.get('del', []), 'del', pol_callable, region_blocks.get('del', []), 'pol'),
+                            (region_freqs.get('ins', []), 'ins', pol_callable, region_blocks.get('ins', []), 'pol'),
+                            (region_freqs.get('indel', []), 'indel', all_callable,
+                             region_blocks.get('indel', []), 'all')]
 
             # process all mute type sfs
             for mute_sfs in sfs_list:
@@ -202,24 +588,16 @@ def main():
                     ci_pi = [0, 0]
                     ci_tajd = [0, 0]
 
-                else:
-                    bs_theta = []
-                    bs_pi = []
-                    bs_tajd = []
+                elif block_size is not None:
+                    # resample blocks of the chromosome, or of the genome, summing their stored sfs and callable sites
+                    bins, block_counts = block_sfs(mute_sfs[0], mute_sfs[3], len(block_chromos))
+                    ci_tw, ci_pi, ci_tajd = block_bootstrap_cis(n, bins, block_counts[in_row],
+                                                                block_calls[call_key][mute_sfs[4]][in_row],
+                                                                bootstrap, rng)
 
-                    # resample with replacement - calc stats for each resample
-                    for bs in range(0, bootstrap):
-
-                        resampled_sfs = resample_replace(mute_sfs[0])
-
-                        bs_theta.append(theta_w(n, len(resampled_sfs)) / mute_sfs[2])
-                        bs_pi.append(pi(n, resampled_sfs) / mute_sfs[2])
-                        bs_tajd.append(tajimas_d(n, resampled_sfs))
-
-                    # calc cis
-                    ci_tw = numpy.percentile(bs_theta, [2.5, 97.5])
-                    ci_pi = numpy.percentile(bs_pi, [2.5, 97.5])
-                    ci_tajd = numpy.percentile(bs_tajd, [2.5, 97.5])
+                else:
+                    # resample with replacement - all replicates drawn and their stats calculated at once
+                    ci_tw, ci_pi, ci_tajd = bootstrap_cis(n, mute_sfs[0], mute_sfs[2], bootstrap, rng)
 
                 if markdown is True:
                     sep = '|'
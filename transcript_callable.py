@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import argparse
+import gzip
+import os
+import numpy
+import pysam
+from callable_mask import CallableMask, letters_to_codes
+from degen_to_bed import cds_transcripts, prem_stop_sites
+
+COLUMNS = ['chromo', 'start', 'end', 'trans_id', 'site_class', 'all_callable', 'pol_callable']
+
+
+def position_callable_counts(call_mask, chromos, positions, trans_ids):
+
+    """
+    counts the callable (kK) and polarisable (K) sites at 0-based positions for each transcript,
+    positions listed more than once are counted once per listing
+    :param call_mask: CallableMask
+    :param chromos: numpy.array
+    :param positions: numpy.array
+    :param trans_ids: numpy.array
+    :return: dict
+    """
+
+    trans_names, trans_index = numpy.unique(trans_ids, return_inverse=True)
+    all_counts = numpy.zeros(len(trans_names), dtype=numpy.int64)
+    pol_counts = numpy.zeros(len(trans_names), dtype=numpy.int64)
+
+    for chromo in numpy.unique(chromos):
+        on_chromo = chromos == chromo
+        codes = call_mask[chromo].codes_at(positions[on_chromo])
+        for counts, letters in [(all_counts, 'kK'), (pol_counts, 'K')]:
+            counts += numpy.bincount(trans_index[on_chromo], weights=numpy.in1d(codes, letters_to_codes(letters)),
+                                     minlength=len(trans_names)).astype(numpy.int64)
+
+    return {x: {'all': int(y), 'pol': int(z)} for x, y, z in zip(trans_names, all_counts, pol_counts)}
+
+
+def bed_callable_counts(call_mask, bed_file):
+
+    """
+    counts callable sites per transcript over the intervals of a bed file in the form
+    chr\tstart\tstop\ttrans_id[,trans_id], overlapping intervals are counted once per interval
+    :param call_mask: CallableMask
+    :param bed_file: str
+    :return: dict, dict
+    """
+
+    chromos, starts, ends, trans_ids = [], [], [], []
+    for line in gzip.open(bed_file):
+        chromo, start, stop, gene_id = line.rstrip().split('\t')
+        for trans_id in gene_id.split(','):
+            chromos.append(chromo)
+            starts.append(int(start))
+            ends.append(int(stop))
+            trans_ids.append(trans_id)
+
+    chromos = numpy.array(chromos)
+    starts = numpy.array(starts, dtype=numpy.int64)
+    ends = numpy.array(ends, dtype=numpy.int64)
+    trans_ids = numpy.array(trans_ids)
+
+    # transcript spans for the table index
+    spans = {}
+    for chromo, start, end, trans_id in zip(chromos, starts, ends, trans_ids):
+        if trans_id not in spans:
+            spans[trans_id] = [chromo, start, end]
+        spans[trans_id][1] = min(spans[trans_id][1], start)
+        spans[trans_id][2] = max(spans[trans_id][2], end)
+
+    # interval counts from running counts of each chromosome
+    trans_names, trans_index = numpy.unique(trans_ids, return_inverse=True)
+    all_counts = numpy.zeros(len(trans_names), dtype=numpy.int64)
+    pol_counts = numpy.zeros(len(trans_names), dtype=numpy.int64)
+    for chromo in numpy.unique(chromos):
+        on_chromo = chromos == chromo
+        chr_mask = call_mask[chromo]
+        chr_starts, chr_ends = starts[on_chromo], ends[on_chromo]
+        chr_ends = numpy.maximum(chr_starts, chr_ends)
+        if len(chr_starts) and (chr_starts.min() < 0 or chr_ends.max() > len(chr_mask)):
+            raise IndexError('position outside {}'.format(chromo))
+
+        for counts, letters in [(all_counts, 'kK'), (pol_counts, 'K')]:
+            prefix = chr_mask.cumulative_counts(letters)
+            counts += numpy.bincount(trans_index[on_chromo], weights=prefix[chr_ends] - prefix[chr_starts],
+                                     minlength=len(trans_names)).astype(numpy.int64)
+
+    counts = {x: {'all': int(y), 'pol': int(z)} for x, y, z in zip(trans_names, all_counts, pol_counts)}
+
+    return counts, spans
+
+
+def prem_stop_callable_counts(call_mask, cds_fa, chromo=None):
+
+    """
+    counts the callable sites per transcript of a CDS fasta at which a premature stop codon is possible,
+    with the span of each transcript, by default each transcript is looked up on the chromosome in its header
+    :param call_mask: CallableMask
+    :param cds_fa: str
+    :param chromo: str
+    :return: dict, dict
+    """
+
+    chromos, positions, trans_ids = [], [], []
+    spans = {}
+    for trans_name, trans_chromo, sequence, coords in cds_transcripts(cds_fa):
+        if chromo is not None:
+            trans_chromo = chromo
+        for site_pos, codon, pos, base_pos in prem_stop_sites(sequence, coords):
+            chromos.append(trans_chromo)
+            positions.append(site_pos - 1)
+            trans_ids.append(trans_name)
+        if trans_name not in spans:
+            spans[trans_name] = [trans_chromo, min(coords) - 1, max(coords)]
+
+    counts = position_callable_counts(call_mask, numpy.array(chromos),
+                                      numpy.array(positions, dtype=numpy.int64), numpy.array(trans_ids))
+
+    return counts, spans
+
+
+def write_callable_table(out_file, class_counts):
+
+    """
+    writes the per transcript callable site counts of each site class as a bgzipped, tabix indexed table
+    :param out_file: str
+    :param class_counts: list
+    :return: str
+    """
+
+    rows = []
+    for site_class, counts, spans in class_counts:
+        for trans_id in counts:
+            chromo, start, end = spans[trans_id]
+            rows.append((chromo, int(start), int(end), trans_id, site_class,
+                         counts[trans_id]['all'], counts[trans_id]['pol']))
+
+    if out_file.endswith('.gz'):
+        out_file = out_file[:-3]
+
+    with open(out_file, 'w') as out:
+        print('#' + '\t'.join(COLUMNS), file=out)
+        for row in sorted(rows):
+            print(*row, sep='\t', file=out)
+
+    return pysam.tabix_index(out_file, seq_col=0, start_col=1, end_col=2, zerobased=True, force=True)
+
+
+def read_callable_table(table, chromo=None):
+
+    """
+    reads a per transcript callable sites table into a dict of transcript, site class and
+    callable type, optionally for one chromosome only
+    :param table: str
+    :param chromo: str
+    :return: dict
+    """
+
+    if chromo is not None:
+        tabix = pysam.TabixFile(table)
+        lines = tabix.fetch(chromo) if chromo in tabix.contigs else []
+    else:
+        lines = gzip.open(table)
+
+    call_table = {}
+    for line in lines:
+        if line.startswith('#'):
+            continue
+        line = line.rstrip('\n').split('\t')
+        trans_id, site_class = line[3], line[4]
+        if trans_id not in call_table:
+            call_table[trans_id] = {}
+        call_table[trans_id][site_class] = {'all': int(line[5]), 'pol': int(line[6])}
+
+    return call_table
+
+
+def main():
+
+    # arguments
+    parser = argparse.ArgumentParser(description='Counts the callable and polarisable sites of each transcript '
+                                                 'for each site class once, for the per gene summary scripts')
+    parser.add_argument('-call_fa', help='Callable sites fasta file', required=True)
+    parser.add_argument('-bed', help='Bed file of sites with transcript ids, in form chr\tstart\tstop\ttrans_id, '
+                                     'with the site class label i.e. /path/to/zerofold.bed.gz,zerofold',
+                        action='append', default=[])
+    parser.add_argument('-cds_fa', help='If specified counts the sites where a premature stop is possible in '
+                                        'the transcripts of this CDS fasta as the prem_stop class', default=None)
+    parser.add_argument('-out', help='Output table, bgzipped and tabix indexed', required=True)
+    args = parser.parse_args()
+
+    call_mask = CallableMask(args.call_fa)
+    class_counts = []
+    for bed in args.bed:
+        bed_file, site_class = bed.split(',')
+        counts, spans = bed_callable_counts(call_mask, bed_file)
+        class_counts.append((site_class, counts, spans))
+
+    if args.cds_fa is not None:
+        counts, spans = prem_stop_callable_counts(call_mask, args.cds_fa)
+        class_counts.append(('prem_stop', counts, spans))
+
+    print(os.path.abspath(write_callable_table(args.out, class_counts)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,491 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import subprocess
+from collections import namedtuple
+import numpy
+from pysam import VariantFile, TabixFile
+
+BLOCK_BYTES = 64 * 1024 * 1024
+# blocks with sample columns are split into many more separators, so are kept small enough to stay in cache
+SAMPLE_BLOCK_BYTES = 1024 * 1024
+# per sample mean depths are estimated from this fraction of a contig, spread over evenly spaced windows
+DEPTH_SAMPLE_FRACTION = 0.05
+DEPTH_SAMPLE_WINDOWS = 20
+
+SiteRecord = namedtuple('SiteRecord', ['contig', 'pos', 'ref', 'alts'])
+
+
+def parse_digits(buf, starts, ends, max_width=18):
+
+    """
+    parses the unsigned integers held in byte spans of a buffer, flagging spans that are
+    empty or hold anything but digits
+    :param buf: numpy.array
+    :param starts: numpy.array
+    :param ends: numpy.array
+    :param max_width: int
+    :return: numpy.array, numpy.array
+    """
+
+    widths = ends - starts
+    values = numpy.zeros(widths.shape, dtype=numpy.int64)
+    numeric = (widths > 0) & (widths <= max_width)
+    if widths.size == 0:
+        return values, numeric
+
+    # digits are read from the right, so each only needs scaling by its own power of ten
+    for offset in range(min(widths.max(), max_width)):
+        digits = buf.take(ends - (offset + 1), mode='clip') - numpy.uint8(48)
+        digits[widths <= offset] = 0
+        numeric &= digits <= 9
+        values += digits.astype(numpy.int64) * 10 ** offset
+
+    values[~numeric] = 0
+
+    return values, numeric
+
+
+def parse_ints(buf, starts, ends):
+
+    """
+    parses the unsigned integers held in byte spans of a buffer
+    :param buf: numpy.array
+    :param starts: numpy.array
+    :param ends: numpy.array
+    :return: numpy.array
+    """
+
+    values, numeric = parse_digits(buf, starts, ends)
+    if not numeric.all():
+        raise ValueError('non numeric characters in integer field')
+
+    return values
+
+
+def digit_run_ends(buf, starts, max_width=12):
+
+    """
+    returns the end of the run of digits beginning at each start position
+    :param buf: numpy.array
+    :param starts: numpy.array
+    :param max_width: int
+    :return: numpy.array
+    """
+
+    ends = starts.copy()
+    running = numpy.ones(len(starts), dtype=bool)
+    for offset in range(max_width):
+        chars = buf[numpy.minimum(starts + offset, len(buf) - 1)]
+        running &= (chars >= 48) & (chars <= 57)
+        if not running.any():
+            break
+        ends += running
+
+    return ends
+
+
+class SiteBlock(object):
+
+    """
+    a block of consecutive allsites vcf records held as numpy arrays
+    """
+
+    def __init__(self, contig, text):
+
+        """
+        parses the columns needed for classification from a block of raw vcf lines,
+        the columns are located with numpy on the raw bytes rather than line by line
+        :param contig: str
+        :param text: str
+        """
+
+        self.contig = contig
+        self.text = text
+
+        buf = numpy.frombuffer(text, dtype=numpy.uint8)
+
+        # tabs, newlines and colons in file order, colons are only needed to split sample fields
+        self.separators = numpy.flatnonzero((buf == 9) | (buf == 10) | (buf == 58))
+        field_separators = numpy.flatnonzero(buf[self.separators] != 58)
+        is_newline = buf[self.separators[field_separators]] == 10
+        n_lines = int(is_newline.sum())
+
+        # every vcf line has the same number of columns, so the tabs form a regular matrix
+        if n_lines == 0 or len(field_separators) % n_lines != 0 or len(field_separators) // n_lines < 8:
+            raise ValueError('irregular number of columns in vcf block')
+        self.field_separators = field_separators.reshape(n_lines, len(field_separators) // n_lines)
+        if not is_newline.reshape(self.field_separators.shape)[:, -1].all():
+            raise ValueError('irregular number of columns in vcf block')
+
+        self.field_ends = self.separators[self.field_separators]
+        newlines = self.field_ends[:, -1]
+        line_starts = numpy.append(0, newlines[:-1] + 1)
+        self.field_starts = numpy.empty_like(self.field_ends)
+        self.field_starts[:, 0] = line_starts
+        self.field_starts[:, 1:] = self.field_ends[:, :-1] + 1
+
+        self.pos = parse_ints(buf, self.field_starts[:, 1], self.field_ends[:, 1])
+
+        ref_start, ref_end = self.field_starts[:, 3], self.field_ends[:, 3]
+        self.ref_n = (ref_end - ref_start == 1) & (buf[ref_start] == ord('N'))
+
+        # find 'DP=' keys that open an INFO entry
+        info_start, info_end = self.field_starts[:, 7], self.field_ends[:, 7]
+        self.has_dp = numpy.zeros(n_lines, dtype=bool)
+        self.dp = numpy.zeros(n_lines)
+
+        keys = numpy.flatnonzero(buf[1:-2] == ord('D')) + 1
+        keys = keys[(buf[keys + 1] == ord('P')) & (buf[keys + 2] == ord('=')) &
+                    ((buf[keys - 1] == ord(';')) | (buf[keys - 1] == 9))]
+        key_lines = numpy.searchsorted(line_starts, keys, side='right') - 1
+        in_info = (keys >= info_start[key_lines]) & (keys < info_end[key_lines])
+        keys, key_lines = keys[in_info], key_lines[in_info]
+
+        value_ends = digit_run_ends(buf, keys + 3)
+        numeric = value_ends > keys + 3
+        self.has_dp[key_lines[numeric]] = True
+        self.dp[key_lines[numeric]] = parse_ints(buf, keys[numeric] + 3, value_ends[numeric])
+
+    def __len__(self):
+        return len(self.pos)
+
+    def subset(self, keep):
+
+        """
+        drops records not flagged in boolean array keep
+        :param keep: numpy.array
+        :return: None
+        """
+
+        self.pos = self.pos[keep]
+        self.ref_n = self.ref_n[keep]
+        self.has_dp = self.has_dp[keep]
+        self.dp = self.dp[keep]
+        self.field_starts = self.field_starts[keep]
+        self.field_ends = self.field_ends[keep]
+        self.field_separators = self.field_separators[keep]
+
+    def field(self, i, column):
+
+        """
+        returns the text of a column of record i
+        :param i: int
+        :param column: int
+        :return: str
+        """
+
+        return self.text[self.field_starts[i, column]: self.field_ends[i, column]]
+
+    def record(self, i):
+
+        """
+        returns a lightweight record for site i that can be passed to polarisable()
+        :param i: int
+        :return: SiteRecord
+        """
+
+        alt = self.field(i, 4)
+        if alt == '.':
+            alts = None
+        else:
+            alts = tuple(alt.split(','))
+
+        return SiteRecord(self.contig, int(self.pos[i]), self.field(i, 3), alts)
+
+    def alleles(self):
+
+        """
+        returns the first base of the ref and first alt allele of each record, whether each of the two is a
+        single base and whether the record is monomorphic, alt bases are 0 for monomorphic records
+        :return: numpy.array, numpy.array, numpy.array, numpy.array, numpy.array
+        """
+
+        buf = numpy.frombuffer(self.text, dtype=numpy.uint8)
+        ref_start, ref_end = self.field_starts[:, 3], self.field_ends[:, 3]
+        alt_start, alt_end = self.field_starts[:, 4], self.field_ends[:, 4]
+
+        mono = (alt_end - alt_start == 1) & (buf[alt_start] == ord('.'))
+        alt_single = ((alt_end - alt_start == 1) | (buf[alt_start + 1] == ord(','))) & ~mono
+
+        return buf[ref_start], ref_end - ref_start == 1, numpy.where(mono, 0, buf[alt_start]), alt_single, mono
+
+    def line(self, i):
+
+        """
+        returns the full text of record i including the newline
+        :param i: int
+        :return: str
+        """
+
+        return self.text[self.field_starts[i, 0]: self.field_ends[i, -1] + 1]
+
+    def sample_depths(self):
+
+        """
+        returns the FORMAT/DP of every sample of every record as a records by samples array,
+        -1 where the depth is missing. The position of DP is looked up once per run of records
+        sharing a FORMAT string, then each sample's DP subfield is found by counting separators
+        :return: numpy.array
+        """
+
+        n_samples = self.field_starts.shape[1] - 9
+        if n_samples <= 0 or len(self) == 0:
+            return numpy.full((len(self), max(n_samples, 0)), -1, dtype=numpy.int64)
+
+        buf = numpy.frombuffer(self.text, dtype=numpy.uint8)
+        last = len(buf) - 1
+
+        # FORMAT strings only need reading where they differ from the previous record
+        format_starts, format_ends = self.field_starts[:, 8], self.field_ends[:, 8]
+        widths = format_ends - format_starts
+        changed = numpy.ones(len(self), dtype=bool)
+        changed[1:] = widths[1:] != widths[:-1]
+        for offset in range(widths.max()):
+            changed[1:] |= ((widths[1:] > offset) &
+                            (buf[numpy.minimum(format_starts[1:] + offset, last)] !=
+                             buf[numpy.minimum(format_starts[:-1] + offset, last)]))
+
+        # index of DP within the FORMAT column of each record, -1 if absent
+        run_dp_index = []
+        for i in numpy.flatnonzero(changed):
+            keys = self.field(i, 8).split(':')
+            run_dp_index.append(keys.index('DP') if 'DP' in keys else -1)
+        k = numpy.array(run_dp_index, dtype=numpy.int64)[numpy.cumsum(changed) - 1][:, None]
+
+        # each sample field opens at a tab, its k-th colon, if it comes before the
+        # field's closing tab, opens the DP subfield
+        separators = self.separators
+        opening, closing = self.field_separators[:, 8:-1], self.field_separators[:, 9:]
+
+        dp_open = opening + k
+        present = (k >= 0) & (dp_open < closing)
+        dp_starts = separators.take(dp_open, mode='clip') + 1
+        dp_ends = separators.take(dp_open + 1, mode='clip')
+
+        values, numeric = parse_digits(buf, dp_starts, dp_ends)
+
+        return numpy.where(present & numeric, values, -1)
+
+
+def text_blocks(in_file, block_bytes=BLOCK_BYTES):
+
+    """
+    reads an open file in large chunks, yielding only complete lines
+    :param in_file: file
+    :param block_bytes: int
+    :return: generator
+    """
+
+    remainder = ''
+    while True:
+        chunk = in_file.read(block_bytes)
+        if not chunk:
+            break
+
+        chunk = remainder + chunk
+        cut = chunk.rfind('\n') + 1
+        remainder = chunk[cut:]
+        if cut == 0:
+            continue
+
+        yield chunk[:cut]
+
+    if remainder != '':
+        yield remainder + '\n'
+
+
+def tabix_site_blocks(vcf_file, chromo, regions, block_bytes=None, samples=False):
+
+    """
+    streams the records tabix returns for a list of regions of one contig of a vcf in blocks
+    :param vcf_file: str
+    :param chromo: str
+    :param regions: list
+    :param block_bytes: int
+    :param samples: bool
+    :return: generator
+    """
+
+    # tabix prints nothing for a contig missing from its index, raise as pysam does rather than return no records
+    if chromo not in TabixFile(vcf_file).contigs:
+        raise ValueError('invalid contig {} for {}'.format(chromo, vcf_file))
+
+    # sample columns are dropped before they reach python unless they are needed, pipefail makes the
+    # exit status that of tabix rather than cut
+    tabix_cmd = 'tabix {} {}'.format(vcf_file, ' '.join(regions))
+    if not samples:
+        tabix_cmd += ' | cut -f 1-8'
+    if block_bytes is None:
+        block_bytes = SAMPLE_BLOCK_BYTES if samples else BLOCK_BYTES
+    tabix = subprocess.Popen(['bash', '-o', 'pipefail', '-c', tabix_cmd], stdout=subprocess.PIPE)
+
+    for text in text_blocks(tabix.stdout, block_bytes):
+        yield SiteBlock(chromo, text)
+
+    if tabix.wait() != 0:
+        raise IOError('tabix failed to read {} from {}'.format(' '.join(regions), vcf_file))
+
+
+def site_blocks(vcf_file, chromo, start=None, stop=None, block_bytes=None, samples=False):
+
+    """
+    streams the records of a chromosome or region of a tabix indexed vcf in blocks,
+    only records starting within [start, stop) are returned
+    :param vcf_file: str
+    :param chromo: str
+    :param start: int
+    :param stop: int
+    :param block_bytes: int
+    :param samples: bool
+    :return: generator
+    """
+
+    region = chromo
+    if start is not None or stop is not None:
+        region = '{}:{}-{}'.format(chromo, (start or 0) + 1, stop or '')
+
+    for block in tabix_site_blocks(vcf_file, chromo, [region], block_bytes, samples):
+
+        # tabix returns records overlapping the region, so trim those that start outside it
+        if start is not None or stop is not None:
+            keep = numpy.ones(len(block), dtype=bool)
+            if start is not None:
+                keep &= block.pos > start
+            if stop is not None:
+                keep &= block.pos <= stop
+            if not keep.all():
+                block.subset(keep)
+
+        yield block
+
+
+def depth_sample_blocks(vcf_file, chromo, fraction=DEPTH_SAMPLE_FRACTION, n_windows=DEPTH_SAMPLE_WINDOWS):
+
+    """
+    streams the records, with their sample columns, of evenly spaced windows covering a fraction of a contig,
+    enough to estimate per sample mean depths at a fraction of the cost of a full pass,
+    the whole contig is returned if its length is not in the vcf header or the windows would cover it
+    :param vcf_file: str
+    :param chromo: str
+    :param fraction: float
+    :param n_windows: int
+    :return: generator
+    """
+
+    length = contig_length(vcf_file, chromo)
+    window = 0 if length is None else max(1, int(length * fraction / n_windows))
+    step = 0 if length is None else length // n_windows
+    if window >= step:
+        regions = [chromo]
+    else:
+        regions = ['{}:{}-{}'.format(chromo, x + 1, x + window) for x in range(0, step * n_windows, step)]
+
+    return tabix_site_blocks(vcf_file, chromo, regions, samples=True)
+
+
+def file_site_blocks(in_file, block_bytes=SAMPLE_BLOCK_BYTES):
+
+    """
+    streams the records of an open plain text vcf, read past its header, in blocks
+    :param in_file: file
+    :param block_bytes: int
+    :return: generator
+    """
+
+    for text in text_blocks(in_file, block_bytes):
+        yield SiteBlock(None, text)
+
+
+def sample_mean_depths(blocks, n_samples):
+
+    """
+    returns the number of sites with a FORMAT/DP and the mean FORMAT/DP of each sample over blocks of records
+    :param blocks: generator
+    :param n_samples: int
+    :return: numpy.array, numpy.array
+    """
+
+    depth_sum = numpy.zeros(n_samples, dtype=numpy.int64)
+    n_sites = numpy.zeros(n_samples, dtype=numpy.int64)
+    for block in blocks:
+        depths = block.sample_depths()
+        present = depths >= 0
+        depth_sum += numpy.where(present, depths, 0).sum(axis=0)
+        n_sites += present.sum(axis=0)
+
+    return n_sites, depth_sum / numpy.maximum(n_sites, 1).astype(float)
+
+
+def write_sample_depths(out_file, samples, n_sites, mean_depths):
+
+    """
+    writes per sample mean depths in the same layout as vcftools --depth
+    :param out_file: str
+    :param samples: list
+    :param n_sites: numpy.array
+    :param mean_depths: numpy.array
+    :return: None
+    """
+
+    with open(out_file, 'w') as out:
+        print('INDV', 'N_SITES', 'MEAN_DEPTH', sep='\t', file=out)
+        for sample, sites, mean_depth in zip(samples, n_sites, mean_depths):
+            print(sample, sites, mean_depth, sep='\t', file=out)
+
+
+def read_sample_depths(depth_file, samples):
+
+    """
+    reads per sample mean depths, as written by vcftools --depth, in the order of the vcf samples
+    :param depth_file: str
+    :param samples: list
+    :return: numpy.array
+    """
+
+    mean_depths = {}
+    for line in open(depth_file):
+        line = line.split()
+        if line[0] == 'INDV':
+            continue
+        mean_depths[line[0]] = float(line[2])
+
+    missing = [x for x in samples if x not in mean_depths]
+    if len(missing) > 0:
+        raise KeyError('no mean depth for samples: {}'.format(', '.join(missing)))
+
+    return numpy.array([mean_depths[x] for x in samples])
+
+
+def samples_within_depth(depths, lower_depth_limits, upper_depth_limits):
+
+    """
+    counts for each record the samples whose FORMAT/DP lies within their own depth limits,
+    one row of counts is returned per row of limits
+    :param depths: numpy.array
+    :param lower_depth_limits: numpy.array
+    :param upper_depth_limits: numpy.array
+    :return: numpy.array
+    """
+
+    lower = numpy.asarray(lower_depth_limits, dtype=float).reshape(-1, 1, depths.shape[1])
+    upper = numpy.asarray(upper_depth_limits, dtype=float).reshape(-1, 1, depths.shape[1])
+    within = (depths >= 0) & (lower <= depths) & (depths <= upper)
+
+    return within.sum(axis=2)
+
+
+def contig_length(vcf_file, chromo):
+
+    """
+    returns the length of a contig from the vcf header, or None if it is not recorded
+    :param vcf_file: str
+    :param chromo: str
+    :return: int
+    """
+
+    header = VariantFile(vcf_file).header
+    if chromo not in header.contigs:
+        return None
+
+    return header.contigs[chromo].length
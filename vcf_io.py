@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import gzip
+import struct
+import zlib
+import numpy
+
+# bgzf blocks hold at most 64kb, data is cut a little short of that so incompressible blocks still fit
+BLOCK_DATA = 0xff00
+BGZF_EOF = ('\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00\x1b\x00'
+            '\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+
+# tabix binning scheme
+MIN_SHIFT = 14
+DEPTH = 5
+TBX_VCF = 2
+
+
+def bgzf_block(data, level=6):
+
+    """
+    compresses up to 64kb of data to a single bgzf block
+    :param data: str
+    :param level: int
+    :return: str
+    """
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+
+    header = struct.pack('<4BI2BH2BHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(deflated) + 25)
+    footer = struct.pack('<2I', zlib.crc32(data) & 0xffffffff, len(data))
+
+    return header + deflated + footer
+
+
+class BGZFWriter(object):
+
+    """
+    writes a bgzf stream, keeping track of the virtual offset of every byte written so tabix index entries
+    can be taken as records are written. Streams written without the end of file marker can be concatenated
+    """
+
+    def __init__(self, out_file, level=6):
+
+        """
+        :param out_file: file
+        :param level: int
+        """
+
+        self.out_file = out_file
+        self.level = level
+        self.buffer = []
+        self.buffered = 0
+        self.coffset = 0
+
+    def tell(self):
+
+        """
+        returns the virtual offset of the next byte to be written
+        :return: int
+        """
+
+        return (self.coffset << 16) | self.buffered
+
+    def write(self, data):
+
+        """
+        adds data to the stream, compressing each full block as it fills
+        :param data: str
+        :return: None
+        """
+
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= BLOCK_DATA:
+            data = ''.join(self.buffer)
+            n_full = len(data) // BLOCK_DATA
+            for i in range(n_full):
+                block = bgzf_block(data[i * BLOCK_DATA: (i + 1) * BLOCK_DATA], self.level)
+                self.out_file.write(block)
+                self.coffset += len(block)
+            data = data[n_full * BLOCK_DATA:]
+            self.buffer = [data]
+            self.buffered = len(data)
+
+    def flush(self):
+
+        """
+        compresses any buffered data as a final partial block
+        :return: None
+        """
+
+        if self.buffered:
+            block = bgzf_block(''.join(self.buffer), self.level)
+            self.out_file.write(block)
+            self.coffset += len(block)
+        self.buffer = []
+        self.buffered = 0
+
+    def close(self, eof=True):
+
+        """
+        flushes the stream and optionally writes the end of file marker, the underlying file is left open
+        :param eof: bool
+        :return: int
+        """
+
+        self.flush()
+        if eof:
+            self.out_file.write(BGZF_EOF)
+            self.coffset += len(BGZF_EOF)
+
+        return self.coffset
+
+
+def reg2bin(beg, end):
+
+    """
+    returns the tabix bin of each 0-based half open interval
+    :param beg: numpy.array
+    :param end: numpy.array
+    :return: numpy.array
+    """
+
+    beg = numpy.asarray(beg, dtype=numpy.int64)
+    end = numpy.asarray(end, dtype=numpy.int64) - 1
+    bins = numpy.zeros(len(beg), dtype=numpy.int64)
+    assigned = numpy.zeros(len(beg), dtype=bool)
+
+    # smallest bin holding the whole interval, from 16kb bins up
+    for level in range(DEPTH, 0, -1):
+        shift = MIN_SHIFT + 3 * (DEPTH - level)
+        offset = ((1 << 3 * level) - 1) // 7
+        fits = ~assigned & ((beg >> shift) == (end >> shift))
+        bins[fits] = offset + (beg[fits] >> shift)
+        assigned |= fits
+
+    return bins
+
+
+class TabixIndexBuilder(object):
+
+    """
+    collects the coordinates and virtual offsets of vcf records as they are written
+    and writes the tabix index of the file
+    """
+
+    def __init__(self):
+        self.contigs = []
+        self.entries = {}
+
+    def add(self, contig, beg, end, start_offsets, end_offsets):
+
+        """
+        adds the records of a contig in file order
+        :param contig: str
+        :param beg: numpy.array
+        :param end: numpy.array
+        :param start_offsets: numpy.array
+        :param end_offsets: numpy.array
+        :return: None
+        """
+
+        if len(beg) == 0:
+            return
+        if contig not in self.entries:
+            self.contigs.append(contig)
+            self.entries[contig] = []
+        self.entries[contig].append([numpy.asarray(x, dtype=numpy.int64)
+                                     for x in [beg, end, start_offsets, end_offsets]])
+
+    def contig_index(self, contig):
+
+        """
+        returns the binary bin and linear index of a contig
+        :param contig: str
+        :return: str
+        """
+
+        beg, end, start_offsets, end_offsets = [numpy.concatenate(x) for x in zip(*self.entries[contig])]
+        end = numpy.maximum(end, beg + 1)
+        bins = reg2bin(beg, end)
+
+        # records of a bin form one chunk until a record of another bin is written between them
+        order = numpy.lexsort((numpy.arange(len(bins)), bins))
+        new_chunk = numpy.ones(len(order), dtype=bool)
+        new_chunk[1:] = ((bins[order][1:] != bins[order][:-1]) |
+                         (start_offsets[order][1:] != end_offsets[order][:-1]))
+        chunk_starts = numpy.flatnonzero(new_chunk)
+        chunk_ends = numpy.append(chunk_starts[1:], len(order)) - 1
+        chunk_bins = bins[order][chunk_starts]
+        chunk_begs = start_offsets[order][chunk_starts]
+        chunk_stops = end_offsets[order][chunk_ends]
+
+        parts = []
+        unique_bins, first_chunk, n_chunks = numpy.unique(chunk_bins, return_index=True, return_counts=True)
+        parts.append(struct.pack('<i', len(unique_bins)))
+        for bin_id, first, n in zip(unique_bins, first_chunk, n_chunks):
+            parts.append(struct.pack('<Ii', bin_id, n))
+            chunks = numpy.empty(2 * n, dtype='<u8')
+            chunks[0::2] = chunk_begs[first: first + n]
+            chunks[1::2] = chunk_stops[first: first + n]
+            parts.append(chunks.tostring())
+
+        # linear index, lowest offset of a record overlapping each 16kb window, empty windows take the value
+        # of the nearest filled window to their left
+        first_window, last_window = beg >> MIN_SHIFT, (end - 1) >> MIN_SHIFT
+        n_windows = int(last_window.max()) + 1
+        linear = numpy.full(n_windows, numpy.iinfo(numpy.int64).max, dtype=numpy.int64)
+        spans = last_window - first_window + 1
+        windows = numpy.repeat(first_window, spans) + (numpy.arange(spans.sum()) -
+                                                       numpy.repeat(numpy.cumsum(spans) - spans, spans))
+        numpy.minimum.at(linear, windows, numpy.repeat(start_offsets, spans))
+        empty = linear == numpy.iinfo(numpy.int64).max
+        filled = numpy.maximum.accumulate(numpy.where(empty, 0, numpy.arange(n_windows)))
+        linear = linear[filled]
+        linear[linear == numpy.iinfo(numpy.int64).max] = 0
+
+        parts.append(struct.pack('<i', n_windows))
+        parts.append(linear.astype('<u8').tostring())
+
+        return ''.join(parts)
+
+    def write(self, index_file):
+
+        """
+        writes the bgzip compressed tabix index
+        :param index_file: str
+        :return: str
+        """
+
+        names = ''.join([x + '\0' for x in self.contigs])
+        header = struct.pack('<4s8i', 'TBI\1', len(self.contigs), TBX_VCF, 1, 2, 0, ord('#'), 0, len(names))
+        data = header + names + ''.join([self.contig_index(x) for x in self.contigs])
+
+        with open(index_file, 'wb') as out:
+            writer = BGZFWriter(out)
+            writer.write(data)
+            writer.close()
+
+        return index_file
+
+
+def add_info_lines(header_lines, info_lines):
+
+    """
+    adds INFO lines to a vcf header, ahead of the contig lines
+    :param header_lines: list
+    :param info_lines: list
+    :return: list
+    """
+
+    new_header = []
+    previous_line = ''
+    for line in header_lines:
+        if line.startswith('##contig') and previous_line.startswith('##INFO'):
+            new_header += [x + '\n' for x in info_lines]
+        previous_line = line
+        new_header.append(line)
+
+    return new_header
+
+
+def vcf_record_span(line):
+
+    """
+    returns the 0-based start and end of a vcf line as tabix sees them, the end is taken from
+    the INFO END key if present and the length of the ref allele otherwise
+    :param line: str
+    :return: int, int
+    """
+
+    fields = line.split('\t', 8)
+    beg = int(fields[1]) - 1
+    end = beg + len(fields[3])
+    if 'END=' in fields[7]:
+        for entry in fields[7].split(';'):
+            if entry.startswith('END='):
+                end = int(entry[4:])
+
+    return beg, end
+
+
+def open_vcf(vcf_file):
+
+    """
+    opens a plain text or gzipped vcf for reading
+    :param vcf_file: str
+    :return: file
+    """
+
+    if vcf_file.endswith('.gz'):
+        return gzip.open(vcf_file)
+    else:
+        return open(vcf_file)
+
+
+def write_vcf(lines, out_vcf):
+
+    """
+    writes vcf lines to a plain text file, or if the output name ends .gz to a bgzf file with its
+    tabix index built from the record offsets as they are written, records must be sorted by contig
+    :param lines: iterable
+    :param out_vcf: str
+    :return: int
+    """
+
+    n_records = 0
+
+    if not out_vcf.endswith('.gz'):
+        with open(out_vcf, 'w') as out_file:
+            for line in lines:
+                out_file.write(line)
+                n_records += not line.startswith('#')
+
+        return n_records
+
+    index = TabixIndexBuilder()
+    with open(out_vcf, 'wb') as out_file:
+        writer = BGZFWriter(out_file)
+        contig = None
+        entries = []
+        for line in lines:
+            start_offset = writer.tell()
+            writer.write(line)
+            if line.startswith('#'):
+                continue
+            n_records += 1
+
+            # records are added to the index a contig at a time
+            chromo = line[:line.index('\t')]
+            if chromo != contig:
+                if len(entries):
+                    index.add(contig, *numpy.array(entries, dtype=numpy.int64).T)
+                contig = chromo
+                entries = []
+            entries.append(vcf_record_span(line) + (start_offset, writer.tell()))
+
+        if len(entries):
+            index.add(contig, *numpy.array(entries, dtype=numpy.int64).T)
+        writer.close()
+    index.write(out_vcf + '.tbi')
+
+    return n_records
@@ -2,8 +2,182 @@
 
 from __future__ import print_function
 import argparse
-import gzip
-import sys
+import bisect
+from gff_index import gff_regions
+
+REGIONS = ['CDS_frameshift', 'CDS_non_frameshift', 'intron', 'intergenic']
+
+
+def region_index(gff_file, gene_proxy=False, chr_list=None):
+
+    """
+    reads the merged CDS, intron and gene intervals of each chromosome in one pass of the gff, as lists
+    for bisection, all features merged stand in for genes if gene_proxy is set
+    :param gff_file: str
+    :param gene_proxy: bool
+    :param chr_list: list
+    :return: dict
+    """
+
+    gene_feature = 'all_feat' if gene_proxy else 'gene'
+    index = {}
+    for chromo, regions in gff_regions(gff_file, chr_list).items():
+        index[chromo] = {x: (regions[y][0].tolist(), regions[y][1].tolist())
+                         for x, y in [('CDS', 'CDS'), ('intron', 'intron'), ('gene', gene_feature)]}
+
+    return index
+
+
+def in_merged(intervals, position):
+
+    """
+    checks if a 0-based position falls in a set of sorted, merged half open intervals
+    :param intervals: tuple
+    :param position: int
+    :return: bool
+    """
+
+    starts, ends = intervals
+    i = bisect.bisect_right(starts, position) - 1
+
+    return i >= 0 and position < ends[i]
+
+
+def variant_region(chr_regions, position, ref, alt):
+
+    """
+    returns the region of a variant from the features at its first base, None if it falls in
+    more than one or none of CDS, intron and intergenic
+    :param chr_regions: dict
+    :param position: int
+    :param ref: str
+    :param alt: str
+    :return: str
+    """
+
+    if chr_regions is None:
+        return 'intergenic'
+
+    in_cds = in_merged(chr_regions['CDS'], position)
+    in_intron = in_merged(chr_regions['intron'], position)
+    in_intergenic = not in_merged(chr_regions['gene'], position)
+
+    if in_cds + in_intron + in_intergenic != 1:
+        return None
+    elif in_cds:
+        if abs(len(ref) - len(alt)) % 3 == 0:
+            return 'CDS_non_frameshift'
+        else:
+            return 'CDS_frameshift'
+    elif in_intron:
+        return 'intron'
+    else:
+        return 'intergenic'
+
+
+def region_summary(counts):
+
+    """
+    returns the summary table of the region counters
+    :param counts: dict
+    :return: str
+    """
+
+    all_variants = counts['all']
+
+    return ('\n'
+            '|Category          | Number INDELs   |\n'
+            '|:-----------------|:---------------:|\n'
+            '|All               | ' + str(all_variants) + ' |\n'
+            '|CDS_frameshift    | ' + str(counts['CDS_frameshift']) + ' |\n'
+            '|CDS_non_frameshift| ' + str(counts['CDS_non_frameshift']) + ' |\n'
+            '|Intron            | ' + str(counts['intron']) + ' |\n'
+            '|Intergenic        | ' + str(counts['intergenic']) + ' |\n'
+            '|Not annotated     | ' + str(all_variants - sum([counts[x] for x in REGIONS])) + ' |')
+
+
+class RegionAnnotator(object):
+
+    """
+    ANNO annotation of the genomic region of each record, for annotate_vcf.py
+    """
+
+    name = 'ANNO'
+    suffix = '.annotated'
+    info_lines = ['##INFO=<ID=ANNO,Number=1,Type=String,Description="Annotation of genomic region">']
+
+    def __init__(self, gff_file, gene_proxy=False):
+
+        """
+        :param gff_file: str
+        :param gene_proxy: bool
+        """
+
+        self.region_coords = region_index(gff_file, gene_proxy)
+        self.counts = dict.fromkeys(['all'] + REGIONS, 0)
+
+    def annotate(self, fields):
+
+        """
+        adds the region to the INFO of a split record, returns False if the record is to be dropped
+        :param fields: list
+        :return: bool
+        """
+
+        self.counts['all'] += 1
+        region = variant_region(self.region_coords.get(fields[0]), int(fields[1]) - 1, fields[3], fields[4])
+        if region is not None:
+            self.counts[region] += 1
+            fields[7] += ';ANNO=' + region
+
+        return True
+
+    def summary(self):
+        return region_summary(self.counts)
+
+
+def annotate_vcf(vcf_file, region_coords, out_vcf, chromo=None):
+
+    """
+    annotates the region of every record in one pass of a vcf, or of the records of one chromosome,
+    returning the number of records in each region
+    :param vcf_file: str
+    :param region_coords: dict
+    :param out_vcf: str
+    :param chromo: str
+    :return: dict
+    """
+
+    counts = dict.fromkeys(['all'] + REGIONS, 0)
+    previous_line = ''
+    with open(out_vcf, 'w') as annotated_vcf:
+        for line in open(vcf_file):
+            if line.startswith('#'):
+                if line.startswith('##contig') and previous_line.startswith('##INFO'):
+                    new_info = '##INFO=<ID=ANNO,Number=1,Type=String,Description="Annotation of genomic region">\n'
+                    annotated_vcf.write(new_info)
+                previous_line = line
+                annotated_vcf.write(line)
+                continue
+
+            split_line = line.split('\t')
+            if chromo is not None and split_line[0] != chromo:
+                continue
+
+            counts['all'] += 1
+            region = variant_region(region_coords.get(split_line[0]), int(split_line[1]) - 1,
+                                    split_line[3], split_line[4])
+
+            # write newly annotated line
+            if region is not None:
+                counts[region] += 1
+                anno_line = ('\t'.join(split_line[0:7]) + '\t' + split_line[7] +
+                             ';ANNO=' + region + '\t' + '\t'.join(split_line[8:]))
+                annotated_vcf.write(anno_line)
+            else:
+                annotated_vcf.write(line)
+
+    return counts
 
 
 def main():
@@ -13,7 +187,8 @@ def main():
     parser.add_argument('-gff', help='GFF file to read annotations from, note squence names must match VCF',
                         required=True)
     parser.add_argument('-vcf', help='VCF file to annotate variants in', required=True)
-    parser.add_argument('-chr', help='Chromosome to annotate, must be consistent with GFF and VCF', required=True)
+    parser.add_argument('-chr', help='Chromosome to annotate, must be consistent with GFF and VCF, '
+                                     'if not specified all chromosomes are annotated in one pass', default=None)
     parser.add_argument('--feat_merge_gene_proxy', help='If specified will merge all features to get gene coords,'
                                                         'only valid if only gene features annotated in gff',
                         action='store_true', default=False)
@@ -23,122 +198,20 @@ def main():
     gff = args.gff
     chromo = args.chr
     vcf_file = args.vcf
-    out_vcf = vcf_file.replace('.vcf', '.annotated.' + chromo + '.vcf')
+    if chromo is None:
+        out_vcf = vcf_file.replace('.vcf', '.annotated.vcf')
+    else:
+        out_vcf = vcf_file.replace('.vcf', '.annotated.' + chromo + '.vcf')
     gene_prox = args.feat_merge_gene_proxy
 
-    # make coord sets
-    introns = []
-    cds = []
-    genes = []
-    all_feat = []
-    for line in gzip.open(gff):
-        line = line.split('\t')
-        if line[0] == chromo:
-            gff_chromo, feature, feat_start, feat_end = line[0], line[2], int(line[3]), int(line[4])
-
-            if chromo == gff_chromo:
-                all_feat += range(feat_start-1, feat_end)
-                if feature == 'gene':
-                    genes += range(feat_start-1, feat_end)
-                elif feature == 'intron':
-                    introns += range(feat_start-1, feat_end)
-                elif feature == 'CDS':
-                    cds += range(feat_start-1, feat_end)
-                else:
-                    continue
-
-    introns = set(introns)
-    cds = set(cds)
-    genes = set(genes)
-    all_feat = set(all_feat)
-
-    # annotation counters
-    all_variants = 0
-    cds_frame = 0
-    cds_nonframe = 0
-    inter = 0
-    intron_count = 0
+    # merged coords of each feature type
+    chr_list = None if chromo is None else [chromo]
+    region_coords = region_index(gff, gene_prox, chr_list)
 
     # loop through vcf and identify category for each variant
-    previous_line = ''
-    with open(out_vcf, 'w') as annotated_vcf:
-        for line in open(vcf_file):
-            if line.startswith('#'):
-                if line.startswith('##contig') and previous_line.startswith('##INFO'):
-                    new_info = '##INFO=<ID=ANNO,Number=1,Type=String,Description="Annotation of genomic region">\n'
-                    annotated_vcf.write(new_info)
-                previous_line = line
-                annotated_vcf.write(line)
-            elif line.split('\t')[0] == chromo:
-                all_variants += 1
-                split_line = line.split('\t')
-                chromo, start, end = split_line[0], int(split_line[1])-1, int(split_line[1]) + len(split_line[3])
-
-                in_cds = False
-                for x in range(start, end):
-                    if x not in cds:
-                        break
-                    else:
-                        in_cds = True
-
-                in_intergenic = False
-                if gene_prox is False:
-                    coords = genes
-                else:
-                    coords = all_feat
-                for x in range(start, end):
-                    if x in coords:
-                        break
-                    else:
-                        in_intergenic = True
-
-                in_intron = False
-                for x in range(start, end):
-                    if x not in introns:
-                        break
-                    else:
-                        in_intron = True
-
-                region_true = [x for x in [in_cds, in_intergenic, in_intron] if x is True]
-                number_true = len(region_true)
-
-                if number_true == 1:
-                    if in_cds is True:
-                        variant_length = abs(len(split_line[3]) - len(split_line[4]))
-                        if variant_length % 3.0 == 0.0:
-                            region = 'CDS_non_frameshift'
-                            cds_nonframe += 1
-                        else:
-                            region = 'CDS_frameshift'
-                            cds_frame += 1
-                    elif in_intron is True:
-                        intron_count += 1
-                        region = 'intron'
-                    elif in_intergenic is True:
-                        inter += 1
-                        region = 'intergenic'
-                    else:
-                        print('BUGGY BUGGY BUGGY!')
-                        sys.exit('An impossible error occured!')
-
-                    # write newly annotated line
-                    anno_line = ('\t'.join(split_line[0:7]) + '\t' + split_line[7] +
-                                 ';ANNO=' + region + '\t' + '\t'.join(split_line[8:]))
-                    annotated_vcf.write(anno_line)
-                else:
-                    annotated_vcf.write(line)
-            else:
-                continue
+    counts = annotate_vcf(vcf_file, region_coords, out_vcf, chromo)
 
-    print('\n'
-          '|Category          | Number INDELs   |\n'
-          '|:-----------------|:---------------:|\n'
-          '|All               | ' + str(all_variants) + ' |\n'
-          '|CDS_frameshift    | ' + str(cds_frame) + ' |\n'
-          '|CDS_non_frameshift| ' + str(cds_nonframe) + ' |\n'
-          '|Intron            | ' + str(intron_count) + ' |\n'
-          '|Intergenic        | ' + str(inter) + ' |\n'
-          '|Not annotated     | ' + str(all_variants - (cds_frame + cds_nonframe + intron_count + inter)) + ' |')
+    print(region_summary(counts))
 
 if __name__ == '__main__':
     main()
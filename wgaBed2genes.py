@@ -5,7 +5,8 @@ import argparse
 from qsub import *
 import sys
 import gzip
-import pysam
+import numpy
+from wga_index import WGAIndex
 
 
 def get_complement(dna_seq):
@@ -58,7 +59,8 @@ def main():
                                                  'alignments for each sequence from a whole genome alignment bed file '
                                                  'and writes each alignment to a separate phylip file.')
     parser.add_argument('-wga_bed',
-                        help='Whole genome alignment bed file to extract CDS alignments from',
+                        help='Tabix indexed whole genome alignment bed file to extract CDS alignments from, '
+                             'compiled to an index next to the bed on first use',
                         required=True)
     parser.add_argument('-cds_fa',
                         help='Fasta file of CDS transcript sequences',
@@ -84,7 +86,7 @@ def main():
 
     # variables
     fa = args.cds_fa
-    wga = pysam.TabixFile(args.wga_bed)
+    wga = WGAIndex(args.wga_bed)
     out_dir = args.out_dir
     if not os.path.isdir(out_dir):
         os.makedirs(out_dir)
@@ -111,23 +113,26 @@ def main():
 
                 align_dict = {}
 
+                # first alignment row of every position of the transcript
+                contig = wga[chromo]
+                coord_rows = contig.first_rows(numpy.array(coords, dtype=numpy.int64) - 1)
+
                 # extract positions from alignment
-                for codon in [coords[i: i + 3] for i in range(0, len(coords), 3)]:
+                for codon_rows in [coord_rows[i: i + 3] for i in range(0, len(coords), 3)]:
                     codon_dict = {}
-                    for pos in codon:
-                        align_pos = list(wga.fetch(chromo, pos - 1, pos, parser=pysam.asTuple()))
+                    for row in codon_rows:
 
-                        # get align data in form [('dmel', 'T'), ('dsim', '?'), ('dyak', 'T')]
+                        # skip positions not in the alignment
+                        if row == -1:
+                            continue
 
+                        # get align data in form [('dmel', 'T'), ('dsim', '?'), ('dyak', 'T')]
                         try:
-                            spp_bases = zip(align_pos[0][4].split(','), align_pos[0][7].split(','))
+                            spp_bases = zip(contig.species(row), contig.sequences(row, upper=False))
                             for spp in spp_bases:
                                 if spp[0] not in codon_dict.keys():
                                     codon_dict[spp[0]] = ''
-                                if len(align_pos) == 0:
-                                    codon_dict[spp[0]] += 'N'
-                                else:
-                                    codon_dict[spp[0]] += spp[1][0]
+                                codon_dict[spp[0]] += spp[1][0]
                         except IndexError:
                             continue
 
@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import argparse
+import os
+import numpy
+import pysam
+from file_cache import file_checksum
+from depth_cache import save_array
+
+# per row flags
+GAP = 1
+MISSING = 2
+MULTI = 4
+
+READ_ROWS = 1000000
+
+raw_lookup = numpy.arange(256, dtype=numpy.uint8)
+upper_lookup = numpy.arange(256, dtype=numpy.uint8)
+upper_lookup[ord('a'): ord('z') + 1] -= 32
+
+
+def index_path(wga_bed, cache_dir=None):
+
+    """
+    returns the compiled index directory of a whole genome alignment bed, named by its checksum so
+    an edited alignment never reads a stale index
+    :param wga_bed: str
+    :param cache_dir: str
+    :return: str
+    """
+
+    if cache_dir is None:
+        cache_dir = os.path.dirname(os.path.abspath(wga_bed))
+
+    return os.path.join(cache_dir, '{}.{}.wga_index'.format(os.path.basename(wga_bed), file_checksum(wga_bed)))
+
+
+def compile_rows(rows, species_ids):
+
+    """
+    converts a list of alignment rows, split on tabs, to arrays of the row coordinates, the first base of each
+    species, row flags and species set, with the full sequence text of rows where any species has other than
+    one base
+    :param rows: list
+    :param species_ids: dict
+    :return: dict
+    """
+
+    n_rows = len(rows)
+    starts = numpy.array([int(x[1]) for x in rows], dtype=numpy.int64)
+    ends = numpy.array([int(x[2]) for x in rows], dtype=numpy.int64)
+
+    species = numpy.empty(n_rows, dtype=numpy.uint16)
+    n_species = numpy.empty(n_rows, dtype=numpy.int64)
+    for i, row in enumerate(rows):
+        if row[4] not in species_ids:
+            species_ids[row[4]] = len(species_ids)
+        species[i] = species_ids[row[4]]
+        n_species[i] = row[4].count(',') + 1
+
+    # sequence column of every row as one byte array with row offsets
+    sequences = [x[7] for x in rows]
+    lengths = numpy.array([len(x) for x in sequences], dtype=numpy.int64)
+    offsets = numpy.zeros(n_rows + 1, dtype=numpy.int64)
+    numpy.cumsum(lengths, out=offsets[1:])
+    text = numpy.frombuffer(''.join(sequences).encode(), dtype=numpy.uint8)
+
+    flags = numpy.zeros(n_rows, dtype=numpy.uint8)
+    if len(text):
+        for flag, char in [(GAP, '-'), (MISSING, '?')]:
+            running = numpy.zeros(len(text) + 1, dtype=numpy.int64)
+            numpy.cumsum(text == ord(char), out=running[1:])
+            flags[running[offsets[1:]] > running[offsets[:-1]]] |= flag
+
+    # rows holding one base per species sit at fixed offsets, every other row keeps its full text
+    single = lengths == 2 * n_species - 1
+    width = int(n_species.max()) if n_rows else 0
+    bases = numpy.zeros((n_rows, width), dtype=numpy.uint8)
+    columns = numpy.arange(width, dtype=numpy.int64)
+    for n in numpy.unique(n_species[single]):
+        of_size = numpy.flatnonzero(single & (n_species == n))
+        commas = text[offsets[of_size][:, None] + 2 * columns[:n - 1] + 1] == ord(',')
+        single[of_size[~commas.all(axis=1)]] = False
+        of_size = of_size[commas.all(axis=1)]
+        bases[of_size[:, None], columns[:n]] = text[offsets[of_size][:, None] + 2 * columns[:n]]
+    flags[~single] |= MULTI
+
+    multi = numpy.flatnonzero(~single)
+    for i in multi:
+        first_bases = [x[:1] for x in sequences[i].split(',')]
+        bases[i, :len(first_bases)] = [ord(x) if x else 0 for x in first_bases]
+
+    multi_lengths = lengths[multi]
+    multi_text = numpy.concatenate([text[offsets[i]: offsets[i + 1]] for i in multi] +
+                                   [numpy.array([], dtype=numpy.uint8)])
+
+    return {'starts': starts, 'ends': ends, 'species': species, 'flags': flags, 'bases': bases,
+            'multi_rows': multi, 'multi_lengths': multi_lengths, 'multi_text': multi_text}
+
+
+def build_contig_index(wga_bed, chromo, index_dir, read_rows=READ_ROWS):
+
+    """
+    compiles the alignment rows of one contig to memory mapped arrays, read a block of rows at a time
+    :param wga_bed: str
+    :param chromo: str
+    :param index_dir: str
+    :param read_rows: int
+    :return: int
+    """
+
+    if not os.path.isdir(index_dir):
+        try:
+            os.makedirs(index_dir)
+        except OSError:
+            if not os.path.isdir(index_dir):
+                raise
+
+    species_ids = {}
+    blocks = []
+    rows = []
+    for line in pysam.TabixFile(wga_bed).fetch(chromo):
+        rows.append(line.split('\t'))
+        if len(rows) == read_rows:
+            blocks.append(compile_rows(rows, species_ids))
+            rows = []
+    blocks.append(compile_rows(rows, species_ids))
+
+    # offsets of multi rows are taken from the whole contig, so row indexes are shifted block by block
+    first_row = numpy.cumsum([0] + [len(x['starts']) for x in blocks])
+    width = max(x['bases'].shape[1] for x in blocks)
+    arrays = {name: numpy.concatenate([x[name] for x in blocks])
+              for name in ['starts', 'ends', 'species', 'flags', 'multi_lengths', 'multi_text']}
+    arrays['bases'] = numpy.concatenate([numpy.pad(x['bases'], ((0, 0), (0, width - x['bases'].shape[1])),
+                                                   'constant') for x in blocks])
+    arrays['multi_rows'] = numpy.concatenate([x['multi_rows'] + y for x, y in zip(blocks, first_row)])
+    arrays['multi_offsets'] = numpy.zeros(len(arrays['multi_rows']) + 1, dtype=numpy.int64)
+    numpy.cumsum(arrays.pop('multi_lengths'), out=arrays['multi_offsets'][1:])
+
+    # rows are sorted by start, the running maximum of their ends gives the first row overlapping any position
+    arrays['max_ends'] = numpy.maximum.accumulate(arrays['ends'])
+
+    for name, array in arrays.items():
+        save_array(os.path.join(index_dir, '{}.{}.npy'.format(chromo, name)), array)
+    with open(os.path.join(index_dir, chromo + '.species.txt'), 'w') as species_out:
+        for species, species_id in sorted(species_ids.items(), key=lambda x: x[1]):
+            print(species, file=species_out)
+
+    # written last, marks the contig as complete
+    with open(os.path.join(index_dir, chromo + '.done'), 'w') as done:
+        print(len(arrays['starts']), file=done)
+
+    return len(arrays['starts'])
+
+
+class ContigAlignment(object):
+
+    """
+    memory mapped alignment rows of one contig of a compiled whole genome alignment
+    """
+
+    def __init__(self, index_dir, chromo):
+
+        """
+        :param index_dir: str
+        :param chromo: str
+        """
+
+        self.contig = chromo
+        self.starts, self.ends, self.max_ends, self.species_ids, self.flags, self.bases, \
+            self.multi_rows, self.multi_offsets, self.multi_text = [
+                numpy.load(os.path.join(index_dir, '{}.{}.npy'.format(chromo, x)), mmap_mode='r')
+                for x in ['starts', 'ends', 'max_ends', 'species', 'flags', 'bases',
+                          'multi_rows', 'multi_offsets', 'multi_text']]
+        self.species_sets = [x.rstrip('\n').split(',')
+                             for x in open(os.path.join(index_dir, chromo + '.species.txt'))]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def span(self, start, end):
+
+        """
+        returns the slice of rows from the first overlapping the 0-based half open region start-end to
+        the last starting before end, rows inside the slice may end before start if an earlier row spans it
+        :param start: int
+        :param end: int
+        :return: int, int
+        """
+
+        return (int(numpy.searchsorted(self.max_ends, start, side='right')),
+                int(numpy.searchsorted(self.starts, end, side='left')))
+
+    def overlapping(self, start, end):
+
+        """
+        returns the indexes of the rows overlapping the 0-based half open region start-end, in file order
+        :param start: int
+        :param end: int
+        :return: numpy.array
+        """
+
+        low, high = self.span(start, end)
+        rows = numpy.arange(low, high)
+        if high - low > 1:
+            rows = rows[self.ends[low:high] > start]
+
+        return rows
+
+    def columns(self, start, end):
+
+        """
+        returns views of the start, end, flags and first base of each species of the rows spanning
+        the 0-based half open region start-end
+        :param start: int
+        :param end: int
+        :return: numpy.array, numpy.array, numpy.array, numpy.array
+        """
+
+        low, high = self.span(start, end)
+
+        return self.starts[low:high], self.ends[low:high], self.flags[low:high], self.bases[low:high]
+
+    def first_rows(self, positions):
+
+        """
+        returns the first row overlapping each 0-based position, or -1 where no row does
+        :param positions: numpy.array
+        :return: numpy.array
+        """
+
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        rows = numpy.searchsorted(self.max_ends, positions, side='right')
+        found = rows < len(self.starts)
+        found[found] = self.starts[rows[found]] <= positions[found]
+
+        return numpy.where(found, rows, -1)
+
+    def sequences(self, row, upper=True):
+
+        """
+        returns the aligned sequence of each species in a row
+        :param row: int
+        :param upper: bool
+        :return: list
+        """
+
+        lookup = upper_lookup if upper else raw_lookup
+
+        if self.flags[row] & MULTI:
+            i = numpy.searchsorted(self.multi_rows, row)
+            text = lookup[self.multi_text[self.multi_offsets[i]: self.multi_offsets[i + 1]]].tostring().decode()
+            return text.split(',')
+
+        n_species = len(self.species_sets[self.species_ids[row]])
+
+        return list(lookup[self.bases[row, :n_species]].tostring().decode())
+
+    def species(self, row):
+
+        """
+        returns the species names of a row
+        :param row: int
+        :return: list
+        """
+
+        return self.species_sets[self.species_ids[row]]
+
+
+class WGAIndex(object):
+
+    """
+    compiled whole genome alignment, each contig is compiled from the tabix indexed bed on first use
+    """
+
+    def __init__(self, wga_bed, cache_dir=None):
+
+        """
+        :param wga_bed: str
+        :param cache_dir: str
+        """
+
+        self.wga_bed = wga_bed
+        self.index_dir = index_path(wga_bed, cache_dir)
+        self.contigs = set(pysam.TabixFile(wga_bed).contigs)
+        self.loaded = {}
+
+    def __contains__(self, chromo):
+        return chromo in self.contigs
+
+    def has_contig(self, chromo):
+
+        """
+        checks if a contig has been compiled
+        :param chromo: str
+        :return: bool
+        """
+
+        return os.path.isfile(os.path.join(self.index_dir, chromo + '.done'))
+
+    def build(self, chromo):
+
+        """
+        compiles one contig
+        :param chromo: str
+        :return: int
+        """
+
+        return build_contig_index(self.wga_bed, chromo, self.index_dir)
+
+    def __getitem__(self, chromo):
+
+        """
+        returns the compiled alignment of a contig, compiling it if needed, raises ValueError
+        for contigs missing from the alignment as tabix does
+        :param chromo: str
+        :return: ContigAlignment
+        """
+
+        if chromo not in self.loaded:
+            if chromo not in self.contigs:
+                raise ValueError('could not create iterator for region {}'.format(chromo))
+            if not self.has_contig(chromo):
+                self.build(chromo)
+            self.loaded[chromo] = ContigAlignment(self.index_dir, chromo)
+
+        return self.loaded[chromo]
+
+    def alignment(self, chromo, start, end):
+
+        """
+        returns the upper case aligned sequence of each species for every row overlapping the
+        0-based half open region start-end, in file order
+        :param chromo: str
+        :param start: int
+        :param end: int
+        :return: list
+        """
+
+        contig = self[chromo]
+
+        return [contig.sequences(x) for x in contig.overlapping(start, end)]
+
+
+def main():
+
+    # arguments
+    parser = argparse.ArgumentParser(description='Compiles a tabix indexed whole genome alignment bed to per contig '
+                                                 'memory mapped arrays, used in place of the bed by the '
+                                                 'polarisation and alignment extraction scripts')
+    parser.add_argument('-wga_bed', help='Tabix indexed whole genome alignment bed file', required=True)
+    parser.add_argument('-chr', help='Contig to compile, can be specified more than once, defaults to all contigs',
+                        action='append', default=[])
+    parser.add_argument('-cache_dir', help='Directory to hold the index, defaults to the bed directory',
+                        default=None)
+    args = parser.parse_args()
+
+    wga = WGAIndex(args.wga_bed, args.cache_dir)
+    chromos = args.chr if len(args.chr) else sorted(wga.contigs)
+    for chromo in chromos:
+        print(chromo, wga.build(chromo), sep='\t')
+    print(wga.index_dir)
+
+
+if __name__ == '__main__':
+    main()